@@ -1,60 +1,146 @@
+import click
 from flask import Flask
 from flask_bootstrap import Bootstrap
 from config import Config
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
-from flask_avatars import Avatars
+from jinja2 import FileSystemBytecodeCache
 import logging
-from logging.handlers import SMTPHandler
-from flask_mail import Mail
+import os
 from flask_moment import Moment
-from flask_uploads import configure_uploads, IMAGES, UploadSet
+from flask_uploads import configure_uploads, IMAGES
+from app.database import RoutingSQLAlchemy
+from app.storage import ContentAddressedUploadSet
+from app.faststart import faststart
+from app.presence import LastSeenBuffer
+from app.identity import UserCache
+from app.typeahead import UsernameIndex
+from app.derivatives import ImageDerivatives
+from app.reaper import Reaper
+from app.resumable import ResumableUploads
+from app.search import SearchIndex
+from app.timeline import Timeline
+from app.trending import Trending
+from app.fragments import FragmentCache
+from app.outbox import Outbox, OutboxHandler
+from app.metrics import Metrics
+from app.httpcache import Compression, ETags
+from app.events import EventHub
 
 
+# created unbound and set up by create_app(); Flask-Mail is loaded by the outbox when
+# it first sends, and Flask-Migrate, like the commands, only by the flask command
+metrics = Metrics()
 
-app = Flask(__name__)
-app.config.from_object(Config)
+images = ContentAddressedUploadSet('images', IMAGES, referrers=('photo.filename', 'user.profile_picture'))
+clips = ContentAddressedUploadSet('videos', extensions=('mp4',), referrers=('video.filename',), process=faststart)
+derivatives = ImageDerivatives()
+reaper = Reaper()
+fragments = FragmentCache()
 
-images = UploadSet('images', IMAGES)
-clips = UploadSet('videos', extensions=('mp4'))
-configure_uploads(app,(images,clips))
+bootstrap = Bootstrap()
 
+db = RoutingSQLAlchemy()
 
-bootstrap = Bootstrap(app)
+search_index = SearchIndex()
 
-db = SQLAlchemy(app)
+timeline = Timeline()
 
-migrate = Migrate(app,db, render_as_batch=True)
+trending = Trending()
 
-login = LoginManager(app)
-login.login_view='login' #points to the url_for('login') to handle the view
+resumable = ResumableUploads()
 
-avatars=Avatars(app)
+last_seen = LastSeenBuffer()
 
-mail = Mail(app)
+user_cache = UserCache()
 
-moment = Moment(app)
+usernames = UsernameIndex()
 
-if not app.debug:
-    if app.config['MAIL_SERVER']:
-        auth = None
-        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
-            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        secure = None
-        if app.config['MAIL_USE_TLS']:
-            secure = ()
-        mail_handler = SMTPHandler(
-            mailhost = (app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-            fromaddr = 'no-reply@' + app.config['MAIL_SERVER'],
-            toaddrs = app.config['ADMINS'], subject = "HoVuXomMoi Failure",
-            credentials=auth,
-            secure=secure
+login = LoginManager()
+login.login_view='main.login' #points to the url_for('main.login') to handle the view
 
-        )
-        mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
+outbox = Outbox()
 
+moment = Moment()
 
-from app import routes, models, errors
+compression = Compression()
 
+etags = ETags()
+
+events = EventHub()
+
+
+def from_command_line():
+    # the flask command loads the app inside its click context; a WSGI server does not
+    return click.get_current_context(silent=True) is not None
+
+
+def register_commands(app):
+    # what only the flask command needs, kept out of the web workers' start
+    from flask_migrate import Migrate
+    Migrate(app, db, render_as_batch=True)
+
+    from app.cli import bp as cli_bp
+    app.register_blueprint(cli_bp)
+
+    from app.bench import bp as bench_bp
+    app.register_blueprint(bench_bp)
+
+
+def create_app(config_class=Config):
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    if app.config.get('JINJA_BYTECODE_CACHE_DIR'):
+        # compiled templates are shared by every process on the host, and survive restarts
+        os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+        app.jinja_options = dict(app.jinja_options,
+                                 bytecode_cache=FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR']))
+
+    metrics.init_app(app)
+
+    configure_uploads(app,(images,clips))
+    derivatives.init_app(app, images)
+    reaper.init_app(app, derivatives)
+    fragments.init_app(app, derivatives)
+
+    bootstrap.init_app(app)
+    db.init_app(app)
+    search_index.init_app(app, db)
+    timeline.init_app(app, db)
+    trending.init_app(app, db)
+    resumable.init_app(app, clips, db)
+    last_seen.init_app(app)
+    user_cache.init_app(app, db)
+    usernames.init_app(app, db)
+    login.init_app(app)
+    outbox.init_app(app)
+    moment.init_app(app)
+    compression.init_app(app)
+    etags.init_app(app)
+    events.init_app(app)
+
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+
+    from app.routes import bp as main_bp
+    app.register_blueprint(main_bp)
+
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp)
+
+    if from_command_line():
+        register_commands(app)
+
+    if not app.debug:
+        if app.config['MAIL_SERVER']:
+            # queued through the outbox, so logging an error never waits on SMTP
+            mail_handler = OutboxHandler(
+                outbox,
+                fromaddr = 'no-reply@' + app.config['MAIL_SERVER'],
+                toaddrs = app.config['ADMINS'], subject = "HoVuXomMoi Failure"
+            )
+            mail_handler.setLevel(logging.ERROR)
+            app.logger.addHandler(mail_handler)
+
+    return app
+
+from app import models
@@ -0,0 +1,261 @@
+from functools import wraps
+from flask import Blueprint, current_app, request, url_for, jsonify
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy.orm import selectinload
+from app import db, derivatives, fragments, timeline, usernames
+from app.models import Post, Photo, Video, Comment, TimelineEntry
+from app.pagination import paginate_keyset
+from app.routes import csrf_header_required, publish_comment, publish_counts
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# the pages' scripts send it back in X-CSRFToken
+bp.add_app_template_global(generate_csrf, 'csrf_token')
+
+
+class APIError(Exception):
+    """An API request refused with `status`; answered as JSON by app.errors."""
+
+    def __init__(self, status, message):
+        super(APIError, self).__init__(message)
+        self.status = status
+
+
+# collection in the URL: model, query for its feed, singular name
+COLLECTIONS = {
+    'posts': (Post, lambda: Post.query.filter(Post.is_discussion == 1), 'post'),
+    'photos': (Photo, lambda: Photo.query.filter(Photo.is_public == 1), 'photo'),
+    'videos': (Video, lambda: Video.query, 'video'),
+}
+
+
+def _timestamp(value):
+    return value.isoformat() + 'Z' if value else None
+
+
+def _editable(comment, endpoint):
+    return url_for(endpoint, id=comment.id) if comment.user_id == current_user.id else None
+
+
+# type: field: value of the field for one row; ctx is the Serializer, for relations and likes
+FIELDS = {
+    'user': {
+        'id': lambda user, ctx: user.id,
+        'username': lambda user, ctx: user.username,
+        'avatar': lambda user, ctx: derivatives.src(user.profile_picture, 90),
+        'url': lambda user, ctx: url_for('main.profile', username=user.username),
+    },
+    'post': {
+        'id': lambda post, ctx: post.id,
+        'body': lambda post, ctx: post.body,
+        'timestamp': lambda post, ctx: _timestamp(post.timestamp),
+        'like_count': lambda post, ctx: post.like_count,
+        'comment_count': lambda post, ctx: post.comment_count,
+        'liked': lambda post, ctx: post.id in ctx.liked['post'],
+        'author': lambda post, ctx: ctx.render('user', post.author),
+        'url': lambda post, ctx: url_for('main.post', id=post.id),
+    },
+    'photo': {
+        'id': lambda photo, ctx: photo.id,
+        'title': lambda photo, ctx: photo.title,
+        'timestamp': lambda photo, ctx: _timestamp(photo.timestamp),
+        'like_count': lambda photo, ctx: photo.like_count,
+        'comment_count': lambda photo, ctx: photo.comment_count,
+        'liked': lambda photo, ctx: photo.id in ctx.liked['photo'],
+        'author': lambda photo, ctx: ctx.render('user', photo.post.author),
+        'image': lambda photo, ctx: derivatives.src(photo.filename, 600),
+        'original': lambda photo, ctx: url_for('static', filename='uploads/images/' + photo.filename),
+        'url': lambda photo, ctx: url_for('main.photo', id=photo.id),
+    },
+    'video': {
+        'id': lambda video, ctx: video.id,
+        'title': lambda video, ctx: video.title,
+        'timestamp': lambda video, ctx: _timestamp(video.timestamp),
+        'like_count': lambda video, ctx: video.like_count,
+        'comment_count': lambda video, ctx: video.comment_count,
+        'liked': lambda video, ctx: video.id in ctx.liked['video'],
+        'author': lambda video, ctx: ctx.render('user', video.post.author),
+        'src': lambda video, ctx: url_for('main.media_video', filename=video.filename),
+        'url': lambda video, ctx: url_for('main.video', id=video.id),
+    },
+    'comment': {
+        'id': lambda comment, ctx: comment.id,
+        'body': lambda comment, ctx: comment.body,
+        'timestamp': lambda comment, ctx: _timestamp(comment.timestamp),
+        'author': lambda comment, ctx: ctx.render('user', comment.author),
+        # only for the viewer's own comments
+        'edit_url': lambda comment, ctx: _editable(comment, 'main.edit_comment'),
+        'delete_url': lambda comment, ctx: _editable(comment, 'main.delete_comment'),
+    },
+}
+
+# type: relationships to eager load for its `author` field, one SELECT ... IN per page for each
+AUTHOR_PATHS = {
+    'post': ('author',),
+    'photo': ('post', 'author'),
+    'video': ('post', 'author'),
+    'comment': ('author',),
+}
+
+
+class Serializer(object):
+    """Turns rows into JSON objects holding the fields the request asked for.
+
+    ?fields[<type>]=a,b,c limits the objects of that type, nested ones
+    included, to those fields; every field is sent otherwise.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        for kind, fields in FIELDS.items():
+            wanted = request.args.get('fields[{}]'.format(kind))
+            if wanted is None:
+                self.fields[kind] = list(fields)
+                continue
+            self.fields[kind] = [name for name in wanted.split(',') if name]
+            unknown = set(self.fields[kind]) - set(fields)
+            if unknown:
+                raise APIError(400, 'Unknown {} fields: {}.'.format(kind, ', '.join(sorted(unknown))))
+        self.liked = {'post': frozenset(), 'photo': frozenset(), 'video': frozenset()}
+
+    def load(self, kind, query):
+        """`query` with the relations the fields of `kind` need loaded for a whole page at a time."""
+        if 'author' not in self.fields[kind]:
+            return query
+        path = AUTHOR_PATHS[kind]
+        option = selectinload(path[0])
+        for relation in path[1:]:
+            option = option.selectinload(relation)
+        return query.options(option)
+
+    def find_likes(self, kind, items):
+        if 'liked' in self.fields[kind]:
+            self.liked[kind] = getattr(current_user, 'liked_{}_ids'.format(kind))(items)
+
+    def render(self, kind, item, **extra):
+        data = {name: FIELDS[kind][name](item, self) for name in self.fields[kind]}
+        data.update(extra)
+        return data
+
+
+def api_login_required(f):
+    # like login_required and verified_required, but answering 401/403 instead of redirecting
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise APIError(401, 'Log in first.')
+        if current_user.verified != 1:
+            raise APIError(403, 'You are not a verified user yet.')
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def per_page():
+    try:
+        limit = int(request.args.get('limit', current_app.config['API_PER_PAGE']))
+    except ValueError:
+        raise APIError(400, 'limit must be a number.')
+    return min(max(limit, 1), current_app.config['API_MAX_PER_PAGE'])
+
+
+def page_response(page, data):
+    # cursors for the neighbouring pages, and links to them keeping the other arguments
+    args = {key: value for key, value in request.args.items() if key not in ('before', 'after')}
+    args.update(request.view_args)
+
+    def link(**cursor):
+        return url_for(request.endpoint, **dict(args, **cursor))
+
+    return jsonify(data=data, older=page.older, newer=page.newer, links={
+        'older': link(before=page.older) if page.older else None,
+        'newer': link(after=page.newer) if page.newer else None,
+    })
+
+
+def get_item(collection, id):
+    model = COLLECTIONS[collection][0]
+    item = model.query.get(id)
+    if item is None:
+        raise APIError(404, 'No such {}.'.format(COLLECTIONS[collection][2]))
+    return item
+
+
+@bp.route('/timeline')
+@api_login_required
+def api_timeline():
+    serializer = Serializer()
+    page = timeline.hydrate(paginate_keyset(TimelineEntry.query, (TimelineEntry.timestamp, TimelineEntry.id),
+                                            per_page()))
+    for kind in serializer.liked:
+        serializer.find_likes(kind, [item for k, item in page if k == kind])
+    return page_response(page, [serializer.render(kind, item, type=kind) for kind, item in page])
+
+
+@bp.route('/<any(posts, photos, videos):collection>')
+@api_login_required
+def api_feed(collection):
+    model, feed, kind = COLLECTIONS[collection]
+    serializer = Serializer()
+    page = paginate_keyset(serializer.load(kind, feed()), (model.timestamp, model.id), per_page())
+    serializer.find_likes(kind, page.items)
+    return page_response(page, [serializer.render(kind, item) for item in page])
+
+
+@bp.route('/<any(posts, photos, videos):collection>/<int:id>')
+@api_login_required
+def api_item(collection, id):
+    kind = COLLECTIONS[collection][2]
+    serializer = Serializer()
+    item = get_item(collection, id)
+    serializer.find_likes(kind, [item])
+    return jsonify(data=serializer.render(kind, item))
+
+
+@bp.route('/<any(posts, photos, videos):collection>/<int:id>/comments', methods=['GET', 'POST'])
+@api_login_required
+@csrf_header_required
+def api_comments(collection, id):
+    item = get_item(collection, id)
+    serializer = Serializer()
+    if request.method == 'POST':
+        body = ((request.get_json(silent=True) or {}).get('body') or '').strip()
+        if not 1 <= len(body) <= 1000:
+            raise APIError(400, 'A comment of 1 to 1000 characters is required.')
+        comment = current_user.add_comment(item, body)
+        fragments.invalidate(item)
+        db.session.commit()
+        publish_comment(comment)
+        return jsonify(data=serializer.render('comment', comment), comment_count=item.comment_count), 201
+    column = getattr(Comment, COLLECTIONS[collection][2] + '_id')
+    page = paginate_keyset(serializer.load('comment', Comment.query.filter(column == item.id)),
+                           (Comment.timestamp, Comment.id), per_page())
+    return page_response(page, [serializer.render('comment', comment) for comment in page])
+
+
+@bp.route('/<any(posts, photos, videos):collection>/<int:id>/like', methods=['POST', 'DELETE'])
+@api_login_required
+@csrf_header_required
+def api_like(collection, id):
+    kind = COLLECTIONS[collection][2]
+    item = get_item(collection, id)
+    action = 'like' if request.method == 'POST' else 'unlike'
+    getattr(current_user, '{}_{}'.format(action, kind))(item)
+    fragments.invalidate(item)
+    db.session.commit()
+    publish_counts(item)
+    return jsonify(liked=action == 'like', like_count=item.like_count)
+
+
+# typeahead: verified users whose name starts with ?prefix=, a leading @ allowed, most recently seen first
+@bp.route('/usernames')
+@api_login_required
+def api_usernames():
+    prefix = request.args.get('prefix', '').strip().lstrip('@')
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        raise APIError(400, 'limit must be a number.')
+    limit = min(max(limit, 1), current_app.config['TYPEAHEAD_SIZE'])
+    return jsonify(data=[{'id': id, 'username': username, 'url': url_for('main.profile', username=username)}
+                         for id, username in usernames.search(prefix, limit)])
@@ -0,0 +1,24 @@
+import os
+import resource
+from flask import Blueprint
+
+
+def rss_mb():
+    """Current resident set size of this process in MiB."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        # peak instead of current where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+bp = Blueprint('bench', __name__, cli_group=None)
+
+
+@bp.cli.group()
+def bench():
+    """Benchmarks and load tests."""
+
+
+from app.bench import media, mail, sqlite, load, plans, trending, typeahead
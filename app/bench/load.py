@@ -0,0 +1,162 @@
+import json
+import time
+import threading
+import click
+from flask import current_app, url_for
+from app import db, clips, trending
+from app.bench import bench, rss_mb
+from app.models import User, Post, Photo, Video, Comment
+from app.loadtest import (Seeder, LoadDriver, StatementCounter, TestClientSession, HTTPSession, SAMPLE_VIDEO, WORDS,
+                          write_sample_video)
+
+
+@bench.command()
+@click.option('--users', default=500)
+@click.option('--posts', default=10000, help='Discussion posts.')
+@click.option('--photos', default=2000)
+@click.option('--videos', default=200)
+@click.option('--comments', default=20000)
+@click.option('--likes', default=50000)
+@click.option('--seed', default=42, help='Random seed; the same seed gives the same data.')
+def seed(users, posts, photos, videos, comments, likes, seed):
+    """Fill the database with synthetic, skewed data for benchmarks.
+
+    Point DATABASE_URL at a scratch database first. Seeded users are named
+    bench<id> and log in with the password "bench".
+    """
+    started = time.time()
+    counts = Seeder(db, seed).run(users, posts, photos, videos, comments, likes)
+    trending.rebuild()
+    write_sample_video(clips.path(SAMPLE_VIDEO))
+    click.echo(json.dumps(dict(rows=counts, seconds=round(time.time() - started, 2)), indent=2))
+
+
+# the steps that write redirect once they have; a 200 is the form shown again, unsaved
+EXPECTED_STATUS = {'discussion_post': 302, 'post_comment': 302}
+
+
+def _sample(column, *criteria):
+    return [row[0] for row in db.session.query(column).filter(*criteria).order_by(db.func.random()).limit(1000)]
+
+
+def load_plan():
+    """The weighted request mix: every route except delete_*, logout and uploads."""
+    posts = _sample(Post.id, Post.is_discussion == 1)
+    photos, videos, comments = _sample(Photo.id), _sample(Video.id), _sample(Comment.id)
+    usernames = _sample(User.username)
+    with current_app.test_request_context():
+        urls = {name: url_for('main.' + name) for name in ('index', 'about', 'discussion', 'photos', 'videos', 'members',
+                                                 'edit_profile', 'edit_profile_picture', 'verification',
+                                                 'login', 'register', 'reset_password_request', 'search')}
+        # url_for, since /trending/posts only redirects to /trending
+        trending_urls = [url_for('main.trending_items', collection=collection)
+                         for collection in ('posts', 'photos', 'videos')]
+
+    def get(url, headers=None):
+        return url, None, headers
+
+    plan = [
+        ('index', 1, 'GET', lambda rnd: get(urls['index'])),
+        ('about', 1, 'GET', lambda rnd: get(urls['about'])),
+        ('discussion', 8, 'GET', lambda rnd: get(urls['discussion'])),
+        ('photos', 5, 'GET', lambda rnd: get(urls['photos'])),
+        ('videos', 3, 'GET', lambda rnd: get(urls['videos'])),
+        ('members', 2, 'GET', lambda rnd: get(urls['members'])),
+        ('trending', 2, 'GET', lambda rnd: get(rnd.choice(trending_urls))),
+        ('search', 3, 'GET', lambda rnd: get('{}?q={}&type={}'.format(
+            urls['search'], rnd.choice(WORDS), rnd.choice(['posts', 'photos', 'videos', 'comments', 'users'])))),
+        ('profile', 3, 'GET', lambda rnd: get('/profile/{}'.format(rnd.choice(usernames)))),
+        ('edit_profile', 1, 'GET', lambda rnd: get(urls['edit_profile'])),
+        ('edit_profile_picture', 1, 'GET', lambda rnd: get(urls['edit_profile_picture'])),
+        ('verification', 1, 'GET', lambda rnd: get(urls['verification'])),
+        ('login', 1, 'GET', lambda rnd: get(urls['login'])),
+        ('register', 1, 'GET', lambda rnd: get(urls['register'])),
+        ('reset_password_request', 1, 'GET', lambda rnd: get(urls['reset_password_request'])),
+        ('reset_password', 1, 'GET', lambda rnd: get('/reset_password/not-a-token')),
+        ('favicon', 1, 'GET', lambda rnd: get('/favicon.ico')),
+    ]
+    if posts:
+        plan += [
+            ('post', 4, 'GET', lambda rnd: get('/post/{}'.format(rnd.choice(posts)))),
+            ('edit_post', 1, 'GET', lambda rnd: get('/edit-post/{}'.format(rnd.choice(posts)))),
+            ('like_post_action', 2, 'GET', lambda rnd: get('/like-post/{}/{}'.format(
+                rnd.choice(posts), rnd.choice(['like', 'unlike'])), {'Referer': urls['discussion']})),
+            ('discussion_post', 1, 'POST', lambda rnd: (urls['discussion'], {
+                'post': 'bench post', 'post_submit': 'Post'}, None)),
+            ('post_comment', 1, 'POST', lambda rnd: ('/post/{}'.format(rnd.choice(posts)), {
+                'post': 'bench comment', 'post_id': rnd.choice(posts), 'comment_submit': 'Comment'},
+                {'Referer': urls['discussion']})),
+        ]
+    if photos:
+        plan += [
+            ('photo', 3, 'GET', lambda rnd: get('/photo/{}'.format(rnd.choice(photos)))),
+            ('edit_photo', 1, 'GET', lambda rnd: get('/edit-photo/{}'.format(rnd.choice(photos)))),
+            ('like_photo_action', 1, 'GET', lambda rnd: get('/like-photo/{}/{}'.format(
+                rnd.choice(photos), rnd.choice(['like', 'unlike'])), {'Referer': urls['photos']})),
+        ]
+    if videos:
+        plan += [
+            ('video', 2, 'GET', lambda rnd: get('/video/{}'.format(rnd.choice(videos)))),
+            ('edit_video', 1, 'GET', lambda rnd: get('/edit-video/{}'.format(rnd.choice(videos)))),
+            ('like_video_action', 1, 'GET', lambda rnd: get('/like-video/{}/{}'.format(
+                rnd.choice(videos), rnd.choice(['like', 'unlike'])), {'Referer': urls['videos']})),
+            ('media_video', 1, 'GET', lambda rnd: get('/media/videos/' + SAMPLE_VIDEO, {'Range': 'bytes=0-65535'})),
+        ]
+    if comments:
+        plan.append(('edit_comment', 1, 'GET', lambda rnd: get('/edit-comment/{}'.format(rnd.choice(comments)))))
+    return plan
+
+
+@bench.command()
+@click.option('--sessions', default=8, help='Concurrent logged-in sessions.')
+@click.option('--requests', default=100, help='Requests per session.')
+@click.option('--url', default=None, help='Drive a running server at this base URL instead of the test client.')
+@click.option('--seed', default=1, help='Random seed for the request mix.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Also write the JSON report here.')
+def run(sessions, requests, url, seed, output):
+    """Load-test every route with many concurrent sessions and report latency as JSON.
+
+    Run `flask bench seed` first. With --url only GET routes are used, CSRF
+    protection being on, and SQL statement counts and memory are not
+    available for the remote process. Exits non-zero if a step that writes
+    answers with anything but its redirect, i.e. saved nothing.
+    """
+    users = [row[0] for row in db.session.query(User.username).filter(User.username.like('bench%')).limit(sessions)]
+    if not users:
+        raise click.ClickException('No seeded users; run "flask bench seed" first.')
+    plan = load_plan()
+    db.session.remove()
+    if url:
+        plan = [step for step in plan if step[2] == 'GET']
+        driver = LoadDriver(plan, lambda username: HTTPSession(url, username), users, seed=seed,
+                            expected=EXPECTED_STATUS)
+        elapsed = driver.run(sessions, requests)
+        result = driver.report(elapsed)
+    else:
+        current_app.config['WTF_CSRF_ENABLED'] = False
+        counter = StatementCounter([db.engine, db.get_reader()])
+        app = current_app._get_current_object()  # sessions are opened by the driver's threads
+        driver = LoadDriver(plan, lambda username: TestClientSession(app, username), users, counter, seed,
+                            EXPECTED_STATUS)
+        peak = [rss_mb()]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.05):
+                peak[0] = max(peak[0], rss_mb())
+
+        threading.Thread(target=sample, daemon=True).start()
+        with counter:
+            elapsed = driver.run(sessions, requests)
+        done.set()
+        result = driver.report(elapsed)
+        result['rss_peak_mib'] = round(peak[0], 1)
+    result.update(sessions=sessions, mode='http' if url else 'test-client')
+    report = json.dumps(result, indent=2, sort_keys=True)
+    click.echo(report)
+    if output:
+        with open(output, 'w') as f:
+            f.write(report + '\n')
+    if result['unexpected']:
+        raise click.ClickException('{} requests did not answer with the status their step expects'.format(
+            result['unexpected']))
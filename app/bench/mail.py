@@ -0,0 +1,123 @@
+import json
+import time
+import uuid
+import threading
+import socketserver
+import click
+from flask import current_app
+from flask_mail import Mail
+from app import db, outbox
+from app.bench import bench
+from app.models import OutboxMessage
+
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.opened()
+        self.reply('220 stand-in ESMTP')
+        data = None
+        for line in self.rfile:
+            if data is not None:
+                if line.rstrip(b'\r\n') == b'.':
+                    self.reply('250 OK' if self.server.accept(b''.join(data)) else '451 Try again later')
+                    data = None
+                else:
+                    data.append(line[1:] if line.startswith(b'..') else line)
+                continue
+            verb = line[:4].upper()
+            if verb in (b'EHLO', b'HELO'):
+                self.reply('250 stand-in')
+            elif verb == b'DATA':
+                data = []
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif verb == b'QUIT':
+                self.reply('221 Bye')
+                break
+            else:  # MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    """Accepts any mail on a local port and keeps count, rejecting every nth message with a 451."""
+
+    daemon_threads = True
+
+    def __init__(self, reject_every=0):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), StandInSMTPHandler)
+        self.reject_every = reject_every
+        self.connections = 0
+        self.received = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def accept(self, data):
+        with self._lock:
+            if self.reject_every and (self.received + self.rejected + 1) % self.reject_every == 0:
+                self.rejected += 1
+                return False
+            self.received += 1
+            return True
+
+
+@bench.command(name='mail')
+@click.option('--messages', default=200, help='Messages to queue.')
+@click.option('--reject-every', default=0, help='Have the server answer 451 to every nth message.')
+@click.option('--timeout', default=60, help='Give up after this many seconds.')
+def mail_(messages, reject_every, timeout):
+    """Drain the outbox into a local stand-in SMTP server.
+
+    Queues --messages messages, sends them with retries against a server
+    on 127.0.0.1 and reports how many connections were used. Exits non-zero
+    unless every message was delivered.
+    """
+    server = StandInSMTPServer(reject_every)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state, config = current_app.extensions.get('mail'), dict(current_app.config)
+    current_app.extensions['mail'] = Mail().init_mail(dict(
+        MAIL_SERVER='127.0.0.1', MAIL_PORT=server.server_address[1], MAIL_SUPPRESS_SEND=False))
+    current_app.config.update(OUTBOX_RETRY_BASE=0)
+    subject = '[bench {}]'.format(uuid.uuid4().hex[:8])
+    started = time.time()
+    try:
+        for n in range(messages):
+            outbox.enqueue(subject, 'bench@localhost', ['user{}@localhost'.format(n)], 'Message {}'.format(n))
+        while time.time() - started < timeout:
+            outbox.send_pending()
+            if not OutboxMessage.query.filter_by(subject=subject, status='pending').count():
+                break
+            time.sleep(0.05)
+        elapsed = time.time() - started
+        statuses = dict(db.session.query(OutboxMessage.status, db.func.count())
+                        .filter_by(subject=subject).group_by(OutboxMessage.status))
+    finally:
+        if state is None:
+            current_app.extensions.pop('mail')
+        else:
+            current_app.extensions['mail'] = state
+        current_app.config.update(config)
+        OutboxMessage.query.filter_by(subject=subject).delete()
+        db.session.commit()
+        server.shutdown()
+        server.server_close()
+
+    result = {
+        'messages': messages,
+        'statuses': statuses,
+        'delivered': server.received,
+        'rejected': server.rejected,
+        'connections': server.connections,
+        'seconds': round(elapsed, 2),
+        'messages_per_second': round(server.received / elapsed, 1) if elapsed else None,
+    }
+    click.echo(json.dumps(result, indent=2))
+    if statuses.get('sent', 0) != messages:
+        raise click.ClickException('{} of {} messages were not delivered'.format(
+            messages - statuses.get('sent', 0), messages))
@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import uuid
+import random
+import threading
+import click
+from flask import current_app, url_for
+from app import clips
+from app.bench import bench, rss_mb
+
+
+@bench.command()
+@click.option('--size', default=2048, help='Size of the test video in MiB.')
+@click.option('--clients', default=16, help='Concurrent downloads.')
+@click.option('--max-growth', default=64, help='Fail if RSS grows by more than this many MiB.')
+def media(size, clients, max_growth):
+    """Download a large video from many clients at once and watch memory.
+
+    Half of the clients fetch the whole file, the other half random byte
+    ranges. Exits non-zero when resident memory grows by more than
+    --max-growth MiB, i.e. when the media endpoint buffers files, or when a
+    download does not answer 200 (206 for a range) with exactly the bytes
+    of the file (of the range) asked for.
+    """
+    directory = clips.config.destination
+    os.makedirs(directory, exist_ok=True)
+    filename = 'bench-{}.mp4'.format(uuid.uuid4().hex)
+    path = os.path.join(directory, filename)
+    with open(path, 'wb') as f:
+        f.truncate(size * 2**20)  # sparse, so the disk is not the bottleneck
+
+    with current_app.test_request_context():
+        url = url_for('main.media_video', filename=filename)
+    sent = []
+    peak = [rss_mb()]
+    start_rss = peak[0]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.05):
+            peak[0] = max(peak[0], rss_mb())
+
+    app = current_app._get_current_object()  # for the download threads
+
+    def download(n):
+        client = app.test_client()
+        headers = {}
+        expected = (200, size * 2**20)
+        if n % 2:
+            first = random.randrange(size * 2**20 // 2)
+            last = first + size * 2**20 // 4
+            headers['Range'] = 'bytes={}-{}'.format(first, last)
+            expected = (206, last - first + 1)
+        response = client.get(url, headers=headers, buffered=False)
+        total = 0
+        for chunk in response.response:
+            total += len(chunk)
+        response.close()
+        sent.append(((response.status_code, total), expected))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.time()
+    threads = [threading.Thread(target=download, args=(n,)) for n in range(clients)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        done.set()
+        os.remove(path)
+    elapsed = time.time() - started
+
+    # a download that raised never made it into `sent`, and counts as failed too
+    failed = clients - len(sent) + sum(1 for got, expected in sent if got != expected)
+    result = {
+        'file_mib': size,
+        'clients': clients,
+        'statuses': sorted(set(status for (status, _), _ in sent)),
+        'failed': failed,
+        'mib_sent': round(sum(total for (_, total), _ in sent) / 2**20, 1),
+        'seconds': round(elapsed, 2),
+        'rss_start_mib': round(start_rss, 1),
+        'rss_peak_mib': round(peak[0], 1),
+    }
+    click.echo(json.dumps(result, indent=2))
+    if failed:
+        raise click.ClickException('{} of {} downloads got the wrong status or byte count'.format(failed, clients))
+    if peak[0] - start_rss > max_growth:
+        raise click.ClickException('RSS grew by {:.1f} MiB while streaming'.format(peak[0] - start_rss))
@@ -0,0 +1,126 @@
+import re
+import json
+import random
+import click
+from flask import current_app, url_for
+from app import db
+from app.bench import bench
+from app.bench.load import EXPECTED_STATUS, load_plan, _sample
+from app.models import User, Post, Photo, Video, Comment, TimelineEntry
+from app.pagination import encode_cursor
+from app.loadtest import StatementRecorder, TestClientSession, query_plan, plan_problems
+
+
+def _cursor_after(model, columns, *criteria):
+    # a cursor halfway down a listing, for the plans of pages past the first
+    row = db.session.query(*columns).filter(*criteria).order_by(*[c.desc() for c in columns]) \
+        .offset(db.session.query(model).filter(*criteria).count() // 2).first()
+    return encode_cursor(row) if row else None
+
+
+def deep_pages():
+    """Requests for pages past the first of each listing, and for the JSON API."""
+    cursors = {
+        'index': _cursor_after(TimelineEntry, (TimelineEntry.timestamp, TimelineEntry.id)),
+        'discussion': _cursor_after(Post, (Post.timestamp, Post.id), Post.is_discussion == 1),
+        'photos': _cursor_after(Photo, (Photo.timestamp, Photo.id), Photo.is_public == 1),
+        'videos': _cursor_after(Video, (Video.timestamp, Video.id)),
+        'members': _cursor_after(User, (User.member_since, User.id), User.verified == 1),
+    }
+    commented = db.session.query(Comment.post_id, Comment.timestamp, Comment.id) \
+        .filter(Comment.post_id.isnot(None)).order_by(db.func.random()).first()
+    photos, videos = _sample(Photo.id), _sample(Video.id)
+    steps = []
+    with current_app.test_request_context():
+        for endpoint, cursor in cursors.items():
+            if cursor:
+                steps.append((endpoint + '_older', 'GET', url_for('main.' + endpoint, before=cursor)))
+        steps += [
+            ('api_timeline', 'GET', url_for('api.api_timeline')),
+            ('api_feed_posts', 'GET', url_for('api.api_feed', collection='posts')),
+            ('api_feed_photos', 'GET', url_for('api.api_feed', collection='photos')),
+            ('api_feed_videos', 'GET', url_for('api.api_feed', collection='videos')),
+        ]
+        if cursors['discussion']:
+            steps.append(('api_feed_posts_older', 'GET', url_for('api.api_feed', collection='posts',
+                                                                 before=cursors['discussion'])))
+        if commented:
+            cursor = encode_cursor(commented[1:])
+            steps += [
+                ('post_comments_older', 'GET', url_for('main.post', id=commented[0], before=cursor)),
+                ('api_item', 'GET', url_for('api.api_item', collection='posts', id=commented[0])),
+                ('api_comments', 'GET', url_for('api.api_comments', collection='posts', id=commented[0])),
+                ('api_comments_older', 'GET', url_for('api.api_comments', collection='posts', id=commented[0],
+                                                      before=cursor)),
+            ]
+        if photos:
+            steps.append(('api_comments_photo', 'GET', url_for('api.api_comments', collection='photos', id=photos[0])))
+        if videos:
+            steps.append(('api_comments_video', 'GET', url_for('api.api_comments', collection='videos', id=videos[0])))
+    return steps
+
+
+@bench.command()
+@click.option('--repeat', default=3, help='Requests per route, each with different ids.')
+@click.option('--seed', default=1, help='Random seed for the ids requested.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Also write the JSON report here.')
+def plans(repeat, seed, output):
+    """Check the query plan of every SQL statement every route runs.
+
+    Run `flask bench seed` first, so the planner sees realistic tables.
+    Each route of the load test and of the JSON API is requested with the
+    test client; every statement it runs goes through EXPLAIN QUERY PLAN.
+    Exits non-zero if any of them reads a whole table or sorts its result
+    in a temp B-tree for ORDER BY, which is what a missing index looks
+    like and gets slower as the tables grow, or if a step that writes
+    answers with anything but its redirect, so its plans were not the write's.
+    """
+    users = [row[0] for row in db.session.query(User.username).filter(User.username.like('bench%')).limit(1)]
+    if not users:
+        raise click.ClickException('No seeded users; run "flask bench seed" first.')
+    rnd = random.Random(seed)
+    steps = [(name, method, build) for name, _, method, build in load_plan()]
+    steps += [(name, method, lambda rnd, url=url: (url, None, None)) for name, method, url in deep_pages()]
+    db.session.remove()
+    current_app.config['WTF_CSRF_ENABLED'] = False
+    session = TestClientSession(current_app._get_current_object(), users[0])
+    recorder = StatementRecorder([db.engine, db.get_reader()])
+    routes = {}
+    unexpected = {}
+    with recorder:
+        recorder.take()
+        for name, method, build in steps:
+            statements = routes.setdefault(name, {})
+            for _ in range(repeat):
+                url, data, headers = build(rnd)
+                status = session.request(method, url, data, headers)
+                if status != EXPECTED_STATUS.get(name, status):
+                    unexpected[name] = status
+                for statement, parameters in recorder.take():
+                    statements.setdefault(statement, parameters)
+
+    connection = db.engine.raw_connection()
+    result = {'routes': {}, 'problems': 0, 'unexpected': unexpected}
+    try:
+        for name, statements in sorted(routes.items()):
+            problems = []
+            for statement, parameters in statements.items():
+                plan = query_plan(connection, statement, parameters)
+                if plan_problems(plan, re.search(r'\bWHERE\b', statement) is not None):
+                    problems.append({'sql': ' '.join(statement.split()), 'plan': plan})
+            result['routes'][name] = {'statements': len(statements), 'problems': problems}
+            result['problems'] += len(problems)
+    finally:
+        connection.close()
+    report = json.dumps(result, indent=2, sort_keys=True)
+    click.echo(report)
+    if output:
+        with open(output, 'w') as f:
+            f.write(report + '\n')
+    if unexpected:
+        # their statements are those of a refused form, not of the write the step stands for
+        raise click.ClickException('steps answered with the wrong status: {}'.format(
+            ', '.join('{} {}'.format(name, status) for name, status in sorted(unexpected.items()))))
+    if result['problems']:
+        raise click.ClickException('{} statements scan a whole table or sort in a temp B-tree'.format(
+            result['problems']))
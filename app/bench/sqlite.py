@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import random
+import threading
+import tempfile
+import statistics
+import click
+from datetime import datetime
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.pool import NullPool
+from flask import current_app
+from app import db
+from app.bench import bench
+from app.database import sqlite_engine
+
+
+FEED_SQL = text('SELECT post.id, post.body, post.timestamp, user.username FROM post '
+                'JOIN user ON user.id = post.user_id WHERE post.is_discussion = 1 '
+                'ORDER BY post.timestamp DESC, post.id DESC LIMIT 10')
+TOUCH_SQL = text('UPDATE user SET last_seen = :now WHERE id = :id')
+POST_SQL = text('INSERT INTO post (body, timestamp, user_id, is_discussion, is_public) '
+                'VALUES (:body, :now, :id, 1, 1)')
+
+
+def _seed(engine, users, posts):
+    db.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(db.metadata.tables['user'].insert(), [
+            {'username': 'u{}'.format(n), 'email': 'u{}@example.com'.format(n), 'verified': 1}
+            for n in range(users)])
+        conn.execute(POST_SQL, [{'body': 'post {}'.format(n), 'now': now, 'id': n % users + 1}
+                                for n in range(posts)])
+
+
+def _hammer(reader, writer, threads, seconds, write_ratio, users):
+    """Run feed reads and last_seen/post writes from `threads` threads for `seconds`."""
+    latencies = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def work(seed):
+        rnd = random.Random(seed)
+        mine = {'read': [], 'write': []}
+        failed = {'read': 0, 'write': 0}
+        while time.time() < deadline:
+            kind = 'write' if rnd.random() < write_ratio else 'read'
+            started = time.time()
+            try:
+                if kind == 'read':
+                    with reader.connect() as conn:
+                        conn.execute(FEED_SQL).fetchall()
+                else:
+                    with writer.begin() as conn:
+                        params = {'now': datetime.utcnow(), 'id': rnd.randint(1, users), 'body': 'bench'}
+                        conn.execute(TOUCH_SQL, params)
+                        if rnd.random() < 0.2:
+                            conn.execute(POST_SQL, params)
+            except exc.OperationalError:
+                failed[kind] += 1
+                continue
+            mine[kind].append(time.time() - started)
+        with lock:
+            for kind in mine:
+                latencies[kind].extend(mine[kind])
+                errors[kind] += failed[kind]
+
+    workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    def ms(values, q):
+        return round(statistics.quantiles(values, n=100)[q - 1] * 1000, 2) if len(values) > 1 else None
+
+    ops = sum(len(v) for v in latencies.values())
+    failures = sum(errors.values())
+    return {
+        'ops_per_second': round(ops / seconds, 1),
+        'error_rate': round(failures / (ops + failures), 4) if ops + failures else 0,
+        'errors': errors,
+        'read_p50_ms': ms(latencies['read'], 50), 'read_p99_ms': ms(latencies['read'], 99),
+        'write_p50_ms': ms(latencies['write'], 50), 'write_p99_ms': ms(latencies['write'], 99),
+    }
+
+
+@bench.command()
+@click.option('--threads', default=16, help='Concurrent clients.')
+@click.option('--seconds', default=10, help='Duration of each run.')
+@click.option('--write-ratio', default=0.2, help='Share of operations that write.')
+@click.option('--busy-timeout', default=5.0, help='Seconds a connection waits for a lock before failing.')
+def sqlite(threads, seconds, write_ratio, busy_timeout):
+    """Compare the old rollback-journal setup with the WAL profile under concurrent load.
+
+    Each profile gets a fresh database file with the same data and the same
+    mix of feed reads and last_seen/post writes. "journal" is what the app
+    used to do: a connection per checkout, default pragmas. "wal" uses
+    SQLITE_PRAGMAS with separate writer and query_only reader pools.
+    """
+    users, posts = 200, 5000
+    directory = tempfile.mkdtemp(prefix='bench-sqlite-')
+    pragmas = dict(current_app.config['SQLITE_PRAGMAS'], busy_timeout=int(busy_timeout * 1000))
+    results = {}
+    try:
+        url = 'sqlite:///' + os.path.join(directory, 'journal.db')
+        engine = create_engine(url, poolclass=NullPool, connect_args={'timeout': busy_timeout})
+        _seed(engine, users, posts)
+        results['journal'] = _hammer(engine, engine, threads, seconds, write_ratio, users)
+        engine.dispose()
+
+        url = 'sqlite:///' + os.path.join(directory, 'wal.db')
+        writer = sqlite_engine(url, pragmas, current_app.config['SQLITE_POOL_SIZE'])
+        reader = sqlite_engine(url, dict(pragmas, query_only=1), current_app.config['SQLITE_READER_POOL_SIZE'])
+        _seed(writer, users, posts)
+        results['wal'] = _hammer(reader, writer, threads, seconds, write_ratio, users)
+        reader.dispose()
+        writer.dispose()
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    click.echo(json.dumps(dict(threads=threads, seconds=seconds, write_ratio=write_ratio, **results), indent=2))
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import random
+import tempfile
+import click
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from flask import current_app
+from app import db, trending
+from app.bench import bench
+from app.database import sqlite_engine
+from app.models import Post
+from app.loadtest import query_plan, zipf_weights, percentile_ms
+from app.trending import EPOCH_ID, rebuild_sql
+
+
+# what ranking posts by likes costs without a stored score
+NAIVE_TOP_SQL = text('SELECT post.id FROM post JOIN post_like ON post_like.post_id = post.id '
+                     'WHERE post.is_discussion = 1 GROUP BY post.id ORDER BY count(*) DESC, post.id DESC LIMIT :k')
+
+
+def _time_reads(conn, statement, params, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        conn.execute(statement, params).fetchall()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+@bench.command(name='trending')
+@click.option('--items', default=5000, help='Discussion posts to rank.')
+@click.option('--volumes', default='10000,100000,1000000', help='Comma-separated like totals to measure at.')
+@click.option('--reads', default=200, help='Top-K reads timed at each total.')
+@click.option('--likes', default=200, help='Single likes timed at each total.')
+@click.option('--seed', default=42, help='Random seed; the same seed gives the same data.')
+def trending_(items, volumes, reads, likes, seed):
+    """Show that the trending top K costs the same to read however many likes there are.
+
+    A scratch database gets `items` posts, then likes, most of them for a
+    few posts, until it holds each total in --volumes. At every total the
+    query behind /trending is timed next to the GROUP BY over post_like it
+    replaces, and so is the UPDATE one more like runs.
+    """
+    volumes = sorted(int(v) for v in volumes.split(','))
+    rnd = random.Random(seed)
+    users = max(volumes[-1] // 50, 100)
+    directory = tempfile.mkdtemp(prefix='bench-trending-')
+    engine = sqlite_engine('sqlite:///' + os.path.join(directory, 'trending.db'), current_app.config['SQLITE_PRAGMAS'], 1)
+    post, post_like = Post.__table__, db.metadata.tables['post_like']
+    k = current_app.config['TRENDING_SIZE']
+    top = trending.ranking('posts').with_entities(Post.id).limit(k).statement
+    boost = trending.boost(current_app.config['TRENDING_LIKE_WEIGHT'])
+    results = []
+    try:
+        db.metadata.create_all(engine)
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            conn.execute(db.metadata.tables['user'].insert(), [
+                {'username': 'u{}'.format(n), 'email': 'u{}@example.com'.format(n), 'verified': 1}
+                for n in range(users)])
+            # spread over three days, so the decay has something to do
+            conn.execute(post.insert(), [
+                {'body': 'post {}'.format(n), 'user_id': n % users + 1, 'is_discussion': 1,
+                 'timestamp': now - timedelta(seconds=rnd.randint(0, 3 * 86400))} for n in range(items)])
+            conn.execute(db.metadata.tables['trending_epoch'].insert(), id=EPOCH_ID, epoch=time.time())
+        weights = zipf_weights(items)
+        add_like = post_like.insert().prefix_with('OR IGNORE')
+        total = 0
+        for volume in volumes:
+            started = time.time()
+            with engine.begin() as conn:
+                while total < volume:
+                    conn.execute(add_like, [{'user_id': rnd.randint(1, users), 'post_id': post_id} for post_id in
+                                            rnd.choices(range(1, items + 1), cum_weights=weights, k=volume - total)])
+                    total = conn.execute(text('SELECT count(*) FROM post_like')).scalar()
+                conn.execute(text('UPDATE post SET like_count = '
+                                  '(SELECT count(*) FROM post_like WHERE post_like.post_id = post.id)'))
+                epoch = conn.execute(text('SELECT epoch FROM trending_epoch')).scalar()
+                conn.execute(rebuild_sql('post'), trending.rebuild_params(epoch))
+            loaded = time.time() - started
+
+            increments = []
+            for _ in range(likes):
+                post_id = rnd.choices(range(1, items + 1), cum_weights=weights)[0]
+                started = time.perf_counter()
+                with engine.begin() as conn:
+                    if conn.execute(add_like, user_id=rnd.randint(1, users), post_id=post_id).rowcount:
+                        conn.execute(post.update().where(post.c.id == post_id).values(
+                            like_count=post.c.like_count + 1, trending_score=post.c.trending_score + boost))
+                increments.append(time.perf_counter() - started)
+
+            with engine.connect() as conn:
+                top_times = _time_reads(conn, top, {}, reads)
+                naive_times = _time_reads(conn, NAIVE_TOP_SQL, {'k': k}, max(reads // 20, 3))
+                total = conn.execute(text('SELECT count(*) FROM post_like')).scalar()
+            results.append({
+                'likes': total, 'load_seconds': round(loaded, 2),
+                'top_p50_ms': percentile_ms(top_times, 50), 'top_p99_ms': percentile_ms(top_times, 99),
+                'group_by_p50_ms': percentile_ms(naive_times, 50),
+                'like_p50_ms': percentile_ms(increments, 50), 'like_p99_ms': percentile_ms(increments, 99),
+            })
+
+        compiled = top.compile(dialect=engine.dialect)
+        connection = engine.raw_connection()
+        try:
+            plan = query_plan(connection, str(compiled), [compiled.params[key] for key in compiled.positiontup])
+        finally:
+            connection.close()
+    finally:
+        engine.dispose()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    click.echo(json.dumps(dict(items=items, k=k, plan=plan, volumes=results), indent=2))
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import tracemalloc
+import click
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from flask import current_app
+from app import db, usernames
+from app.bench import bench
+from app.database import sqlite_engine
+from app.loadtest import WORDS, percentile_ms
+
+
+# what each keystroke would cost without the index; LIKE is case-insensitive, so no index serves it
+TYPEAHEAD_SQL = text('SELECT id, username FROM user WHERE verified = 1 AND username LIKE :pattern '
+                     'ORDER BY last_seen DESC LIMIT :limit')
+
+
+@bench.command()
+@click.option('--users', default=1000000)
+@click.option('--queries', default=2000, help='Prefixes looked up in the index.')
+@click.option('--sql-queries', default=20, help='Of those, looked up with LIKE as well.')
+@click.option('--limit', default=10, help='Matches per lookup.')
+@click.option('--seed', default=42, help='Random seed; the same seed gives the same data.')
+def typeahead(users, queries, sql_queries, limit, seed):
+    """Measure the username prefix index: memory, build time and lookups.
+
+    A scratch database gets `users` verified users with mixed-case names
+    and last_seen times spread over a month. The index is built from it as
+    the app does, with its memory measured by tracemalloc, and then looked
+    up with prefixes of one to four characters taken from the names, next
+    to the LIKE query it replaces.
+    """
+    rnd = random.Random(seed)
+    directory = tempfile.mkdtemp(prefix='bench-typeahead-')
+    engine = sqlite_engine('sqlite:///' + os.path.join(directory, 'typeahead.db'), current_app.config['SQLITE_PRAGMAS'], 1)
+    names = []
+    try:
+        db.metadata.create_all(engine)
+        now = datetime.utcnow()
+        for start in range(0, users, 50000):
+            rows = []
+            for n in range(start, min(start + 50000, users)):
+                name = '{}{}{}'.format(rnd.choice(WORDS), rnd.choice(WORDS).capitalize(), n)
+                names.append(name)
+                rows.append({'username': name, 'email': '{}@example.com'.format(n), 'verified': 1,
+                             'last_seen': now - timedelta(seconds=rnd.randint(0, 30 * 86400))})
+            with engine.begin() as conn:
+                conn.execute(db.metadata.tables['user'].insert(), rows)
+
+        tracemalloc.start()
+        started = time.time()
+        with engine.connect() as conn:
+            index = usernames.build(conn)
+        built = time.time() - started
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # the same names as a plain list of strings, for comparison
+        as_list = sum(sys.getsizeof(name) + 8 for name in names)
+
+        prefixes = [rnd.choice(names)[:rnd.randint(1, 4)] for _ in range(queries)]
+        times = {}
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.search(prefix, limit)
+            times.setdefault(len(prefix), []).append(time.perf_counter() - started)
+        sql_times = []
+        with engine.connect() as conn:
+            for prefix in prefixes[:sql_queries]:
+                started = time.perf_counter()
+                conn.execute(TYPEAHEAD_SQL, pattern=prefix + '%', limit=limit).fetchall()
+                sql_times.append(time.perf_counter() - started)
+    finally:
+        engine.dispose()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    everything = [t for values in times.values() for t in values]
+    click.echo(json.dumps({
+        'users': len(index), 'build_seconds': round(built, 2),
+        'index_mb': round(size / 2**20, 1), 'build_peak_mb': round(peak / 2**20, 1),
+        'list_of_str_mb': round(as_list / 2**20, 1), 'long_runs': len(index.top),
+        'lookup_p50_ms': percentile_ms(everything, 50), 'lookup_p99_ms': percentile_ms(everything, 99),
+        'lookup_max_ms': round(max(everything) * 1000, 3),
+        'lookup_p99_ms_by_length': {length: percentile_ms(values, 99) for length, values in sorted(times.items())},
+        'like_p50_ms': percentile_ms(sql_times, 50),
+    }, indent=2))
@@ -0,0 +1,349 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+from datetime import datetime
+from itertools import chain
+from flask_uploads import extension
+import click
+from flask import Blueprint, current_app
+from app import db, images, clips, derivatives, search_index, timeline, trending, outbox, resumable
+from app.events import Relay
+from app.models import User, Post, Photo, Video, PostLike, Comment, OutboxMessage
+from app.storage import content_path, file_digest, is_content_path
+from app.faststart import faststart as make_faststart
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+@bp.cli.command()
+def recount():
+    """Rebuild the like and comment counters from post_like and comment."""
+    for model, like_fk, comment_fk in ((Post, PostLike.post_id, Comment.post_id),
+                                       (Photo, PostLike.photo_id, Comment.photo_id),
+                                       (Video, PostLike.video_id, Comment.video_id)):
+        likes = db.select([db.func.count(PostLike.id)]).where(like_fk == model.id).as_scalar()
+        comments = db.select([db.func.count(Comment.id)]).where(comment_fk == model.id).as_scalar()
+        result = db.session.execute(model.__table__.update().values(
+            like_count=likes, comment_count=comments))
+        click.echo('{}: {} rows recounted'.format(model.__tablename__, result.rowcount))
+    db.session.commit()
+
+
+@bp.cli.group()
+def storage():
+    """Upload storage maintenance."""
+
+
+def _referrer_columns(uploads):
+    for referrer in uploads.referrers:
+        table, column = referrer.split('.')
+        yield db.metadata.tables[table].c[column]
+
+
+@storage.command()
+def rehome():
+    """Move uploads saved under their original names into content-addressed paths.
+
+    The old path is kept as a hard link to the stored file, so URLs handed
+    out before the move keep working without using extra space.
+    """
+    for uploads in (images, clips):
+        columns = list(_referrer_columns(uploads))
+        old_names = set()
+        for column in columns:
+            old_names.update(row[0] for row in db.session.query(column).distinct()
+                             if row[0] and not is_content_path(row[0]))
+        moved = 0
+        for old in sorted(old_names):
+            old_path = uploads.path(old)
+            if not os.path.exists(old_path):
+                click.echo('{}: {} is missing, skipped'.format(uploads.name, old))
+                continue
+            new = content_path(file_digest(old_path), extension(old).lower())
+            new_path = uploads.path(new)
+            if not os.path.exists(new_path):
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.link(old_path, new_path)
+            elif not os.path.samefile(old_path, new_path):
+                # duplicate content: point the old name at the stored copy
+                tmp = old_path + '.rehome'
+                os.link(new_path, tmp)
+                os.replace(tmp, old_path)
+            for column in columns:
+                db.session.execute(column.table.update().where(column == old).values({column.name: new}))
+            db.session.commit()
+            moved += 1
+        click.echo('{}: {} files rehomed'.format(uploads.name, moved))
+
+
+@storage.command()
+@click.option('--delete', is_flag=True, help='Remove the orphans instead of listing them.')
+@click.option('--min-age', default=3600, show_default=True,
+              help='Seconds a file must be old before it counts; newer ones may belong to uploads in flight.')
+def orphans(delete, min_age):
+    """Find uploaded files and derivatives that no row refers to.
+
+    Walks the upload directories once, checking filenames against the
+    database in batches, so it runs in constant memory however many files
+    there are. Catches files the reaper never got to, e.g. after a restart.
+    """
+    for uploads in (images, clips):
+        found = chain(uploads.orphans(min_age), derivatives.orphans() if uploads is images else ())
+        count = size = 0
+        for filename, length in found:
+            count += 1
+            size += length
+            if delete:
+                path = uploads.path(filename)
+                os.remove(path)
+                _remove_empty_dirs(os.path.dirname(path), uploads.config.destination)
+            else:
+                click.echo('{}/{}'.format(uploads.name, filename))
+        click.echo('{}: {} orphans, {:.1f} MiB{}'.format(
+            uploads.name, count, size / 2**20, ' removed' if delete else ''))
+
+
+@storage.command()
+def faststart():
+    """Rewrite stored videos uploaded before moov was moved to the front on upload."""
+    rewritten = total = 0
+    for (filename,) in db.session.query(Video.filename).distinct():
+        path = clips.path(filename)
+        if filename and os.path.exists(path):
+            total += 1
+            rewritten += make_faststart(path)
+    click.echo('videos: {} of {} files rewritten'.format(rewritten, total))
+
+
+@storage.command('expire-uploads')
+def expire_uploads():
+    """Remove chunked uploads left unfinished for longer than RESUMABLE_UPLOAD_EXPIRY."""
+    click.echo('{} stale uploads removed'.format(resumable.collect_garbage()))
+
+
+def _remove_empty_dirs(path, root):
+    root = os.path.abspath(root)
+    path = os.path.abspath(path)
+    while path != root and path.startswith(root + os.sep):
+        try:
+            os.rmdir(path)
+        except OSError:
+            break
+        path = os.path.dirname(path)
+
+
+@bp.cli.command()
+def reindex():
+    """Rebuild the full-text search index from the content tables."""
+    search_index.reindex()
+    click.echo('search index rebuilt')
+
+
+@bp.cli.command('rebuild-timeline')
+def rebuild_timeline():
+    """Rebuild the home timeline from the content tables."""
+    timeline.rebuild()
+    click.echo('timeline rebuilt')
+
+
+@bp.cli.group(name='trending')
+def trending_group():
+    """Trending scores."""
+
+
+@trending_group.command()
+def rebase():
+    """Move the decay epoch to now, scaling every score to match."""
+    click.echo('scores scaled by {:.6g}'.format(trending.rebase()))
+
+
+@trending_group.command()
+def rebuild():
+    """Recompute every score from the like counters and comments."""
+    trending.rebuild()
+    click.echo('trending scores rebuilt')
+
+
+@bp.cli.group(name='events')
+def events_group():
+    """Live updates."""
+
+
+@events_group.command()
+@click.option('--socket', 'path', help='Unix socket to listen on; EVENTS_RELAY by default.')
+def relay(path):
+    """Pass live update events between the app's processes until interrupted."""
+    path = path or current_app.config['EVENTS_RELAY']
+    if not path:
+        raise click.ClickException('Set EVENTS_RELAY or pass --socket.')
+    click.echo('relaying events on {}'.format(path))
+    try:
+        asyncio.run(Relay(current_app.config['EVENTS_BUFFER']).serve(path))
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+@bp.cli.group(name='outbox')
+def outbox_group():
+    """Outgoing mail."""
+
+
+@outbox_group.command()
+def status():
+    """Show delivery status and the latest failures."""
+    for name, count in sorted(outbox.status().items()):
+        click.echo('{}: {}'.format(name, count))
+    for message in OutboxMessage.query.filter(OutboxMessage.last_error.isnot(None)) \
+            .order_by(OutboxMessage.next_attempt_at.desc()).limit(10):
+        click.echo('#{} {} to {} after {} attempts: {}'.format(
+            message.id, message.status, message.recipients, message.attempts, message.last_error))
+
+
+@outbox_group.command()
+def send():
+    """Send everything that is due now, without waiting for the background sender."""
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = outbox.send_pending()
+        total_sent += sent
+        total_failed += failed
+        if not sent:
+            break
+    click.echo('{} sent, {} failed attempts'.format(total_sent, total_failed))
+
+
+@outbox_group.command()
+def retry():
+    """Queue failed messages for another round of attempts."""
+    count = OutboxMessage.query.filter_by(status='failed').update(
+        {'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.utcnow()})
+    db.session.commit()
+    click.echo('{} messages queued again'.format(count))
+
+
+@bp.cli.group(name='users')
+def users_group():
+    """User accounts."""
+
+
+@users_group.command()
+@click.argument('username')
+@click.option('--revoke', is_flag=True, help='Take the rights away instead.')
+def admin(username, revoke):
+    """Let a verified user see /metrics and /stats/fragments, or stop them.
+
+    Processes that cached the user keep the old rights for up to USER_CACHE_TTL seconds.
+    """
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException('No user named {}.'.format(username))
+    if not revoke and user.verified != 1:
+        raise click.ClickException('{} is not verified yet.'.format(username))
+    user.is_admin = 0 if revoke else 1
+    db.session.commit()
+    click.echo('{} is {}an admin'.format(username, 'no longer ' if revoke else 'now '))
+
+
+@bp.cli.group(name='templates')
+def templates_group():
+    """Compiled templates."""
+
+
+@templates_group.command(name='compile')
+def compile_templates():
+    """Compile every template into JINJA_BYTECODE_CACHE_DIR, so that no process has to."""
+    if not current_app.config.get('JINJA_BYTECODE_CACHE_DIR'):
+        raise click.ClickException('Set JINJA_BYTECODE_CACHE_DIR first.')
+    names = current_app.jinja_env.list_templates()
+    for name in names:
+        current_app.jinja_env.get_template(name)
+    click.echo('{} templates compiled into {}'.format(len(names), current_app.config['JINJA_BYTECODE_CACHE_DIR']))
+
+
+# run by startup-profile in a fresh interpreter, as a web worker starts: the arguments
+# are the URL to request and the time.time() the interpreter was started at
+STARTUP_PROBE = """
+import json, sys, time
+from app import create_app
+imported = time.time()
+app = create_app()
+created = time.time()
+client = app.test_client()
+status = client.get(sys.argv[1]).status_code
+first = time.time()
+client.get(sys.argv[1])
+second = time.time()
+print(json.dumps({'status': status, 'total': first - float(sys.argv[2]), 'import': imported - float(sys.argv[2]),
+                  'create_app': created - imported, 'first_request': first - created, 'second_request': second - first}))
+"""
+
+
+def import_times(stderr):
+    """(module, own µs, cumulative µs) from the output of python -X importtime."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if own.strip().isdigit():
+            modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+@bp.cli.command('startup-profile')
+@click.option('--path', default='/login', help='URL of the first request.')
+@click.option('--runs', default=3, help='Fresh processes to start; the median one is reported.')
+@click.option('--top', default=15, help='Modules and packages to list.')
+@click.option('--budget', type=float, help='Seconds allowed until the first response; STARTUP_BUDGET by default.')
+def startup_profile(path, runs, top, budget):
+    """Time a cold start: imports per module, create_app() and the first request.
+
+    Each run is a new interpreter under python -X importtime that imports
+    the app, creates it as a web worker does and requests --path twice.
+    Exits non-zero when the median run takes more than --budget seconds
+    from starting the interpreter to its first response, or that response
+    is a server error.
+    """
+    budget = budget or current_app.config['STARTUP_BUDGET']
+    results = []
+    for _ in range(runs):
+        started = time.time()
+        probe = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_PROBE, path, repr(started)],
+                               cwd=os.path.dirname(current_app.root_path), capture_output=True, text=True)
+        if probe.returncode:
+            raise click.ClickException('The app did not start:\n' + probe.stderr[-2000:])
+        results.append((json.loads(probe.stdout.splitlines()[-1]), import_times(probe.stderr)))
+    results.sort(key=lambda result: result[0]['total'])
+    timings, modules = results[len(results) // 2]
+
+    packages = {}
+    for name, own, _ in modules:
+        packages[name.split('.')[0]] = packages.get(name.split('.')[0], 0) + own
+    slowest = sorted(modules, key=lambda module: -module[1])[:top]
+    report = {
+        'path': path, 'status': timings['status'], 'runs': runs,
+        'total_ms': round(timings['total'] * 1000, 1), 'budget_ms': round(budget * 1000, 1),
+        'total_ms_range': [round(result[0]['total'] * 1000, 1) for result in (results[0], results[-1])],
+        'import_ms': round(timings['import'] * 1000, 1),
+        'create_app_ms': round(timings['create_app'] * 1000, 1),
+        'first_request_ms': round(timings['first_request'] * 1000, 1),
+        'second_request_ms': round(timings['second_request'] * 1000, 1),
+        'bytecode_cache': current_app.config.get('JINJA_BYTECODE_CACHE_DIR'),
+        'modules_imported': len(modules),
+        'import_ms_by_package': {name: round(us / 1000, 1) for name, us in
+                                 sorted(packages.items(), key=lambda item: -item[1])[:top]},
+        'import_ms_by_module': {name: {'own': round(own / 1000, 1), 'cumulative': round(cumulative / 1000, 1)}
+                                for name, own, cumulative in slowest},
+    }
+    click.echo(json.dumps(report, indent=2))
+    if timings['status'] >= 500:
+        raise click.ClickException('{} answered {}'.format(path, timings['status']))
+    if timings['total'] > budget:
+        raise click.ClickException('First response after {:.0f} ms, over the budget of {:.0f} ms'.format(
+            timings['total'] * 1000, budget * 1000))
+
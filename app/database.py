@@ -0,0 +1,123 @@
+import threading
+from functools import partial
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.expression import TextClause, UpdateBase
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+WRITE_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'DROP', 'ALTER')
+
+
+def apply_pragmas(pragmas, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
+
+
+def is_file_sqlite(url):
+    return url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:')
+
+
+def sqlite_engine(url, pragmas, pool_size, **options):
+    """An engine on a SQLite file with a real connection pool and `pragmas` run on every new connection."""
+    options.setdefault('connect_args', {})['check_same_thread'] = False
+    engine = create_engine(url, poolclass=QueuePool, pool_size=pool_size, **options)
+    event.listen(engine, 'connect', partial(apply_pragmas, pragmas))
+    return engine
+
+
+def is_write(clause):
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, TextClause):
+        words = clause.text.split(None, 1)
+        return bool(words) and words[0].upper() in WRITE_KEYWORDS
+    return False
+
+
+def is_read_request():
+    return has_request_context() and request.method in READ_METHODS
+
+
+class RoutingSession(SignallingSession):
+    """Sends the reads of GET requests to the read-only pool and everything else to the writer.
+
+    Once a transaction has written (a flush or an INSERT/UPDATE/DELETE
+    statement) it stays on the writer until it ends, so a request always
+    reads its own writes.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        self.writing = False
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or is_write(clause) or not is_read_request():
+            self.writing = True
+        if self.writing:
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        return self.db.get_reader(self.app)
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _back_to_reader(session, transaction):
+    if transaction.parent is None:
+        session.writing = False
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy tuned for concurrent access to a SQLite file.
+
+    Every connection gets SQLITE_PRAGMAS (WAL, synchronous=NORMAL, a busy
+    timeout, mmap and page cache sizes). Writes go through a small pool on
+    the main engine; GET requests read through a second pool of
+    query_only connections, which in WAL mode never wait for the writer.
+    Other databases are left alone and use a single engine.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+        super(RoutingSQLAlchemy, self).__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLITE_PRAGMAS', {})
+        app.config.setdefault('SQLITE_POOL_SIZE', 5)
+        app.config.setdefault('SQLITE_READER_POOL_SIZE', 10)
+        self.pragmas = app.config['SQLITE_PRAGMAS']
+        super(RoutingSQLAlchemy, self).init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super(RoutingSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if is_file_sqlite(sa_url) and options.get('poolclass') is NullPool:
+            # pool connections instead of opening one, and running the pragmas, per checkout
+            options.update(poolclass=QueuePool, pool_size=app.config['SQLITE_POOL_SIZE'])
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super(RoutingSQLAlchemy, self).create_engine(sa_url, engine_opts)
+        if sa_url.drivername.startswith('sqlite'):
+            event.listen(engine, 'connect', partial(apply_pragmas, self.pragmas))
+        return engine
+
+    def get_reader(self, app=None):
+        """The engine for reads: a query_only pool on SQLite files, the writer otherwise."""
+        app = self.get_app(app)
+        writer = self.get_engine(app)
+        with self._readers_lock:
+            engine, reader = self._readers.get(app, (None, None))
+            if engine is not writer:
+                if is_file_sqlite(writer.url):
+                    reader = sqlite_engine(writer.url, dict(self.pragmas, query_only=1),
+                                           app.config['SQLITE_READER_POOL_SIZE'])
+                else:
+                    reader = writer
+                self._readers[app] = (writer, reader)
+            return reader
@@ -0,0 +1,151 @@
+import os
+import glob
+import shutil
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import url_for
+from app.storage import walk_files
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+SAVE_OPTIONS = {
+    'jpeg': dict(quality=82, optimize=True, progressive=True),
+    'webp': dict(quality=80, method=4),
+}
+
+
+class ImageDerivatives(object):
+    """Resized, re-encoded copies of uploaded images.
+
+    Derivatives live next to the originals under derived/<name>/<size>.<ext>
+    and are generated on a small thread pool, either right after an upload
+    or the first time a template asks for an image that has none yet.
+    Templates get the original until every size has been written.
+    """
+
+    def __init__(self, app=None, uploads=None):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._ready = set()
+        self._failed = set()
+        self._formats = None
+        if app is not None:
+            self.init_app(app, uploads)
+
+    def init_app(self, app, uploads):
+        self.app = app
+        self.uploads = uploads
+        self.sizes = tuple(sorted(app.config['IMAGE_DERIVATIVE_SIZES']))
+        self.max_pending = app.config['IMAGE_DERIVATIVE_QUEUE']
+        self._pool = ThreadPoolExecutor(max_workers=app.config['IMAGE_DERIVATIVE_WORKERS'],
+                                        thread_name_prefix='image-derivatives')
+        app.add_template_global(self.src, 'image_src')
+        app.add_template_global(self.srcset, 'image_srcset')
+
+    @property
+    def formats(self):
+        # Pillow is loaded by the first page showing a resized image, not at startup
+        if self._formats is None:
+            from PIL import features
+            self._formats = ('webp', 'jpeg') if features.check('webp') else ('jpeg',)
+        return self._formats
+
+    def relpath(self, filename, size, fmt):
+        name = os.path.splitext(filename)[0]
+        return 'derived/{}/{}.{}'.format(name, size, EXTENSIONS[fmt])
+
+    def path(self, filename, size, fmt):
+        return os.path.join(self.uploads.config.destination, self.relpath(filename, size, fmt))
+
+    def url(self, filename, size, fmt):
+        return url_for('static', filename='uploads/{}/{}'.format(
+            self.uploads.name, self.relpath(filename, size, fmt)))
+
+    def schedule(self, filename):
+        with self._lock:
+            if filename in self._pending or filename in self._ready or filename in self._failed:
+                return False
+            if len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(filename)
+        self._pool.submit(self._run, filename)
+        return True
+
+    def is_ready(self, filename):
+        if filename in self._ready:
+            return True
+        # the smallest JPEG is written last
+        if os.path.exists(self.path(filename, self.sizes[0], 'jpeg')):
+            with self._lock:
+                self._ready.add(filename)
+            return True
+        self.schedule(filename)
+        return False
+
+    def src(self, filename, width):
+        """URL of the smallest derivative at least `width` px wide, else the original."""
+        if not self.is_ready(filename):
+            return url_for('static', filename='uploads/{}/{}'.format(self.uploads.name, filename))
+        size = next((s for s in self.sizes if s >= width), self.sizes[-1])
+        return self.url(filename, size, 'jpeg')
+
+    def srcset(self, filename, fmt='jpeg'):
+        if fmt not in self.formats or not self.is_ready(filename):
+            return ''
+        return ', '.join('{} {}w'.format(self.url(filename, size, fmt), size) for size in self.sizes)
+
+    def discard(self, filename):
+        """Remove every derivative of `filename`, once the original is gone."""
+        name = os.path.splitext(filename)[0]
+        shutil.rmtree(os.path.join(self.uploads.config.destination, 'derived', name), ignore_errors=True)
+        with self._lock:
+            self._ready.discard(filename)
+            self._failed.discard(filename)
+
+    def orphans(self):
+        """Yield (path, size) of derivatives, relative to the upload set, whose original is gone."""
+        root = self.uploads.config.destination
+        checked = {}
+        for path, entry in walk_files(os.path.join(root, 'derived')):
+            name = posixpath.dirname(path)
+            if name not in checked:
+                # files arrive a directory at a time, so only the current one is remembered
+                checked = {name: bool(glob.glob(glob.escape(os.path.join(root, name)) + '.*'))}
+            if not checked[name]:
+                yield posixpath.join('derived', path), entry.stat().st_size
+
+    def generate(self, filename):
+        from PIL import Image, ImageOps
+        with Image.open(self.uploads.path(filename)) as original:
+            # let the JPEG decoder downscale while decoding when the source is huge
+            original.draft('RGB', (self.sizes[-1], self.sizes[-1]))
+            image = ImageOps.exif_transpose(original)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            for size in reversed(self.sizes):
+                if image.width > size:
+                    image = image.resize((size, max(1, round(image.height * size / image.width))),
+                                         Image.LANCZOS)
+                for fmt in self.formats:
+                    self._save(image, self.path(filename, size, fmt), fmt)
+
+    def _save(self, image, path, fmt):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        image.save(tmp, format=fmt.upper(), **SAVE_OPTIONS[fmt])
+        os.replace(tmp, path)
+
+    def _run(self, filename):
+        try:
+            with self.app.app_context():
+                self.generate(filename)
+        except Exception:
+            logger.exception('Could not generate derivatives for %s', filename)
+            with self._lock:
+                self._failed.add(filename)
+        finally:
+            with self._lock:
+                self._pending.discard(filename)
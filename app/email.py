@@ -1,18 +1,15 @@
-from flask_mail import Message
-from app import mail, app
-from flask import render_template
+from app import outbox
+from flask import current_app, render_template
 
 def send_email(subject, sender, recipients, text_body, text_html):
-    msg=Message(subject,sender=sender, recipients=recipients)
-    msg.body=text_body
-    msg.html = text_html
-    mail.send(msg)
+    # stored in the outbox and sent by a background thread, never inline; commits the session
+    outbox.enqueue(subject, sender, recipients, text_body, text_html)
 
 def send_password_reset_email(user):
     token = user.get_reset_password_token()
     send_email(
         '[HoVuXomMoi] Reset Your Password',
-        sender=app.config['ADMINS'][0],
+        sender=current_app.config['ADMINS'][0],
         recipients= [user.email],
         text_body= render_template('email/reset_password.txt', user=user, token=token),
         text_html = render_template('email/reset_password.html', user=user, token=token)
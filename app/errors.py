@@ -1,11 +1,28 @@
-from app import app, db
-from flask import render_template
+from app import db
+from app.resumable import UploadError
+from app.api import APIError
+from flask import Blueprint, render_template, jsonify
 
-@app.errorhandler(404)
+bp = Blueprint('errors', __name__)
+
+@bp.app_errorhandler(404)
 def not_found_error(error):
-    render_template('404.html'), 404
+    return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('500.html'), 500
+
+@bp.app_errorhandler(UploadError)
+def upload_error(error):
+    db.session.rollback()
+    response = jsonify(error=str(error), offset=error.offset)
+    if error.offset is not None:
+        response.headers['Upload-Offset'] = str(error.offset)
+    return response, error.status
+
+@bp.app_errorhandler(APIError)
+def api_error(error):
+    db.session.rollback()
+    return jsonify(error=str(error)), error.status
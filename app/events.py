@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# milliseconds the browser waits before reconnecting a dropped stream
+RETRY_MS = 3000
+# seconds between attempts to reach the relay
+RECONNECT_DELAY = 2
+# bytes queued for a process that stopped reading before the relay drops it
+MAX_RELAY_BACKLOG = 4 * 2**20
+
+
+def _clock_id():
+    return int(time.time() * 1000)
+
+
+class EventLog(object):
+    """The latest events, oldest first, as (id, channels, event, data).
+
+    Ids go up by at least one per event and start from the clock in
+    milliseconds, so they keep going up across restarts. Every event with
+    an id of `floor` or more is held; a client whose last id is below that
+    may have missed some.
+    """
+
+    def __init__(self, size, floor=None):
+        self.events = deque(maxlen=size)
+        self.floor = _clock_id() if floor is None else floor
+        self.last_id = self.floor - 1
+
+    def add(self, channels, event, data, id=None):
+        if id is None:
+            id = max(self.last_id + 1, _clock_id())
+        if len(self.events) == self.events.maxlen:
+            self.floor = self.events[0][0] + 1
+        entry = (id, tuple(channels), event, data)
+        self.events.append(entry)
+        self.last_id = id
+        return entry
+
+    def after(self, last_id, channels):
+        """The events on any of `channels` after `last_id`, or None if some may be gone."""
+        if last_id + 1 < self.floor:
+            return None
+        found = []
+        for entry in reversed(self.events):
+            if entry[0] <= last_id:
+                break
+            if not channels.isdisjoint(entry[1]):
+                found.append(entry)
+        found.reverse()
+        return found
+
+
+def _line(message):
+    return (json.dumps(message) + '\n').encode()
+
+
+def _message(entry):
+    id, channels, event, data = entry
+    return {'id': id, 'channels': list(channels), 'event': event, 'data': data}
+
+
+class EventHub(object):
+    """Live updates for open pages: small JSON events published by the write routes.
+
+    Routes call publish() once their change has committed. Events go into
+    an EventLog of the last EVENTS_BUFFER, and every request in wait() sleeps
+    on the one condition they all share; a subscriber is no more than the
+    id of the last event it saw, so an idle one costs the request holding
+    it and nothing else. Run the app on green threads (gunicorn -k gevent)
+    and that is a greenlet rather than a thread. A client coming back with
+    its last id gets what it missed, or a reset if that left the log.
+
+    With EVENTS_RELAY set to a Unix socket path, events go to `flask events
+    relay` instead, which numbers them and sends them to every process, so
+    all workers hold the same log.
+    """
+
+    def __init__(self, app=None):
+        self._condition = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('EVENTS_BUFFER', 1000)
+        app.config.setdefault('EVENTS_RELAY', None)
+        app.config.setdefault('EVENTS_HEARTBEAT', 15)
+        app.config.setdefault('EVENTS_POLL_TIMEOUT', 25)
+        app.config.setdefault('EVENTS_STREAM_LIFETIME', 600)
+        self.log = EventLog(app.config['EVENTS_BUFFER'])
+        # published while the relay is out of reach, sent when it is back
+        self._pending = deque(maxlen=app.config['EVENTS_BUFFER'])
+        app.add_template_global(self.last_id, 'last_event_id')
+
+    def last_id(self):
+        """Where a page rendered now starts listening from."""
+        self._start()
+        return self.log.last_id
+
+    def publish(self, channels, event, **data):
+        """Send `event` with `data` to the clients listening on `channels`, a name or a list of them."""
+        if isinstance(channels, str):
+            channels = [channels]
+        if not self.app.config['EVENTS_RELAY']:
+            with self._condition:
+                self.log.add(channels, event, data)
+                self._condition.notify_all()
+            return
+        line = _line({'channels': list(channels), 'event': event, 'data': data})
+        self._start()
+        with self._send_lock:
+            if self._socket is not None:
+                try:
+                    self._socket.sendall(line)
+                    return
+                except OSError:
+                    logger.warning('Lost the event relay; queueing events until it is back', exc_info=True)
+                    self._socket.close()
+                    self._socket = None
+            self._pending.append(line)
+
+    def wait(self, channels, last_id, timeout):
+        """The events on `channels` after `last_id`, waiting up to `timeout` seconds for some.
+
+        Returns an empty list on timeout, and None if some events may have
+        been missed; the client should then pick up from last_id().
+        """
+        self._start()
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                found = self.log.after(last_id, channels)
+                if found is None or found:
+                    return found
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+
+    def stream(self, channels, last_id):
+        """A text/event-stream of the events on `channels` after `last_id`.
+
+        A comment goes out after EVENTS_HEARTBEAT seconds of quiet, so
+        proxies keep the connection open and a gone client is noticed. The
+        stream ends after EVENTS_STREAM_LIFETIME seconds and the browser
+        reconnects, sending the id of the last event in Last-Event-ID.
+        """
+        config = self.app.config
+        deadline = time.monotonic() + config['EVENTS_STREAM_LIFETIME']
+        yield 'retry: {}\n\n'.format(RETRY_MS)
+        while time.monotonic() < deadline:
+            found = self.wait(channels, last_id, config['EVENTS_HEARTBEAT'])
+            if found is None:
+                last_id = self.log.last_id
+                yield 'id: {}\nevent: reset\ndata: {{}}\n\n'.format(last_id)
+            elif not found:
+                yield ': keep-alive\n\n'
+            for id, _, event, data in found or ():
+                yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(id, event, json.dumps(data))
+                last_id = id
+
+    def _start(self):
+        if not self.app.config['EVENTS_RELAY'] or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._send_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='event-relay', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        path = self.app.config['EVENTS_RELAY']
+        reachable = True
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                with self._send_lock:
+                    while self._pending:
+                        sock.sendall(self._pending[0])
+                        self._pending.popleft()
+                    self._socket = sock
+                reachable = True
+                self._receive(sock.makefile('rb'))
+            except (OSError, ValueError, KeyError):
+                if reachable:
+                    logger.warning('Cannot use the event relay at %s; retrying', path, exc_info=True)
+                reachable = False
+            with self._send_lock:
+                if self._socket is sock:
+                    self._socket = None
+            sock.close()
+            time.sleep(RECONNECT_DELAY)
+
+    def _receive(self, stream):
+        # the relay's log first, which replaces ours, then one event per line
+        hello = json.loads(stream.readline())
+        log = EventLog(self.app.config['EVENTS_BUFFER'], hello['floor'])
+        for _ in range(hello['backlog']):
+            message = json.loads(stream.readline())
+            log.add(message['channels'], message['event'], message['data'], message['id'])
+        with self._condition:
+            self.log = log
+            self._condition.notify_all()
+        for line in stream:
+            message = json.loads(line)
+            with self._condition:
+                self.log.add(message['channels'], message['event'], message['data'], message['id'])
+                self._condition.notify_all()
+        raise OSError('the event relay closed the connection')
+
+
+class Relay(object):
+    """Passes events between the processes of one site; `flask events relay` runs it.
+
+    Each process connects to the Unix socket, sends the events it publishes
+    and receives everyone's, numbered here so that the ids agree across
+    processes. A process that connects is sent the buffered events first,
+    which is how a restarted worker catches up. One asyncio loop serves
+    every connection.
+    """
+
+    def __init__(self, size):
+        self.log = EventLog(size)
+        self.writers = set()
+
+    async def handle(self, reader, writer):
+        writer.write(_line({'floor': self.log.floor, 'backlog': len(self.log.events)}))
+        for entry in self.log.events:
+            writer.write(_line(_message(entry)))
+        self.writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    entry = self.log.add(message['channels'], message['event'], message['data'])
+                except (ValueError, KeyError, TypeError):
+                    logger.warning('Dropped a malformed event: %r', line[:200])
+                    continue
+                self.broadcast(_line(_message(entry)))
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def broadcast(self, line):
+        for writer in list(self.writers):
+            if writer.transport.get_write_buffer_size() > MAX_RELAY_BACKLOG:
+                # it reconnects and catches up from the log
+                logger.warning('Dropped a process that stopped reading events')
+                self.writers.discard(writer)
+                writer.close()
+            else:
+                writer.write(line)
+
+    async def serve(self, path):
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.remove(path) # left by a relay that did not exit cleanly
+            else:
+                raise RuntimeError('Another relay is listening on {}'.format(path))
+            finally:
+                probe.close()
+        server = await asyncio.start_unix_server(self.handle, path)
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,160 @@
+import os
+import struct
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# the moov atom is the only part held in memory; it indexes the samples and is rarely over a few MiB
+MAX_MOOV_SIZE = 64 * 2**20
+# atoms on the way from moov down to the chunk offset tables
+CONTAINERS = (b'trak', b'mdia', b'minf', b'stbl')
+
+
+class NotFaststartable(Exception):
+    pass
+
+
+def top_level_atoms(f, file_size):
+    """(type, offset, size) of each top-level atom. Raises NotFaststartable if they do not tile the file."""
+    atoms = []
+    offset = 0
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise NotFaststartable('truncated atom header at {}'.format(offset))
+        size, kind = struct.unpack('>I4s', header)
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise NotFaststartable('bad size for {!r} at {}'.format(kind, offset))
+        atoms.append((kind, offset, size))
+        offset += size
+    return atoms
+
+
+def _children(data):
+    pos = 0
+    while pos < len(data):
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - pos
+        if size < header or pos + size > len(data):
+            raise NotFaststartable('bad size for {!r} inside moov'.format(kind))
+        yield kind, data[pos + header:pos + size]
+        pos += size
+
+
+def _atom(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def rebuild_moov(body, move, wide=False):
+    """The moov atom with every chunk offset passed through `move`.
+
+    With `wide`, 32-bit stco tables are written as 64-bit co64 ones.
+    Raises OverflowError when an offset no longer fits its table.
+    """
+    def walk(data):
+        out = []
+        for kind, child in _children(data):
+            if kind in CONTAINERS:
+                child = walk(child)
+            elif kind in (b'stco', b'co64'):
+                flags, count = struct.unpack_from('>4sI', child)
+                width = 'I' if kind == b'stco' else 'Q'
+                offsets = [move(o) for o in struct.unpack_from('>{}{}'.format(count, width), child, 8)]
+                if kind == b'stco' and wide:
+                    kind, width = b'co64', 'Q'
+                if width == 'I' and offsets and max(offsets) > 0xFFFFFFFF:
+                    raise OverflowError('chunk offset past 4 GiB in stco')
+                child = struct.pack('>4sI{}{}'.format(count, width), flags, count, *offsets)
+            elif kind == b'cmov':
+                raise NotFaststartable('compressed moov')
+            out.append(_atom(kind, child))
+        return b''.join(out)
+
+    return _atom(b'moov', walk(body))
+
+
+def faststart(path):
+    """Move the moov atom of the MP4 at `path` in front of its media data, in place.
+
+    Players need moov, the index of the samples, before they can start, and
+    many encoders write it last, so a browser has to fetch the whole file
+    first. The file is rewritten to a temp file beside it and swapped in,
+    copying the media data in chunks; only moov is read into memory.
+    Returns True if the file was rewritten, False if it was already
+    faststart or is not an MP4 this understands, which is left as it is.
+    """
+    try:
+        with open(path, 'rb') as f:
+            atoms = top_level_atoms(f, os.fstat(f.fileno()).st_size)
+            kinds = [a[0] for a in atoms]
+            if b'moov' not in kinds or b'mdat' not in kinds:
+                return False
+            _, moov_offset, moov_size = atoms[kinds.index(b'moov')]
+            mdat_offset = atoms[kinds.index(b'mdat')][1]
+            if moov_offset < mdat_offset:
+                return False
+            if moov_size > MAX_MOOV_SIZE:
+                raise NotFaststartable('moov of {} bytes'.format(moov_size))
+            f.seek(moov_offset)
+            header = 16 if struct.unpack('>I', f.read(4))[0] == 1 else 8
+            f.seek(moov_offset + header)
+            body = f.read(moov_size - header)
+
+            def rebuilt(wide):
+                new_size = len(rebuild_moov(body, lambda o: o, wide))
+
+                # moov goes in front of the first mdat: everything from there on moves down
+                # by its size, and whatever followed its old place by the difference
+                def move(offset):
+                    if offset >= moov_offset + moov_size:
+                        return offset + new_size - moov_size
+                    if offset >= mdat_offset:
+                        return offset + new_size
+                    return offset
+                return rebuild_moov(body, move, wide)
+
+            try:
+                moov = rebuilt(wide=False)
+            except OverflowError:
+                moov = rebuilt(wide=True)
+
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.faststart')
+            try:
+                os.chmod(tmp, os.fstat(f.fileno()).st_mode)
+                with os.fdopen(fd, 'wb') as out:
+                    for kind, offset, size in atoms:
+                        if kind == b'moov':
+                            continue
+                        if offset == mdat_offset:
+                            out.write(moov)
+                        _copy(f, out, offset, size)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+    except (NotFaststartable, struct.error) as e:
+        logger.info('Not rewriting %s for streaming: %s', path, e)
+        return False
+    return True
+
+
+def _copy(src, dst, offset, size):
+    src.seek(offset)
+    while size:
+        chunk = src.read(min(CHUNK_SIZE, size))
+        if not chunk:
+            raise NotFaststartable('file shrank while copying')
+        dst.write(chunk)
+        size -= len(chunk)
@@ -1,3 +1,4 @@
+from flask import request
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, MultipleFileField, FileField, RadioField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional
@@ -92,7 +93,14 @@ class VerificationForm(FlaskForm):
     submit = SubmitField('Verify')
 
 class SearchForm(FlaskForm):
-    search = StringField('search', validators=[DataRequired()])
+    q = StringField('Search', validators=[DataRequired()])
+
+    def __init__(self, *args, **kwargs): # submitted with GET, so read the query string and skip CSRF
+        if 'formdata' not in kwargs:
+            kwargs['formdata'] = request.args
+        if 'meta' not in kwargs:
+            kwargs['meta'] = {'csrf': False}
+        super(SearchForm, self).__init__(*args, **kwargs)
 
 class EditPost(FlaskForm):
     edit_submit = SubmitField('Edit')
\ No newline at end of file
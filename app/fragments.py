@@ -0,0 +1,170 @@
+import os
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+from flask import render_template
+from markupsafe import Markup, escape
+
+logger = logging.getLogger(__name__)
+
+# kind: (template, author of the item, image filenames shown in the fragment)
+FRAGMENTS = {
+    'post': ('_post_item.html', lambda post: post.author, lambda post: ()),
+    'photo': ('_photo_item.html', lambda photo: photo.post.author, lambda photo: (photo.filename,)),
+    'video': ('_video_item.html', lambda video: video.post.author, lambda video: ()),
+}
+
+
+class SharedStore(object):
+    """Fragments in a local SQLite file so that every worker process can reuse them."""
+
+    def __init__(self, path, max_rows):
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=0.05, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS fragment (kind TEXT, item_id INTEGER, version TEXT, '
+                         'html TEXT, stored_at REAL, PRIMARY KEY (kind, item_id))')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_fragment_stored_at ON fragment (stored_at)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind, item_id, version):
+        row = self._connection().execute(
+            'SELECT html FROM fragment WHERE kind = ? AND item_id = ? AND version = ?',
+            (kind, item_id, version)).fetchone()
+        return row[0] if row else None
+
+    def put(self, kind, item_id, version, html):
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO fragment VALUES (?, ?, ?, ?, ?)',
+                     (kind, item_id, version, html, time.time()))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            conn.execute('DELETE FROM fragment WHERE rowid IN (SELECT rowid FROM fragment '
+                         'ORDER BY stored_at DESC LIMIT -1 OFFSET ?)', (self.max_rows,))
+
+    def delete(self, kind, item_id):
+        self._connection().execute('DELETE FROM fragment WHERE kind = ? AND item_id = ?', (kind, item_id))
+
+
+class FragmentCache(object):
+    """Caches the rendered, viewer-independent markup of feed items.
+
+    Entries are keyed by (kind, id) and tagged with a version made from the
+    item's version column, its author's name and avatar, and whether image
+    derivatives exist. A stale entry is simply never matched again. The
+    in-process LRU is bounded by FRAGMENT_CACHE_BYTES; FRAGMENT_CACHE_STORE
+    optionally names a SQLite file shared by all workers. Anything that
+    depends on the viewer, like the like button, is passed in as a slot and
+    filled in after the lookup.
+    """
+
+    def __init__(self, app=None, derivatives=None):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = 0
+        if app is not None:
+            self.init_app(app, derivatives)
+
+    def init_app(self, app, derivatives=None):
+        self.derivatives = derivatives
+        self.max_bytes = app.config['FRAGMENT_CACHE_BYTES']
+        path = app.config['FRAGMENT_CACHE_STORE']
+        self.store = SharedStore(path, app.config['FRAGMENT_CACHE_STORE_ROWS']) if path else None
+        app.add_template_global(self.render, 'cached_fragment')
+        # a changed partial retires what was cached with the old one, also in the shared store
+        folder = os.path.join(app.root_path, app.template_folder)
+        self.templates = max(os.path.getmtime(os.path.join(folder, t)) for t, _, _ in FRAGMENTS.values())
+
+    def version(self, kind, item):
+        _, author, images = FRAGMENTS[kind]
+        author = author(item)
+        ready = [self.derivatives.is_ready(f) for f in (author.profile_picture,) + images(item)] \
+            if self.derivatives else []
+        key = '{}|{}|{}|{}|{}|{}'.format(item.version, author.id, author.username, author.profile_picture, ready,
+                                         self.templates)
+        return md5(key.encode('utf-8')).hexdigest()[:16]
+
+    def render(self, kind, item, **slots):
+        """The item's cached markup with each <!--slot:name--> replaced by slots[name]."""
+        version = self.version(kind, item)
+        html = self._get(kind, item.id, version)
+        if html is None:
+            html = render_template(FRAGMENTS[kind][0], item=item)
+            self._put(kind, item.id, version, html)
+        for name, value in slots.items():
+            html = html.replace('<!--slot:{}-->'.format(name), escape(value))
+        return Markup(html)
+
+    def invalidate(self, item):
+        kind = item.__tablename__
+        with self._lock:
+            entry = self._entries.pop((kind, item.id), None)
+            if entry is not None:
+                self._size -= len(entry[1])
+        if self.store is not None:
+            try:
+                self.store.delete(kind, item.id)
+            except sqlite3.Error:
+                logger.warning('Could not remove %s %s from the shared fragment store', kind, item.id)
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.shared_hits) / lookups, 4) if lookups else None,
+            'entries': len(self._entries),
+            'bytes': self._size,
+        }
+
+    def _get(self, kind, item_id, version):
+        with self._lock:
+            entry = self._entries.get((kind, item_id))
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end((kind, item_id))
+                self.hits += 1
+                return entry[1]
+        if self.store is not None:
+            try:
+                html = self.store.get(kind, item_id, version)
+            except sqlite3.Error:
+                html = None
+            if html is not None:
+                self.shared_hits += 1
+                self._remember(kind, item_id, version, html)
+                return html
+        self.misses += 1
+        return None
+
+    def _put(self, kind, item_id, version, html):
+        self._remember(kind, item_id, version, html)
+        if self.store is not None:
+            try:
+                self.store.put(kind, item_id, version, html)
+            except sqlite3.Error:
+                logger.warning('Could not write %s %s to the shared fragment store', kind, item_id)
+
+    def _remember(self, kind, item_id, version, html):
+        with self._lock:
+            old = self._entries.pop((kind, item_id), None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[(kind, item_id)] = (version, html)
+            self._size += len(html)
+            while self._size > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
@@ -0,0 +1,145 @@
+import os
+import time
+import zlib
+from functools import wraps
+from hashlib import md5
+from flask import current_app, request, session
+from flask_login import current_user
+from app.identity import SESSION_KEY
+
+try:
+    import brotli
+except ImportError:  # optional; without it responses are gzipped only
+    brotli = None
+
+COMPRESSIBLE = ('text/html', 'text/plain', 'text/css', 'text/xml', 'text/csv',
+                'application/json', 'application/javascript', 'application/xml')
+
+
+def gzip_stream(chunks, level):
+    encoder = zlib.compressobj(level, zlib.DEFLATED, 31) # 31: gzip header and trailer
+    for chunk in chunks:
+        data = encoder.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield encoder.flush()
+
+
+def brotli_stream(chunks, quality):
+    encoder = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        data = encoder.process(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+class Compression(object):
+    """Compresses text responses with brotli or gzip, whichever the client prefers.
+
+    Buffered responses smaller than COMPRESS_MIN_SIZE bytes are sent as they
+    are, since the headers would eat the saving. Streamed responses are
+    compressed chunk by chunk as they are sent, and files served with
+    send_file are left alone so Range requests keep working.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+        app.after_request(self.compress)
+
+    def encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def compress(self, response):
+        if (response.status_code != 200 or response.direct_passthrough
+                or response.mimetype not in COMPRESSIBLE or 'Content-Encoding' in response.headers
+                or request.method == 'HEAD'):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.encoding()
+        if encoding is None:
+            return response
+        config = current_app.config
+        if encoding == 'br':
+            stream, level = brotli_stream, config['COMPRESS_BROTLI_QUALITY']
+        else:
+            stream, level = gzip_stream, config['COMPRESS_GZIP_LEVEL']
+        if response.is_streamed:
+            response.response = stream(response.response, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(b''.join(stream([data], level)))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class ETags(object):
+    """Weak ETags for pages, and 304 Not Modified without running the view.
+
+    conditional(marker) wraps a view; marker is called with the view's
+    arguments and returns cheap values that change whenever the page would,
+    such as the keys and versions of the rows on it. The ETag also covers
+    the user, their session's CSRF secret, the age of the CSRF token in
+    the page and the templates on disk, so a 304 never hands out a page
+    rendered for someone else, with a stale form or by older code.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.templates = self._templates_version(app)
+
+    def etag(self, marker):
+        config = self.app.config
+        # pages older than half the CSRF time limit get a fresh token
+        token_age = config.get('WTF_CSRF_TIME_LIMIT') or 3600
+        parts = (self.templates, current_user.get_id(), session.get(SESSION_KEY), session.get('csrf_token'),
+                 int(time.time() // (token_age / 2)), marker)
+        return md5(repr(parts).encode('utf-8')).hexdigest()
+
+    def conditional(self, marker):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                # a pending flash message is part of the next page, whatever the marker says
+                if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                    return f(*args, **kwargs)
+                etag = self.etag(marker(*args, **kwargs))
+                if request.if_none_match.contains_weak(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    response = current_app.make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag, weak=True)
+                # browsers keep the page but ask every time; shared caches never store it
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response
+            return decorated_function
+        return decorator
+
+    def _templates_version(self, app):
+        folder = os.path.join(app.root_path, app.template_folder)
+        newest = 0
+        for root, _, files in os.walk(folder):
+            for name in files:
+                newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+        return newest
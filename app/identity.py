@@ -0,0 +1,67 @@
+import time
+import threading
+from collections import OrderedDict
+from hashlib import md5
+from flask import session
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+SESSION_KEY = '_user_stamp'
+
+# columns that change without the user doing anything; left out of the stamp
+VOLATILE = ('last_seen',)
+
+
+class UserCache(object):
+    """Keeps logged-in users' rows in memory so a request need not query to know who it is.
+
+    Entries hold the column values of a user, expire after USER_CACHE_TTL
+    seconds and are evicted least recently used beyond USER_CACHE_SIZE. Each
+    entry has a stamp, a digest of its values, that is also stored in the
+    session cookie; when the cookie's stamp differs, because the user changed
+    through another worker, the row is read again. Routes that change a user
+    call invalidate() after committing.
+    """
+
+    def __init__(self, app=None, db=None):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.size = app.config['USER_CACHE_SIZE']
+
+    def get(self, model, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+        if entry is not None and entry[0] > time.time() and entry[1] == session.get(SESSION_KEY):
+            user = model(**entry[2])
+            make_transient_to_detached(user)
+            # attach to the session as a clean, already loaded instance; no SELECT
+            return self.db.session.merge(user, load=False)
+        user = model.query.get(user_id)
+        if user is not None:
+            self._remember(user)
+        return user
+
+    def invalidate(self, user):
+        with self._lock:
+            self._entries.pop(user.id, None)
+        session.pop(SESSION_KEY, None)
+
+    def _remember(self, user):
+        columns = {attr.key: getattr(user, attr.key) for attr in inspect(type(user)).column_attrs}
+        stamp = md5(repr(sorted((k, v) for k, v in columns.items() if k not in VOLATILE))
+                    .encode('utf-8')).hexdigest()[:12]
+        with self._lock:
+            self._entries[user.id] = (time.time() + self.ttl, stamp, columns)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        if session.get(SESSION_KEY) != stamp:
+            session[SESSION_KEY] = stamp
@@ -0,0 +1,358 @@
+import os
+import re
+import time
+import random
+import threading
+import itertools
+import statistics
+from collections import Counter
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+SEED_PASSWORD = 'bench'
+SAMPLE_VIDEO = 'bench/sample.mp4'
+WORDS = ('goup sunset coffee river city night music travel friends weekend mountain photo video '
+         'street garden rain summer winter morning book movie dinner park beach festival '
+         'washington hanoi saigon market bridge lake train concert birthday football').split()
+
+
+def zipf_weights(n, s=1.1):
+    """Cumulative weights for random.choices giving a few items most of the picks."""
+    return list(itertools.accumulate(1.0 / k ** s for k in range(1, n + 1)))
+
+
+def sentence(rnd, low=4, high=18):
+    return ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(low, high)))[:140]
+
+
+def percentile_ms(values, q):
+    if not values:
+        return None
+    if len(values) == 1:
+        return round(values[0] * 1000, 2)
+    return round(statistics.quantiles(values, n=100)[q - 1] * 1000, 2)
+
+
+class Seeder(object):
+    """Bulk-creates users, posts, photos, videos, comments and likes with Core inserts.
+
+    Authors, commented items and liked items are drawn from Zipf-like
+    distributions, so a few users write most of the posts and a few items
+    get most of the attention, as on a real site. Counters are filled in to
+    match. Every seeded user can log in with the password "bench".
+    """
+
+    def __init__(self, db, seed=42, chunk=5000):
+        self.db = db
+        self.rnd = random.Random(seed)
+        self.chunk = chunk
+
+    def next_id(self, table):
+        return (self.db.session.query(self.db.func.max(table.c.id)).scalar() or 0) + 1
+
+    def insert(self, name, rows):
+        table = self.db.metadata.tables[name]
+        for start in range(0, len(rows), self.chunk):
+            self.db.session.execute(table.insert(), rows[start:start + self.chunk])
+        return len(rows)
+
+    def pick(self, ids, cum_weights, k):
+        return self.rnd.choices(ids, cum_weights=cum_weights, k=k)
+
+    def run(self, users, posts, photos, videos, comments, likes, days=90):
+        tables = self.db.metadata.tables
+        rnd = self.rnd
+        now = datetime.utcnow()
+        start = now - timedelta(days=days)
+
+        counters = dict(like_count=0, comment_count=0, version=0)
+        no_parent = dict(post_id=None, photo_id=None, video_id=None)
+
+        def moment(n, total):
+            # spread in id order, so newer rows have newer timestamps
+            return start + timedelta(seconds=(days * 86400) * (n + rnd.random()) / max(total, 1))
+
+        password_hash = generate_password_hash(SEED_PASSWORD)
+        first_user = self.next_id(tables['user'])
+        user_ids = list(range(first_user, first_user + users))
+        user_rows = [dict(id=i, username='bench{}'.format(i), email='bench{}@example.com'.format(i),
+                          password_hash=password_hash, about_me=sentence(rnd, 2, 8), verified=1,
+                          profile_picture='defaults/default.jpg', member_since=moment(n, users),
+                          last_seen=now - timedelta(minutes=rnd.randint(0, 60 * 24 * 30)))
+                     for n, i in enumerate(user_ids)]
+        active = user_ids[:]
+        rnd.shuffle(active)
+        author_weights = zipf_weights(len(active))
+
+        post_id = itertools.count(self.next_id(tables['post']))
+        post_rows, photo_rows, video_rows = [], [], []
+        authors = self.pick(active, author_weights, posts + photos + videos)
+        for n in range(posts):
+            post_rows.append(dict(id=next(post_id), body=sentence(rnd), timestamp=moment(n, posts),
+                                  user_id=authors[n], is_discussion=1, is_public=1, **counters))
+        first_photo = self.next_id(tables['photo'])
+        for n in range(photos):
+            when, title = moment(n, photos), sentence(rnd, 1, 6)
+            parent = next(post_id)
+            post_rows.append(dict(id=parent, body=title, timestamp=when, user_id=authors[posts + n],
+                                  is_discussion=0, is_public=1, **counters))
+            photo_rows.append(dict(id=first_photo + n, title=title, filename='defaults/default.jpg',
+                                   is_public=1, timestamp=when, post_id=parent, **counters))
+        first_video = self.next_id(tables['video'])
+        for n in range(videos):
+            when, title = moment(n, videos), sentence(rnd, 1, 6)
+            parent = next(post_id)
+            post_rows.append(dict(id=parent, body=title, timestamp=when, user_id=authors[posts + photos + n],
+                                  is_discussion=0, is_public=1, **counters))
+            video_rows.append(dict(id=first_video + n, title=title, filename=SAMPLE_VIDEO,
+                                   timestamp=when, post_id=parent, **counters))
+
+        items = {
+            'post': [r for r in post_rows if r['is_discussion']],
+            'photo': photo_rows,
+            'video': video_rows,
+        }
+        kinds = [k for k in ('post', 'photo', 'video') if items[k]]
+        kind_weights = list(itertools.accumulate(len(items[k]) for k in kinds))
+        popularity = {}
+        for kind in kinds:
+            rows = items[kind][:]
+            rnd.shuffle(rows)
+            popularity[kind] = (rows, zipf_weights(len(rows), 0.9))
+
+        comment_rows = []
+        comment_id = self.next_id(tables['comment'])
+        for n, kind in enumerate(rnd.choices(kinds, cum_weights=kind_weights, k=comments if kinds else 0)):
+            row = self.pick(*popularity[kind], k=1)[0]
+            row['comment_count'] += 1
+            comment_rows.append(dict(no_parent, id=comment_id + n, body=sentence(rnd, 2, 12),
+                                     user_id=rnd.choice(user_ids),
+                                     timestamp=row['timestamp'] + timedelta(minutes=rnd.randint(1, 600)),
+                                     **{kind + '_id': row['id']}))
+
+        like_rows = []
+        liked = set()
+        attempts = 0
+        while kinds and len(like_rows) < likes and attempts < likes * 3:
+            attempts += 1
+            kind = rnd.choices(kinds, cum_weights=kind_weights)[0]
+            row = self.pick(*popularity[kind], k=1)[0]
+            user_id = rnd.choice(user_ids)
+            if (kind, row['id'], user_id) in liked:
+                continue
+            liked.add((kind, row['id'], user_id))
+            row['like_count'] += 1
+            like_rows.append(dict(no_parent, user_id=user_id, **{kind + '_id': row['id']}))
+
+        counts = {}
+        counts['user'] = self.insert('user', user_rows)
+        counts['post'] = self.insert('post', post_rows)
+        counts['photo'] = self.insert('photo', photo_rows)
+        counts['video'] = self.insert('video', video_rows)
+        counts['comment'] = self.insert('comment', comment_rows)
+        counts['post_like'] = self.insert('post_like', like_rows)
+        counts['timeline_entry'] = self.insert('timeline_entry', sorted(
+            (dict(no_parent, timestamp=row['timestamp'], **{kind + '_id': row['id']})
+             for kind in kinds for row in items[kind]), key=lambda row: row['timestamp']))
+        self.db.session.commit()
+        return counts
+
+
+class StatementCounter(object):
+    """Counts SQL statements run by the current thread on the given engines."""
+
+    def __init__(self, engines):
+        self._local = threading.local()
+        self.engines = engines
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+class StatementRecorder(object):
+    """Records the SQL statements, with their parameters, run by the current thread on the given engines."""
+
+    def __init__(self, engines):
+        self._local = threading.local()
+        self.engines = engines
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            self._local.__dict__.setdefault('statements', []).append((statement, parameters))
+
+    def take(self):
+        statements = getattr(self._local, 'statements', [])
+        self._local.statements = []
+        return statements
+
+
+def query_plan(connection, statement, parameters):
+    """The EXPLAIN QUERY PLAN lines of a statement, on a DB-API SQLite connection."""
+    return [row[-1] for row in connection.cursor().execute('EXPLAIN QUERY PLAN ' + statement, parameters or ())]
+
+
+def plan_problems(plan, filtered=False):
+    """The lines of a query plan that read a whole table or sort the result in a temp B-tree.
+
+    A statement with a WHERE clause is `filtered`; walking a whole index in
+    order for one reads every row the filter turns down, so it counts too.
+    Without a filter it is how a LIMIT on ORDER BY stops after a page.
+    """
+    problems = []
+    for line in plan:
+        words = line.split()
+        # "SCAN post" or, before SQLite 3.36, "SCAN TABLE post"; "SCAN post USING INDEX ..." walks an index
+        if (words[0] == 'SCAN' and 'VIRTUAL' not in words and words[1] != 'CONSTANT'
+                and not words[1].startswith('(') and (filtered or 'USING' not in words)):
+            problems.append(line)
+        elif line.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in line:
+            problems.append(line)
+    return problems
+
+
+class TestClientSession(object):
+    """A logged-in user driving the app in-process through the WSGI test client."""
+
+    def __init__(self, app, username):
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': username, 'password': SEED_PASSWORD, 'submit': 'Sign In'})
+
+    def request(self, method, url, data=None, headers=None):
+        response = self.client.open(url, method=method, data=data, headers=headers)
+        response.get_data()
+        return response.status_code
+
+
+class HTTPSession(object):
+    """A logged-in user driving a running server over HTTP."""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+        page = self.opener.open(self.base_url + '/login').read().decode('utf-8')
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+        self.request('POST', '/login', data={'username': username, 'password': SEED_PASSWORD, 'submit': 'Sign In',
+                                             'csrf_token': token.group(1) if token else ''})
+
+    def request(self, method, url, data=None, headers=None):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+        req = urllib.request.Request(self.base_url + url, data=body, method=method, headers=headers or {})
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # report the redirect itself, as the test client does
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class LoadDriver(object):
+    """Replays a weighted mix of requests from many concurrent sessions and collects timings."""
+
+    def __init__(self, plan, make_session, usernames, counter=None, seed=1, expected=None):
+        self.plan = plan # list of (name, weight, method, build(rnd) -> (url, data, headers))
+        self.make_session = make_session
+        self.usernames = usernames
+        self.counter = counter
+        self.seed = seed
+        self.expected = expected or {} # name: the only status that step may answer with
+        self.samples = [] # (name, seconds, status, statements)
+        self._lock = threading.Lock()
+
+    def run(self, sessions, requests):
+        names = [p[0] for p in self.plan]
+        weights = list(itertools.accumulate(p[1] for p in self.plan))
+        steps = {p[0]: (p[2], p[3]) for p in self.plan}
+
+        def work(n):
+            rnd = random.Random(self.seed * 1000 + n)
+            session = self.make_session(self.usernames[n % len(self.usernames)])
+            if self.counter:
+                self.counter.take()
+            mine = []
+            for name in rnd.choices(names, cum_weights=weights, k=requests):
+                method, build = steps[name]
+                url, data, headers = build(rnd)
+                started = time.perf_counter()
+                try:
+                    status = session.request(method, url, data, headers)
+                except Exception:
+                    status = 599
+                elapsed = time.perf_counter() - started
+                mine.append((name, elapsed, status, self.counter.take() if self.counter else None))
+            with self._lock:
+                self.samples.extend(mine)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(sessions)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - started
+
+    def report(self, seconds):
+        def summary(samples):
+            latencies = [s[1] for s in samples]
+            statements = [s[3] for s in samples if s[3] is not None]
+            return {
+                'requests': len(samples),
+                'p50_ms': percentile_ms(latencies, 50),
+                'p95_ms': percentile_ms(latencies, 95),
+                'p99_ms': percentile_ms(latencies, 99),
+                'sql_per_request': round(statistics.mean(statements), 2) if statements else None,
+                'errors': sum(1 for s in samples if s[2] >= 500),
+                'unexpected': sum(1 for s in samples if s[0] in self.expected and s[2] != self.expected[s[0]]),
+                'statuses': dict(Counter(str(s[2]) for s in samples)),
+            }
+
+        by_route = {}
+        for sample in self.samples:
+            by_route.setdefault(sample[0], []).append(sample)
+        result = summary(self.samples)
+        result['requests_per_second'] = round(len(self.samples) / seconds, 1) if seconds else None
+        result['seconds'] = round(seconds, 2)
+        result['routes'] = {name: summary(samples) for name, samples in sorted(by_route.items())}
+        return result
+
+
+def write_sample_video(path, size=2**20):
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(size)
@@ -0,0 +1,22 @@
+import smtplib
+from flask_mail import Connection
+
+
+class OutboxConnection(Connection):
+    """A Flask-Mail connection that gives up on an unresponsive server."""
+
+    def __init__(self, mail, timeout):
+        super(OutboxConnection, self).__init__(mail)
+        self.timeout = timeout
+
+    def configure_host(self):
+        if self.mail.use_ssl:
+            host = smtplib.SMTP_SSL(self.mail.server, self.mail.port, timeout=self.timeout)
+        else:
+            host = smtplib.SMTP(self.mail.server, self.mail.port, timeout=self.timeout)
+        host.set_debuglevel(int(self.mail.debug))
+        if self.mail.use_tls:
+            host.starttls()
+        if self.mail.username and self.mail.password:
+            host.login(self.mail.username, self.mail.password)
+        return host
@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name: (help, buckets, value from RequestStats)
+HISTOGRAMS = {
+    'request_duration_seconds': ('Wall time spent handling a request, less waits for events.', TIME_BUCKETS,
+                                 lambda stats: stats.duration),
+    'sql_statements': ('SQL statements executed per request.', COUNT_BUCKETS,
+                       lambda stats: sum(stats.statements.values())),
+    'sql_duration_seconds': ('Time spent in SQL statements per request.', TIME_BUCKETS,
+                             lambda stats: stats.sql_time),
+    'template_render_seconds': ('Time spent rendering templates per request.', TIME_BUCKETS,
+                                lambda stats: stats.template_time),
+    'response_size_bytes': ('Size of response bodies.', SIZE_BUCKETS,
+                            lambda stats: stats.size),
+}
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.wait_time = 0.0
+        self.statements = Counter() # statement: executions
+        self.statement_time = Counter() # statement: seconds
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_started = 0.0
+        self.template_depth = 0
+        self.size = 0
+
+
+def _format_labels(labels):
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+
+class Metrics(object):
+    """Per-endpoint request timings, SQL and template costs, in Prometheus format.
+
+    Every request records its wall time, the number and duration of its SQL
+    statements, the time spent rendering templates and the response size,
+    aggregated into histograms per endpoint and served by /metrics. Requests
+    slower than METRICS_SLOW_REQUEST seconds log their slowest statements,
+    and any request running the same statement more than
+    METRICS_N_PLUS_ONE times logs a likely N+1 query.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._histograms = {} # (name, endpoint): Histogram
+        self._requests = Counter() # (endpoint, method, status): count
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        # engines are created lazily, and there are two of them, so listen on all
+        event.listen(Engine, 'before_cursor_execute', self._statement_started)
+        event.listen(Engine, 'after_cursor_execute', self._statement_finished)
+        event.listen(Engine, 'handle_error', self._statement_failed)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines += ['# HELP goup_requests_total Requests handled.', '# TYPE goup_requests_total counter']
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                labels = _format_labels((('endpoint', endpoint), ('method', method), ('status', status)))
+                lines.append('goup_requests_total{{{}}} {}'.format(labels, count))
+            for name, (help_text, _, _) in HISTOGRAMS.items():
+                lines += ['# HELP goup_{} {}'.format(name, help_text), '# TYPE goup_{} histogram'.format(name)]
+                for (metric, endpoint), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    labels = (('endpoint', endpoint),)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('goup_{}_bucket{{{}}} {}'.format(name, _format_labels(labels + (('le', bound),)), count))
+                    lines.append('goup_{}_bucket{{{}}} {}'.format(name, _format_labels(labels + (('le', '+Inf'),)),
+                                                                  histogram.count))
+                    lines.append('goup_{}_sum{{{}}} {}'.format(name, _format_labels(labels), histogram.sum))
+                    lines.append('goup_{}_count{{{}}} {}'.format(name, _format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def _start(self):
+        g.request_stats = RequestStats()
+
+    def _finish(self, response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+        stats.duration = time.perf_counter() - stats.started - stats.wait_time
+        if response.content_length is not None:
+            stats.size = response.content_length
+        elif not response.is_streamed:
+            stats.size = len(response.get_data())
+        endpoint = request.endpoint or 'unmatched'
+        with self._lock:
+            self._requests[(endpoint, request.method, response.status_code)] += 1
+            for name, (_, buckets, value) in HISTOGRAMS.items():
+                histogram = self._histograms.get((name, endpoint))
+                if histogram is None:
+                    histogram = self._histograms[(name, endpoint)] = Histogram(buckets)
+                histogram.observe(value(stats))
+        self._report(endpoint, stats)
+        return response
+
+    def _report(self, endpoint, stats):
+        config = self.app.config
+        if stats.duration > config['METRICS_SLOW_REQUEST']:
+            slowest = stats.statement_time.most_common(config['METRICS_SLOW_STATEMENTS'])
+            logger.warning('Slow request %s %s: %.3fs, %d statements in %.3fs, templates %.3fs%s',
+                           request.method, request.full_path, stats.duration, sum(stats.statements.values()),
+                           stats.sql_time, stats.template_time,
+                           ''.join('\n  {:.4f}s x{} {}'.format(seconds, stats.statements[sql], ' '.join(sql.split()))
+                                   for sql, seconds in slowest))
+        for sql, count in stats.statements.items():
+            if count > config['METRICS_N_PLUS_ONE']:
+                logger.warning('Possible N+1 in %s: statement ran %d times: %s', endpoint, count, ' '.join(sql.split()))
+
+    @contextmanager
+    def waiting(self):
+        """Leave the time spent in the block, idling for something to happen, out of the request's duration."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = self._stats()
+            if stats is not None:
+                stats.wait_time += time.perf_counter() - started
+
+    def _stats(self):
+        return g.get('request_stats') if has_request_context() else None
+
+    def _template_started(self, sender, template, context, **extra):
+        stats = self._stats()
+        if stats is not None:
+            if not stats.template_depth:
+                stats.template_started = time.perf_counter()
+            stats.template_depth += 1
+
+    def _template_finished(self, sender, template, context, **extra):
+        stats = self._stats()
+        if stats is not None and stats.template_depth:
+            stats.template_depth -= 1
+            # templates rendered from inside a template are part of the outer render
+            if not stats.template_depth:
+                stats.template_time += time.perf_counter() - stats.template_started
+
+    def _statement_started(self, conn, cursor, statement, parameters, context, executemany):
+        if self._stats() is not None:
+            conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+    def _statement_finished(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._stats()
+        started = conn.info.get('statement_started')
+        if stats is None or not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        stats.statements[statement] += 1
+        stats.statement_time[statement] += elapsed
+        stats.sql_time += elapsed
+
+    def _statement_failed(self, exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('statement_started'):
+            conn.info['statement_started'].pop()
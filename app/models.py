@@ -1,12 +1,49 @@
-from app import app, db, login
+from app import db, login, user_cache, images, clips, trending
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app
 from flask_login import UserMixin
 from time import time
 import jwt
 from hashlib import md5
 
+
+def bump_counters(item, **deltas):
+    # written as "col = col + n" so the UPDATE is atomic and lands in the caller's transaction;
+    # every change also moves the item to a new version, which retires its cached fragment
+    deltas.setdefault('version', 1)
+    for name, delta in deltas.items():
+        setattr(item, name, getattr(type(item), name) + delta)
+    if deltas.get('like_count') or deltas.get('comment_count'):
+        trending.record(item, likes=deltas.get('like_count', 0), comments=deltas.get('comment_count', 0))
+
+
+def delete_item(item):
+    """Delete a post, photo or video with a single DELETE.
+
+    The database removes its comments, likes, photos and videos through ON
+    DELETE CASCADE, instead of the session loading each of them. Returns
+    (upload set, filenames) pairs for the files the deleted rows used, to be
+    handed to the reaper once the transaction commits.
+    """
+    if isinstance(item, Post):
+        files = [(images, [row[0] for row in db.session.query(Photo.filename).filter(Photo.post_id == item.id)]),
+                 (clips, [row[0] for row in db.session.query(Video.filename).filter(Video.post_id == item.id)])]
+    elif isinstance(item, Photo):
+        files = [(images, [item.filename])]
+    else:
+        files = [(clips, [item.filename])]
+    table = type(item).__table__
+    db.session.execute(table.delete().where(table.c.id == item.id))
+    db.session.expunge(item)
+    return files
+
+
 class User(UserMixin, db.Model):
+    __table_args__ = (
+        # the members page, and covering for its ETag, which reads only these columns
+        db.Index('ix_user_verified_member_since', 'verified', 'member_since', 'id', 'username', 'profile_picture'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(60), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
@@ -14,7 +51,9 @@ class User(UserMixin, db.Model):
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow())
     profile_picture = db.Column(db.String(140), index=True)
-    verified = db.Column(db.Integer, index=True, default=0)
+    verified = db.Column(db.Integer, default=0)
+    # opens /metrics and /stats/fragments; granted with `flask users admin`, never by signing up
+    is_admin = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     member_since = db.Column(db.DateTime, default=datetime.utcnow())
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     comments = db.relationship('Comment', backref='author', lazy='dynamic')
@@ -24,52 +63,74 @@ class User(UserMixin, db.Model):
         backref='user', lazy='dynamic')
 
     def like_post(self, post):
-        if not self.has_liked_post(post):
-            like = PostLike(user_id=self.id, post_id=post.id)
-            db.session.add(like)
+        self._like(PostLike.post_id, post)
 
     def unlike_post(self, post):
-        if self.has_liked_post(post):
-            PostLike.query.filter_by(
-                user_id=self.id,
-                post_id=post.id).delete()
+        self._unlike(PostLike.post_id, post)
 
     def has_liked_post(self, post):
-        return PostLike.query.filter(
-            PostLike.user_id == self.id,
-            PostLike.post_id == post.id).count() > 0
+        return post.id in self._liked_ids(PostLike.post_id, [post])
+
+    def liked_post_ids(self, posts):
+        return self._liked_ids(PostLike.post_id, posts)
 
     def like_photo(self, photo):
-        if not self.has_liked_post(photo):
-            like = PostLike(user_id=self.id, photo_id=photo.id)
-            db.session.add(like)
+        self._like(PostLike.photo_id, photo)
 
     def unlike_photo(self, photo):
-        if self.has_liked_post(photo):
-            PostLike.query.filter_by(
-                user_id=self.id,
-                photo_id=photo.id).delete()
+        self._unlike(PostLike.photo_id, photo)
 
     def has_liked_photo(self, photo):
-        return PostLike.query.filter(
-            PostLike.user_id == self.id,
-            PostLike.photo_id == photo.id).count() > 0
+        return photo.id in self._liked_ids(PostLike.photo_id, [photo])
+
+    def liked_photo_ids(self, photos):
+        return self._liked_ids(PostLike.photo_id, photos)
 
     def like_video(self, video):
-        if not self.has_liked_video(video):
-            like = PostLike(user_id=self.id, video_id=video.id)
-            db.session.add(like)
+        self._like(PostLike.video_id, video)
 
     def unlike_video(self, video):
-        if self.has_liked_post(video):
-            PostLike.query.filter_by(
-                user_id=self.id,
-                video_id=video.id).delete()
+        self._unlike(PostLike.video_id, video)
 
     def has_liked_video(self, video):
-        return PostLike.query.filter(
-            PostLike.user_id == self.id,
-            PostLike.video_id == video.id).count() > 0
+        return video.id in self._liked_ids(PostLike.video_id, [video])
+
+    def liked_video_ids(self, videos):
+        return self._liked_ids(PostLike.video_id, videos)
+
+    # INSERT OR IGNORE, so a like racing another of the same item is dropped by the unique
+    # index instead of failing; the counters move only by the rows really inserted or deleted
+    def _like(self, column, item):
+        inserted = db.session.execute(PostLike.__table__.insert().prefix_with('OR IGNORE', dialect='sqlite').values(
+            {PostLike.user_id: self.id, column: item.id})).rowcount
+        if inserted:
+            bump_counters(item, like_count=inserted)
+
+    def _unlike(self, column, item):
+        deleted = PostLike.query.filter(PostLike.user_id == self.id, column == item.id).delete(
+            synchronize_session=False)
+        if deleted:
+            bump_counters(item, like_count=-deleted)
+
+    # one indexed lookup for a whole page of items instead of one query per item
+    def _liked_ids(self, column, items):
+        ids = [item.id for item in items]
+        if not ids:
+            return frozenset()
+        return frozenset(row[0] for row in db.session.query(column).filter(
+            PostLike.user_id == self.id, column.in_(ids)))
+
+    # item is a Post, Photo or Video
+    def add_comment(self, item, body):
+        comment = Comment(author=self, body=body)
+        item.comments.append(comment)
+        bump_counters(item, comment_count=1)
+        return comment
+
+    def delete_comment(self, comment):
+        if comment.parent is not None:
+            bump_counters(comment.parent, comment_count=-1)
+        db.session.delete(comment)
 
     def __repr__(self):
         return '{}'.format(self.username)
@@ -87,29 +148,39 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
     # get token for reset password
     def get_reset_password_token(self, expires_in=600):
-        return jwt.encode({'reset_password':self.id,  'exp':time()+expires_in}, app.config['SECRET_KEY'], algorithm='HS256')
+        return jwt.encode({'reset_password':self.id,  'exp':time()+expires_in}, current_app.config['SECRET_KEY'], algorithm='HS256')
 
     @staticmethod
     def verify_reset_password_token(token):
         try:
-            id = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])['reset_password']
+            id = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])['reset_password']
         except:
             return
         return User.query.get(id)
 
 class Post(db.Model):
     __tablename__ = 'post'
-    __searchable__ = ['body']
+    __table_args__ = (
+        # feeds filter on one column and page through (timestamp, id); the index ends in the rowid
+        db.Index('ix_post_is_discussion_timestamp', 'is_discussion', 'timestamp'),
+        # the trending page, read straight down the index; see app.trending
+        db.Index('ix_post_is_discussion_trending_score', 'is_discussion', 'trending_score'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140), index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    is_discussion=db.Column(db.Integer, index=True, default=0)
+    is_discussion=db.Column(db.Integer, default=0)
     is_public = db.Column(db.Integer, index=True, default=1)
-    photos = db.relationship('Photo', backref='post', lazy='dynamic')
-    videos = db.relationship('Video', backref='post', lazy='dynamic')
-    comments = db.relationship('Comment', backref='post', lazy='dynamic')
-    likes = db.relationship('PostLike', backref='post', lazy='dynamic')
+    like_count = db.Column(db.Integer, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, default=0, server_default='0')
+    version = db.Column(db.Integer, default=0, server_default='0')
+    trending_score = db.Column(db.Float, default=0, server_default='0')
+    # children go with their parent through ON DELETE CASCADE; see delete_item()
+    photos = db.relationship('Photo', backref='post', lazy='dynamic', passive_deletes=True)
+    videos = db.relationship('Video', backref='post', lazy='dynamic', passive_deletes=True)
+    comments = db.relationship('Comment', backref='post', lazy='dynamic', passive_deletes=True)
+    likes = db.relationship('PostLike', backref='post', lazy='dynamic', passive_deletes=True)
 
     def __repr__(self):
         return '{}'.format(self.timestamp)
@@ -118,49 +189,147 @@ class Post(db.Model):
 
 class PostLike(db.Model):
     __tablename__ = 'post_like'
+    __table_args__ = (
+        db.Index('ix_post_like_user_post', 'user_id', 'post_id', unique=True),
+        db.Index('ix_post_like_user_photo', 'user_id', 'photo_id', unique=True),
+        db.Index('ix_post_like_user_video', 'user_id', 'video_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
-    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'))
-    video_id = db.Column(db.Integer, db.ForeignKey('video.id'))
+    # the unique indexes lead with user_id; these serve the ON DELETE CASCADE lookups
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), index=True)
+    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id', ondelete='CASCADE'), index=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id', ondelete='CASCADE'), index=True)
 
 class Comment(db.Model):
+    __table_args__ = (
+        # a thread newest first, and the ON DELETE CASCADE lookups
+        db.Index('ix_comment_post_id_timestamp', 'post_id', 'timestamp'),
+        db.Index('ix_comment_photo_id_timestamp', 'photo_id', 'timestamp'),
+        db.Index('ix_comment_video_id_timestamp', 'video_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
-    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'))
-    video_id = db.Column(db.Integer, db.ForeignKey('video.id'))
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'))
+    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id', ondelete='CASCADE'))
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id', ondelete='CASCADE'))
+
+    @property
+    def parent(self):
+        if self.post_id:
+            return self.post
+        if self.photo_id:
+            return self.photo
+        if self.video_id:
+            return self.video
 
 class Photo(db.Model):
+    __table_args__ = (
+        db.Index('ix_photo_is_public_timestamp', 'is_public', 'timestamp'),
+        db.Index('ix_photo_is_public_trending_score', 'is_public', 'trending_score'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(140), index=True, default='')
-    is_public = db.Column(db.Integer, index=True, default=1)
+    is_public = db.Column(db.Integer, default=1)
     filename = db.Column(db.String(140), index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
-    likes = db.relationship('PostLike', backref='photo', lazy='dynamic')
-    comments = db.relationship('Comment', backref='photo', lazy='dynamic')
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), index=True)
+    like_count = db.Column(db.Integer, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, default=0, server_default='0')
+    version = db.Column(db.Integer, default=0, server_default='0')
+    trending_score = db.Column(db.Float, default=0, server_default='0')
+    likes = db.relationship('PostLike', backref='photo', lazy='dynamic', passive_deletes=True)
+    comments = db.relationship('Comment', backref='photo', lazy='dynamic', passive_deletes=True)
 
     def __repr__(self):
         return '{}'.format(self.timestamp)
 
 class Video(db.Model):
+    __table_args__ = (
+        db.Index('ix_video_trending_score', 'trending_score'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(140), index=True)
     title = db.Column(db.String(140), index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
-    likes = db.relationship('PostLike', backref='video', lazy='dynamic')
-    comments = db.relationship('Comment', backref='video', lazy='dynamic')
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), index=True)
+    like_count = db.Column(db.Integer, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, default=0, server_default='0')
+    version = db.Column(db.Integer, default=0, server_default='0')
+    trending_score = db.Column(db.Float, default=0, server_default='0')
+    likes = db.relationship('PostLike', backref='video', lazy='dynamic', passive_deletes=True)
+    comments = db.relationship('Comment', backref='video', lazy='dynamic', passive_deletes=True)
 
 
     def __repr__(self):
         return '{}'.format(self.timestamp)
 
 
+class TrendingEpoch(db.Model):
+    # a single row: the unix time trending scores are measured from, moved by Trending.rebase()
+    __tablename__ = 'trending_epoch'
+    id = db.Column(db.Integer, primary_key=True)
+    epoch = db.Column(db.Float, nullable=False)
+
+
+class TimelineEntry(db.Model):
+    # one row per item on the home timeline; written by app.timeline, removed by the cascades
+    __tablename__ = 'timeline_entry'
+    __table_args__ = (
+        db.Index('ix_timeline_entry_timestamp_id', 'timestamp', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), index=True)
+    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id', ondelete='CASCADE'), index=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id', ondelete='CASCADE'), index=True)
+    post = db.relationship('Post')
+    photo = db.relationship('Photo')
+    video = db.relationship('Video')
+
+    def __repr__(self):
+        return '<TimelineEntry {}>'.format(self.id)
+
+
+class VideoUpload(db.Model):
+    # a chunked upload in progress; the bytes are in a spool file, see app.resumable
+    __tablename__ = 'video_upload'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), index=True)
+    title = db.Column(db.String(140))
+    filename = db.Column(db.String(140)) # as on the client, for its extension
+    size = db.Column(db.BigInteger)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return '<VideoUpload {}>'.format(self.id)
+
+
+class OutboxMessage(db.Model):
+    __tablename__ = 'outbox_message'
+    __table_args__ = (
+        db.Index('ix_outbox_message_status_due', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255))
+    sender = db.Column(db.String(120))
+    recipients = db.Column(db.Text) # comma separated
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(16), default='pending') # pending, sent or failed
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<OutboxMessage {} {}>'.format(self.id, self.status)
+
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
\ No newline at end of file
+    return user_cache.get(User, int(id))
\ No newline at end of file
@@ -0,0 +1,236 @@
+import atexit
+import logging
+import queue
+import smtplib
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# how long a claimed message stays reserved for the sender that claimed it
+LEASE = timedelta(minutes=5)
+
+
+def is_permanent(error):
+    """True for SMTP errors that will not go away by trying again (5xx replies)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class Outbox(object):
+    """Outgoing mail, stored in the outbox_message table and sent in the background.
+
+    enqueue() only inserts a row, so a request never waits on the mail
+    server. A sender thread, started by the first request so that what an
+    earlier process left behind goes out too, wakes up when something is
+    queued, or every OUTBOX_POLL_INTERVAL seconds, claims up to
+    OUTBOX_BATCH_SIZE due messages and delivers them over a single SMTP
+    connection. Failed attempts are
+    retried with exponential backoff; after OUTBOX_MAX_ATTEMPTS, or on a
+    permanent 5xx reply, the message is marked failed. post() hands a message
+    over in memory instead, for callers such as logging handlers that must
+    not touch the database themselves.
+    """
+
+    def __init__(self, app=None):
+        self._handoff = queue.Queue(maxsize=1000)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.shutdown)
+        app.before_first_request(self._resume)
+
+    @property
+    def mail(self):
+        """The app's Flask-Mail state, set up on first use."""
+        state = self.app.extensions.get('mail')
+        if state is None:
+            from flask_mail import Mail
+            state = Mail(self.app).state
+        return state
+
+    @property
+    def table(self):
+        return self.app.extensions['sqlalchemy'].db.metadata.tables['outbox_message']
+
+    def enqueue(self, subject, sender, recipients, body, html=None):
+        """Write a message to the outbox and commit the current session.
+
+        The commit takes whatever else the caller has pending in the session
+        along with the message, so call this once those changes are ready.
+        """
+        db = self.app.extensions['sqlalchemy'].db
+        db.session.execute(self.table.insert().values(
+            self._row(subject, sender, recipients, body, html)))
+        db.session.commit()
+        self._start()
+        self._wake.set()
+
+    def post(self, subject, sender, recipients, body, html=None):
+        """Queue a message without touching the database; the sender thread stores it."""
+        try:
+            self._handoff.put_nowait(self._row(subject, sender, recipients, body, html))
+        except queue.Full:
+            return False
+        self._start()
+        self._wake.set()
+        return True
+
+    def send_pending(self):
+        """Deliver the messages that are due. Returns (sent, failed) attempt counts."""
+        self._store_handoff()
+        with self.app.app_context():
+            claimed = self._claim()
+            if not claimed:
+                return 0, 0
+            # Flask-Mail is only loaded by a process that has something to send
+            from flask_mail import Message
+            from app.mailer import OutboxConnection
+            sent = failed = 0
+            try:
+                with OutboxConnection(self.mail, self.app.config['OUTBOX_SMTP_TIMEOUT']) as conn:
+                    while claimed:
+                        row = claimed[0]
+                        try:
+                            conn.send(Message(row.subject, sender=row.sender, recipients=row.recipients.split(','),
+                                              body=row.body, html=row.html))
+                        except smtplib.SMTPServerDisconnected:
+                            raise
+                        except smtplib.SMTPException as e:  # an OSError too, so caught first
+                            self._record_failure(row, e, permanent=is_permanent(e))
+                            failed += 1
+                        else:
+                            self._record_sent(row)
+                            sent += 1
+                        claimed.pop(0)
+            except OSError as e:
+                # no connection, or it is gone; whatever was not sent tries again later
+                logger.warning('Outbox could not talk to %s: %s', self.mail.server, e)
+                for row in claimed:
+                    self._record_failure(row, e)
+                    failed += 1
+            return sent, failed
+
+    def status(self):
+        """Message counts by delivery status."""
+        db = self.app.extensions['sqlalchemy'].db
+        rows = db.session.execute(db.select([self.table.c.status, db.func.count()])
+                                  .group_by(self.table.c.status)).fetchall()
+        return dict(rows)
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        # keep what was handed over; sending is left to the next process
+        self._store_handoff()
+
+    def _row(self, subject, sender, recipients, body, html):
+        now = datetime.utcnow()
+        return dict(subject=subject, sender=sender, recipients=','.join(recipients), body=body, html=html,
+                    status='pending', attempts=0, created_at=now, next_attempt_at=now)
+
+    def _store_handoff(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self._handoff.get_nowait())
+            except queue.Empty:
+                break
+        if not rows:
+            return
+        db = self.app.extensions['sqlalchemy'].db
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(self.table.insert(), rows)
+        except Exception:
+            # not logged through the app logger, which may be what posted them
+            logger.warning('Outbox could not store %d handed-over messages', len(rows), exc_info=True)
+
+    def _claim(self):
+        t = self.table
+        db = self.app.extensions['sqlalchemy'].db
+        now = datetime.utcnow()
+        claimed = []
+        with db.engine.begin() as conn:
+            due = conn.execute(t.select().where(t.c.status == 'pending').where(t.c.next_attempt_at <= now)
+                               .order_by(t.c.next_attempt_at).limit(self.app.config['OUTBOX_BATCH_SIZE'])).fetchall()
+            for row in due:
+                # another sender may have claimed the row since it was read
+                result = conn.execute(t.update().where(t.c.id == row.id).where(t.c.status == 'pending')
+                                      .where(t.c.next_attempt_at == row.next_attempt_at)
+                                      .values(next_attempt_at=now + LEASE))
+                if result.rowcount:
+                    claimed.append(row)
+        return claimed
+
+    def _record_sent(self, row):
+        self._update(row, status='sent', attempts=row.attempts + 1, sent_at=datetime.utcnow(), last_error=None)
+
+    def _record_failure(self, row, error, permanent=False):
+        attempts = row.attempts + 1
+        config = self.app.config
+        message = '{}: {}'.format(type(error).__name__, error)[:255]
+        if permanent or attempts >= config['OUTBOX_MAX_ATTEMPTS']:
+            logger.error('Giving up on outbox message %d to %s: %s', row.id, row.recipients, message)
+            self._update(row, status='failed', attempts=attempts, last_error=message)
+            return
+        delay = min(config['OUTBOX_RETRY_BASE'] * 2 ** (attempts - 1), config['OUTBOX_RETRY_MAX'])
+        self._update(row, attempts=attempts, last_error=message,
+                     next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+
+    def _update(self, row, **values):
+        db = self.app.extensions['sqlalchemy'].db
+        with db.engine.begin() as conn:
+            conn.execute(self.table.update().where(self.table.c.id == row.id).values(**values))
+
+    def _resume(self):
+        # a restarted process sends what was left pending, due for a retry or leased by a dead sender
+        self._start()
+        self._wake.set()
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='outbox-sender', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.app.config['OUTBOX_POLL_INTERVAL'])
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                while self.send_pending()[0]:
+                    pass
+            except Exception:
+                logger.warning('Outbox sender failed', exc_info=True)
+
+
+class OutboxHandler(logging.Handler):
+    """A logging handler that mails records through the outbox instead of over SMTP inline."""
+
+    def __init__(self, outbox, fromaddr, toaddrs, subject):
+        super(OutboxHandler, self).__init__()
+        self.outbox = outbox
+        self.fromaddr = fromaddr
+        self.toaddrs = toaddrs
+        self.subject = subject
+
+    def emit(self, record):
+        if record.name == __name__:
+            return  # mailing the outbox's own failures could feed on itself
+        try:
+            self.outbox.post(self.subject, self.fromaddr, self.toaddrs, self.format(record))
+        except Exception:
+            self.handleError(record)
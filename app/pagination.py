@@ -0,0 +1,95 @@
+from flask import current_app, request
+from sqlalchemy import tuple_
+from datetime import datetime
+
+
+class KeysetPage(object):
+    """One page of a listing ordered newest first.
+
+    `older` and `newer` are cursors for the neighbouring pages, or None when
+    there is nothing more in that direction.
+    """
+
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    return '_'.join(v.isoformat() if isinstance(v, datetime) else str(v) for v in values)
+
+
+def decode_cursor(cursor, columns):
+    parts = cursor.split('_')
+    if len(parts) != len(columns):
+        return None
+    values = []
+    try:
+        for part, column in zip(parts, columns):
+            if column.type.python_type is datetime:
+                values.append(datetime.fromisoformat(part))
+            else:
+                values.append(column.type.python_type(part))
+    except (ValueError, NotImplementedError):
+        return None
+    return tuple(values)
+
+
+def _keyset_rows(query, columns, per_page):
+    # the rows for the page the request asks for, one extra to tell if there are more, and
+    # which cursor was used: 'after' (rows come back oldest first), 'before' or None
+    key = tuple_(*columns)
+    after = request.args.get('after')
+    before = request.args.get('before')
+    after = after and decode_cursor(after, columns)
+    before = before and decode_cursor(before, columns)
+
+    if after:
+        return query.filter(key > tuple_(*after)) \
+            .order_by(*[c.asc() for c in columns]).limit(per_page + 1).all(), 'after'
+    if before:
+        query = query.filter(key < tuple_(*before))
+    return query.order_by(*[c.desc() for c in columns]).limit(per_page + 1).all(), before and 'before'
+
+
+def paginate_keyset(query, columns, per_page=None):
+    """Page through `query` on the key `columns`, e.g. (Post.timestamp, Post.id).
+
+    Reads the `before`/`after` cursors from the request args. Each page is a
+    single range scan on the key, so deep pages cost the same as the first one.
+    """
+    per_page = per_page or current_app.config['POSTS_PER_PAGE']
+    rows, cursor_used = _keyset_rows(query, columns, per_page)
+    if cursor_used == 'after':
+        has_newer = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_older = True
+    else:
+        has_older = len(rows) > per_page
+        items = rows[:per_page]
+        has_newer = cursor_used == 'before'
+
+    def cursor(item):
+        return encode_cursor([getattr(item, c.key) for c in columns])
+
+    return KeysetPage(items,
+                      older=cursor(items[-1]) if items and has_older else None,
+                      newer=cursor(items[0]) if items and has_newer else None)
+
+
+def keyset_marker(query, columns, *extra, per_page=None):
+    """The key and `extra` values of the rows paginate_keyset would return, as plain tuples.
+
+    The same range scan reading only a few columns; it changes whenever the
+    page does, which makes it a cheap source for an ETag.
+    """
+    per_page = per_page or current_app.config['POSTS_PER_PAGE']
+    rows, _ = _keyset_rows(query.with_entities(*(tuple(columns) + extra)), columns, per_page)
+    return [tuple(row) for row in rows]
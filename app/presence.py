@@ -0,0 +1,83 @@
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenBuffer(object):
+    """Collects users' last_seen times in memory and writes them in batches.
+
+    A user is only marked again once their known last_seen is older than
+    LAST_SEEN_GRANULARITY seconds, and pending marks are written by a
+    background thread every LAST_SEEN_FLUSH_INTERVAL seconds with a single
+    executemany UPDATE. Read-only page views therefore never write.
+    """
+
+    def __init__(self, app=None):
+        self._pending = {}
+        self._marked = {} # last mark per user, kept across flushes for cached user rows
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.shutdown)
+
+    def touch(self, user, now=None):
+        now = now or datetime.utcnow()
+        granularity = timedelta(seconds=self.app.config['LAST_SEEN_GRANULARITY'])
+        with self._lock:
+            seen = max(filter(None, (self._marked.get(user.id), user.last_seen)), default=None)
+            if seen is not None and now - seen < granularity:
+                return False
+            self._pending[user.id] = self._marked[user.id] = now
+        self._start()
+        return True
+
+    def flush(self):
+        granularity = timedelta(seconds=self.app.config['LAST_SEEN_GRANULARITY'])
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            horizon = datetime.utcnow() - granularity
+            self._marked = {user_id: seen for user_id, seen in self._marked.items() if seen > horizon}
+        if not pending:
+            return 0
+        db = self.app.extensions['sqlalchemy'].db
+        table = db.metadata.tables['user']
+        stmt = table.update().where(table.c.id == bindparam('user_id')) \
+            .values(last_seen=bindparam('seen'))
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(stmt, [{'user_id': user_id, 'seen': seen}
+                                        for user_id, seen in pending.items()])
+        except Exception:
+            logger.exception('Could not write last_seen for %d users', len(pending))
+            with self._lock:
+                for user_id, seen in pending.items():
+                    if self._pending.get(user_id, seen) <= seen:
+                        self._pending[user_id] = seen
+            return 0
+        return len(pending)
+
+    def shutdown(self):
+        self._stop.set()
+        self.flush()
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='last-seen-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.app.config['LAST_SEEN_FLUSH_INTERVAL']):
+            self.flush()
@@ -0,0 +1,85 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Reaper(object):
+    """Removes uploaded files in the background after the rows using them are deleted.
+
+    Routes call schedule() once their delete has committed. A daemon thread
+    removes each file REAPER_DELAY seconds later, so responses still
+    streaming it can finish, and only if no row refers to it any more, since
+    uploads are stored once per content, and no upload stored or reused it
+    in the last REAPER_MIN_AGE seconds. Image derivatives go with their
+    original. Files still queued when the process exits are left on disk
+    for `flask storage orphans` to find.
+    """
+
+    def __init__(self, app=None, derivatives=None):
+        self._queue = [] # (due, sequence, upload set, filename)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app, derivatives)
+
+    def init_app(self, app, derivatives):
+        self.app = app
+        self.derivatives = derivatives
+        app.config.setdefault('REAPER_DELAY', 60)
+        app.config.setdefault('REAPER_MIN_AGE', 300)
+
+    def schedule(self, uploads, filenames):
+        due = time.monotonic() + self.app.config['REAPER_DELAY']
+        with self._lock:
+            for filename in filenames:
+                if filename:
+                    heapq.heappush(self._queue, (due, next(self._sequence), uploads, filename))
+        self._start()
+        self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._queue)
+
+    def reap(self, everything=False):
+        """Remove the files that are due, or all queued ones. Returns the number removed."""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._queue and (everything or self._queue[0][0] <= now):
+                due.append(heapq.heappop(self._queue))
+        removed = 0
+        min_age = self.app.config['REAPER_MIN_AGE']
+        with self.app.app_context():
+            for _, _, uploads, filename in due:
+                try:
+                    if uploads.discard(filename, min_age):
+                        removed += 1
+                        if self.derivatives is not None and uploads is self.derivatives.uploads:
+                            self.derivatives.discard(filename)
+                except Exception:
+                    logger.warning('Could not remove %s/%s', uploads.name, filename, exc_info=True)
+        return removed
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='upload-reaper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+            if timeout is None or timeout > 0:
+                self._wake.wait(timeout)
+                self._wake.clear()
+            self.reap()
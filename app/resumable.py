@@ -0,0 +1,159 @@
+import os
+import time
+import fcntl
+import secrets
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask_uploads import UploadNotAllowed, extension
+from app.storage import CHUNK_SIZE, walk_files
+
+SPOOL_DIR = '.uploads'
+
+
+class UploadError(Exception):
+    """A request the upload protocol refuses; `status` is the HTTP status to answer with."""
+
+    def __init__(self, status, message, offset=None):
+        super(UploadError, self).__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ResumableUploads(object):
+    """Large files uploaded in chunks that survive a dropped connection.
+
+    create() records an upload of a declared size and opens an empty spool
+    file for it. write() appends the bytes of one request at the offset the
+    client says it is at, streaming them to disk CHUNK_SIZE at a time; the
+    spool's length is the acknowledged offset, so after an interruption the
+    client asks for it and carries on from there. finish() checks the size
+    and adopts the spool into the upload set, which runs its processing and
+    moves it into place in one rename. Uploads untouched for
+    RESUMABLE_UPLOAD_EXPIRY seconds are removed by collect_garbage().
+    """
+
+    def __init__(self, app=None, uploads=None, db=None):
+        self._next_collection = 0
+        if app is not None:
+            self.init_app(app, uploads, db)
+
+    def init_app(self, app, uploads, db):
+        self.app = app
+        self.uploads = uploads
+        self.db = db
+        app.config.setdefault('RESUMABLE_UPLOAD_MAX_SIZE', 2 * 2**30)
+        app.config.setdefault('RESUMABLE_UPLOAD_CHUNK_SIZE', 8 * 2**20)
+        app.config.setdefault('RESUMABLE_UPLOAD_EXPIRY', 24 * 3600)
+
+    @property
+    def model(self):
+        from app.models import VideoUpload
+        return VideoUpload
+
+    @property
+    def spool_dir(self):
+        return os.path.join(self.uploads.config.destination, SPOOL_DIR)
+
+    def spool_path(self, upload):
+        return os.path.join(self.spool_dir, upload.id)
+
+    def offset(self, upload):
+        try:
+            return os.path.getsize(self.spool_path(upload))
+        except FileNotFoundError:
+            return 0
+
+    def create(self, user, filename, size, **fields):
+        """Start an upload of `size` bytes and add its row to the session."""
+        if not filename or not self.uploads.extension_allowed(extension(filename).lower()):
+            raise UploadError(415, 'File type not allowed.')
+        if size <= 0 or size > self.app.config['RESUMABLE_UPLOAD_MAX_SIZE']:
+            raise UploadError(413, 'Uploads must be between 1 byte and {} bytes.'.format(
+                self.app.config['RESUMABLE_UPLOAD_MAX_SIZE']))
+        if time.monotonic() >= self._next_collection:
+            self._next_collection = time.monotonic() + self.app.config['RESUMABLE_UPLOAD_EXPIRY'] / 24
+            self.collect_garbage()
+        now = datetime.utcnow()
+        upload = self.model(id=secrets.token_hex(16), user_id=user.id, filename=filename, size=size,
+                            created_at=now, updated_at=now, **fields)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        open(self.spool_path(upload), 'xb').close()
+        self.db.session.add(upload)
+        return upload
+
+    def write(self, upload, offset, stream, length=None):
+        """Append a request body at `offset` and return the new offset."""
+        if length is not None and length > self.app.config['RESUMABLE_UPLOAD_CHUNK_SIZE']:
+            raise UploadError(413, 'Chunks may be at most {} bytes.'.format(
+                self.app.config['RESUMABLE_UPLOAD_CHUNK_SIZE']))
+        with self._locked(upload) as spool:
+            current = os.fstat(spool.fileno()).st_size
+            if offset != current:
+                raise UploadError(409, 'Expected offset {}.'.format(current), current)
+            spool.seek(current)
+            written = 0
+            limit = min(upload.size - current, self.app.config['RESUMABLE_UPLOAD_CHUNK_SIZE'])
+            try:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    written += len(chunk)
+                    if written > limit:
+                        # keep what fitted; the client learns the offset and stops there
+                        spool.write(chunk[:len(chunk) - (written - limit)])
+                        raise UploadError(413, 'Chunk runs past the declared size or the chunk limit.',
+                                          current + limit)
+                    spool.write(chunk)
+            finally:
+                # an interrupted body still counts for what reached the disk
+                spool.flush()
+                os.fsync(spool.fileno())
+            upload.updated_at = datetime.utcnow()
+            return current + written
+
+    def finish(self, upload):
+        """Move the complete spool into the upload set and return its filename there."""
+        with self._locked(upload) as spool:
+            offset = os.fstat(spool.fileno()).st_size
+            if offset != upload.size:
+                raise UploadError(409, 'The upload is incomplete.', offset)
+            try:
+                return self.uploads.adopt(self.spool_path(upload), extension(upload.filename))
+            except UploadNotAllowed:
+                raise UploadError(415, 'File type not allowed.')
+
+    def discard(self, upload):
+        try:
+            os.remove(self.spool_path(upload))
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self):
+        """Remove uploads idle for longer than the expiry, and spool files with no upload. Returns the count."""
+        model = self.model
+        expiry = self.app.config['RESUMABLE_UPLOAD_EXPIRY']
+        stale = model.query.filter(model.updated_at < datetime.utcnow() - timedelta(seconds=expiry)).all()
+        for upload in stale:
+            self.discard(upload)
+            self.db.session.delete(upload)
+        self.db.session.commit()
+        removed = len(stale)
+        # spools whose row never committed, or was removed without them
+        cutoff = time.time() - expiry
+        for name, entry in walk_files(self.spool_dir):
+            if entry.stat().st_mtime < cutoff and model.query.get(name) is None:
+                os.remove(entry.path)
+                removed += 1
+        return removed
+
+    @contextmanager
+    def _locked(self, upload):
+        # one request at a time per upload, across worker processes
+        try:
+            spool = open(self.spool_path(upload), 'r+b')
+        except FileNotFoundError:
+            raise UploadError(404, 'This upload has expired.')
+        with spool:
+            try:
+                fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError(409, 'Another request for this upload is in progress.', self.offset(upload))
+            yield spool
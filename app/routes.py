@@ -1,76 +1,161 @@
-from app import app, db, images, clips
-from flask import render_template, request, redirect, url_for, flash
+from app import db, images, clips, last_seen, derivatives, search_index, fragments, user_cache, metrics, reaper, timeline, etags, resumable, trending, events, usernames
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, send_from_directory, g, jsonify, abort, Response
 from flask_login import current_user, login_user, logout_user, login_required
 from werkzeug.urls import url_parse
 from app.forms import VideoTitleForm, PhotoTitleForm, LoginForm, RegistrationForm, EditProfileForm, PostForm, ResetPasswordRequestForm, ResetPasswordForm, EditProfilePictureForm, VerificationForm, VideoForm, PhotoForm, CommentForm, EditCommentForm, SearchForm
-from app.models import User, Post, Photo, Video, Comment
+from app.models import User, Post, Photo, Video, Comment, TimelineEntry, VideoUpload, bump_counters, delete_item
 from app.email import send_password_reset_email
-from datetime import datetime
+from app.pagination import paginate_keyset, keyset_marker
 from flask_uploads import UploadNotAllowed
+from sqlalchemy.orm import selectinload
+from flask_wtf.csrf import validate_csrf
+from wtforms import ValidationError
+from app.resumable import UploadError
 from functools import wraps
-import flask_whooshalchemy as whooshalchemy
+import os
+import re
 
+bp = Blueprint('main', __name__)
 
 
-@app.before_request # insert code before view function
+@bp.before_app_request # insert code before view function
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow() # update the time
-        db.session.commit()
+        # buffered, written in batches by a background thread
+        if last_seen.touch(current_user):
+            usernames.touch(current_user)
+        g.search_form = SearchForm()
 
 def verified_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if current_user.verified != 1:
             flash('You are not a verified user yet.')
-            return redirect(url_for('verification'))
+            return redirect(url_for('main.verification'))
 
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+def admin_required(f):
+    # is_admin is only set with `flask users admin`; an email address proves nothing, it is never checked
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated or current_user.verified != 1 or current_user.is_admin != 1:
+            abort(404)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def csrf_header_required(f):
+    # for requests sent by scripts, which put the form's CSRF token in a header
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and current_app.config.get('WTF_CSRF_ENABLED', True):
+            try:
+                validate_csrf(request.headers.get('X-CSRFToken'))
+            except ValidationError as e:
+                return jsonify(error=str(e)), 400
+        return f(*args, **kwargs)
+    return decorated_function
 
-@app.route('/about')
+def admin_or_token_required(f):
+    # lets a metrics scraper in with "Authorization: Bearer <METRICS_TOKEN>"
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = current_app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') == 'Bearer ' + token:
+            return f(*args, **kwargs)
+        return admin_required(f)(*args, **kwargs)
+    return decorated_function
+
+def page_marker(query, columns, *extra, images=()):
+    # what a listing page shows: its rows' keys and `extra` columns, and the `images`
+    # columns with whether their resized copies are ready, which changes the <img> tags
+    rows = keyset_marker(query, columns, *(extra + tuple(images)))
+    if not images:
+        return rows
+    return [row + tuple(derivatives.is_ready(filename) for filename in row[-len(images):]) for row in rows]
+
+def comment_page(condition):
+    # newest first, with the authors of the whole page in one more query
+    return paginate_keyset(Comment.query.options(selectinload(Comment.author)).filter(condition),
+                           (Comment.timestamp, Comment.id), current_app.config['COMMENTS_PER_PAGE'])
+
+def item_channel(item):
+    return '{}-{}'.format(type(item).__tablename__, item.id)
+
+def publish_counts(item):
+    # after the commit, so the counters are read back with what others changed meanwhile
+    channels = [item_channel(item)]
+    if isinstance(item, Post) and item.is_discussion:
+        channels.append('discussion')
+    events.publish(channels, 'counts', item=item_channel(item), like_count=item.like_count,
+                   comment_count=item.comment_count)
+
+def publish_comment(comment):
+    author = comment.author
+    events.publish(item_channel(comment.parent), 'comment', id=comment.id, body=comment.body, author={
+        'username': author.username, 'avatar': derivatives.src(author.profile_picture, 90),
+        'url': url_for('main.profile', username=author.username)})
+    publish_counts(comment.parent)
+
+@bp.route('/')
+def index():
+    if not (current_user.is_authenticated and current_user.verified):
+        return render_template('index.html')
+    items = timeline.hydrate(paginate_keyset(TimelineEntry.query, (TimelineEntry.timestamp, TimelineEntry.id),
+                                             current_app.config['TIMELINE_PER_PAGE']))
+    liked = {
+        'post': current_user.liked_post_ids([item for kind, item in items if kind == 'post']),
+        'photo': current_user.liked_photo_ids([item for kind, item in items if kind == 'photo']),
+        'video': current_user.liked_video_ids([item for kind, item in items if kind == 'video']),
+    }
+    return render_template('index.html', items=items, liked=liked)
+
+@bp.route('/about')
 def about():
     return render_template('about.html', title='About')
 
-@app.route('/search')
+@bp.route('/search')
+@login_required
+@verified_required
 def search():
-    res = Post.query.whoosh_search('n')
-    return render_template('search.html', res)
-
-@app.route('/login', methods=['GET','POST'])
+    if not g.search_form.validate():
+        return redirect(url_for('main.discussion'))
+    kind = request.args.get('type', 'posts')
+    page = max(request.args.get('page', 1, type=int), 1)
+    results = search_index.query(kind, g.search_form.q.data, page)
+    return render_template('search.html', title='Search', results=results, q=g.search_form.q.data)
+
+@bp.route('/login', methods=['GET','POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user is None or not user.check_password(form.password.data):
             flash('Invalid username or password')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         login_user(user, remember=form.remember_me.data) # flask_login remember_me
 
         next_page = request.args.get('next') # handles login_required
         if not next_page or url_parse(next_page).netloc != '': # url_parse for security purposes
-            next_page = url_for('index')
+            next_page = url_for('main.index')
         return redirect(next_page)
 
     return render_template('login.html', title='Sign In', form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     form=RegistrationForm()
     if form.validate_on_submit():
@@ -81,32 +166,36 @@ def register():
 
         db.session.add(user)
         db.session.commit()
+        usernames.update(user)
         flash('You are now a register user!')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html', title='Register', form=form)
 
-@app.route('/profile/<username>')
+@bp.route('/profile/<username>')
 @login_required
 def profile(username):
     user = User.query.filter_by(username=username).first_or_404()
 
     return render_template('user.html', title=username, user=user)
 
-@app.route('/edit_profile', methods=['POST','GET'])
+@bp.route('/edit_profile', methods=['POST','GET'])
 @login_required
 def edit_profile():
     form = EditProfileForm(current_user.username)
     if form.validate_on_submit():
+        previous = current_user.username
         current_user.username = form.username.data
         current_user.about_me = form.about_me.data
         db.session.commit()
-        return redirect(url_for('profile', username=current_user.username))
+        user_cache.invalidate(current_user)
+        usernames.update(current_user, previous)
+        return redirect(url_for('main.profile', username=current_user.username))
     elif request.method=='GET': # current username and about_me
         form.username.data=current_user.username
         form.about_me.data=current_user.about_me
     return render_template('edit_profile.html', title='Edit Profile', form=form)
 
-@app.route('/edit_profile_picture', methods=['GET', 'POST'])
+@bp.route('/edit_profile_picture', methods=['GET', 'POST'])
 @login_required
 def edit_profile_picture():
     edit_profile_picture_form = EditProfilePictureForm()
@@ -114,138 +203,170 @@ def edit_profile_picture():
 
         post = Post(body='',author=current_user)
         try:
-            filename = images.save(edit_profile_picture_form.photo.data, folder='profile/'+current_user.username)
+            filename = images.save(edit_profile_picture_form.photo.data)
+            derivatives.schedule(filename)
             current_user.profile_picture = filename
             photo = Photo(filename=filename, post=post, is_public=0)
             db.session.add(photo)
         except UploadNotAllowed:
             flash('File Format Not Allowed.')
-            return redirect(url_for('profile', username=current_user.username))
+            return redirect(url_for('main.profile', username=current_user.username))
         db.session.commit()
+        user_cache.invalidate(current_user)
         flash('Profile Picture Changed')
-        return redirect(url_for('profile', username=current_user.username))
+        return redirect(url_for('main.profile', username=current_user.username))
     elif request.method == 'GET':
         edit_profile_picture_form.photo.data = current_user.profile_picture
 
     return render_template('edit_profile_picture.html', title='Edit Profile Picture', edit_profile_picture_form=edit_profile_picture_form)
 
-@app.route('/discussion', methods=['GET','POST'])
+@bp.route('/discussion', methods=['GET','POST'])
 @login_required
 @verified_required
+@etags.conditional(lambda: page_marker(
+    Post.query.join(Post.author).filter(Post.is_discussion==1), (Post.timestamp, Post.id),
+    Post.version, User.username, images=(User.profile_picture,)))
 def discussion():
     post_form=PostForm()
     if post_form.post_submit.data and post_form.validate_on_submit():
         post = Post(body=post_form.post.data,author=current_user, is_discussion=1)
         db.session.add(post)
         db.session.commit()
+        events.publish('discussion', 'post', id=post.id, url=url_for('main.post', id=post.id))
         flash('Posted successfully!')
-        return redirect(url_for('discussion'))
-    posts = Post.query.filter(Post.is_discussion==1).order_by(Post.timestamp.desc()).all()
-    return render_template('discussion.html', title='Discussion', posts=posts, post_form=post_form)
+        return redirect(url_for('main.discussion'))
+    posts = paginate_keyset(Post.query.options(selectinload(Post.author)).filter(Post.is_discussion==1),
+                            (Post.timestamp, Post.id))
+    liked = current_user.liked_post_ids(posts)
+    return render_template('discussion.html', title='Discussion', posts=posts, post_form=post_form, liked=liked)
 
-@app.route('/post/<id>', methods=['GET','POST'])
+@bp.route('/post/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def post(id):
     comment_form=CommentForm()
     if comment_form.comment_submit.data and comment_form.validate_on_submit():
         post_id=request.form.get("post_id","")
-        post=Post.query.filter_by(id=post_id).first()
-        comment = Comment(author=current_user, body=comment_form.post.data, post=post)
-        db.session.add(comment)
+        post=Post.query.filter_by(id=post_id).first_or_404()
+        comment = current_user.add_comment(post, comment_form.post.data)
+        fragments.invalidate(post)
         db.session.commit()
+        publish_comment(comment)
         flash('Commented')
         return redirect(request.referrer)
-    post = Post.query.filter_by(id=id).first()
-    comments = Comment.query.filter(Comment.post_id==id).order_by(Comment.timestamp.desc()).all()
-    return render_template('post.html', title='Post', post=post, comment_form=comment_form,comments=comments)
+    post = Post.query.filter_by(id=id).first_or_404()
+    comments = comment_page(Comment.post_id == post.id)
+    return render_template('post.html', title='Post', post=post, comment_form=comment_form, comments=comments,
+                           liked=current_user.liked_post_ids([post]))
 
-@app.route('/like-post/<int:post_id>/<action>')
+@bp.route('/like-post/<int:post_id>/<action>')
 @login_required
 @verified_required
 def like_post_action(post_id, action):
     post = Post.query.filter_by(id=post_id).first_or_404()
     if action == 'like':
         current_user.like_post(post)
+        fragments.invalidate(post)
         db.session.commit()
+        publish_counts(post)
     if action == 'unlike':
         current_user.unlike_post(post)
+        fragments.invalidate(post)
         db.session.commit()
+        publish_counts(post)
     return redirect(request.referrer)
 
-@app.route('/like-photo/<int:photo_id>/<action>')
+@bp.route('/like-photo/<int:photo_id>/<action>')
 @login_required
 @verified_required
 def like_photo_action(photo_id, action):
     photo = Photo.query.filter_by(id=photo_id).first_or_404()
     if action == 'like':
         current_user.like_photo(photo)
+        fragments.invalidate(photo)
         db.session.commit()
+        publish_counts(photo)
     if action == 'unlike':
         current_user.unlike_photo(photo)
+        fragments.invalidate(photo)
         db.session.commit()
+        publish_counts(photo)
     return redirect(request.referrer)
 
-@app.route('/like-video/<int:video_id>/<action>')
+@bp.route('/like-video/<int:video_id>/<action>')
 @login_required
 @verified_required
 def like_video_action(video_id, action):
     video = Video.query.filter_by(id=video_id).first_or_404()
     if action == 'like':
         current_user.like_video(video)
+        fragments.invalidate(video)
         db.session.commit()
+        publish_counts(video)
     if action == 'unlike':
         current_user.unlike_video(video)
+        fragments.invalidate(video)
         db.session.commit()
+        publish_counts(video)
     return redirect(request.referrer)
 
-@app.route('/photos', methods=['GET','POST'])
+@bp.route('/photos', methods=['GET','POST'])
 @login_required
 @verified_required
+@etags.conditional(lambda: page_marker(
+    Photo.query.join(Photo.post).join(Post.author).filter(Photo.is_public==1), (Photo.timestamp, Photo.id),
+    Photo.version, User.username, images=(Photo.filename, User.profile_picture)))
 def photos():
     photo_form = PhotoForm()
     if photo_form.validate_on_submit():
         if not (request.files['files'].filename!='' or photo_form.post.data):
             flash('At least one field must have a value.')
-            return redirect(url_for('photos'))
+            return redirect(url_for('main.photos'))
         else:
             post = Post(body=photo_form.post.data,author=current_user)
             for file in photo_form.files.data:
                 try:
                     filename = images.save(file)
+                    derivatives.schedule(filename)
                     photo = Photo(filename=filename, title=photo_form.post.data, post=post, is_public=1)
                     db.session.add(photo)
                 except UploadNotAllowed:
                     flash('File Format Not Allowed.')
-                    return redirect(url_for('photos'))
+                    return redirect(url_for('main.photos'))
             db.session.commit()
             flash('Photo(s) Uploaded.')
-            return redirect(url_for('photos'))
+            return redirect(url_for('main.photos'))
 
-    photos = Photo.query.filter(Photo.is_public==1).order_by(Photo.timestamp.desc()).all()
-    return render_template('photos.html', title='Photos', photo_form=photo_form, photos=photos)
+    photos = paginate_keyset(Photo.query.options(selectinload(Photo.post).selectinload(Post.author))
+                             .filter(Photo.is_public==1), (Photo.timestamp, Photo.id))
+    liked = current_user.liked_photo_ids(photos)
+    return render_template('photos.html', title='Photos', photo_form=photo_form, photos=photos, liked=liked)
 
-@app.route('/photo/<id>', methods=['GET','POST'])
+@bp.route('/photo/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def photo(id):
     comment_form=CommentForm()
     if comment_form.comment_submit.data and comment_form.validate_on_submit():
         photo_id=request.form.get("photo_id","")
-        photo=Photo.query.filter_by(id=photo_id).first()
-        comment = Comment(author=current_user, body=comment_form.post.data, photo=photo)
-        db.session.add(comment)
+        photo=Photo.query.filter_by(id=photo_id).first_or_404()
+        comment = current_user.add_comment(photo, comment_form.post.data)
+        fragments.invalidate(photo)
         db.session.commit()
+        publish_comment(comment)
         flash('Commented')
         return redirect(request.referrer)
-    photo = Photo.query.filter_by(id=id).first()
-
-    comments = Comment.query.filter(Comment.photo_id==photo.id).order_by(Comment.timestamp.desc()).all()
-    return render_template('photo.html', title='Photo', photo=photo, comment_form=comment_form,comments=comments)
+    photo = Photo.query.filter_by(id=id).first_or_404()
+    comments = comment_page(Comment.photo_id == photo.id)
+    return render_template('photo.html', title='Photo', photo=photo, comment_form=comment_form, comments=comments,
+                           liked=current_user.liked_photo_ids([photo]))
 
-@app.route('/videos', methods=['GET','POST'])
+@bp.route('/videos', methods=['GET','POST'])
 @login_required
 @verified_required
+@etags.conditional(lambda: page_marker(
+    Video.query.join(Video.post).join(Post.author), (Video.timestamp, Video.id),
+    Video.version, User.username, images=(User.profile_picture,)))
 def videos():
     video_form = VideoForm()
     if video_form.validate_on_submit():
@@ -257,32 +378,109 @@ def videos():
                 db.session.add(video)
                 db.session.commit()
                 flash('Video Uploaded.')
-                return redirect(url_for('videos'))
+                return redirect(url_for('main.videos'))
             except UploadNotAllowed:
                 flash('File Format Not Allowed.')
-                return redirect(url_for('videos'))
-    videos = Video.query.order_by(Video.timestamp.desc()).all()
-    return render_template('videos.html', title='Videos', videos=videos, video_form=video_form)
+                return redirect(url_for('main.videos'))
+    videos = paginate_keyset(Video.query.options(selectinload(Video.post).selectinload(Post.author)),
+                             (Video.timestamp, Video.id))
+    liked = current_user.liked_video_ids(videos)
+    return render_template('videos.html', title='Videos', videos=videos, video_form=video_form, liked=liked)
+
+def own_upload(id):
+    upload = VideoUpload.query.get(id)
+    if upload is None or upload.user_id != current_user.id:
+        raise UploadError(404, 'No such upload.')
+    return upload
+
+def upload_status(upload, offset, status=200):
+    response = jsonify(id=upload.id, url=url_for('main.video_upload', id=upload.id), offset=offset, size=upload.size,
+                       chunk_size=current_app.config['RESUMABLE_UPLOAD_CHUNK_SIZE'])
+    response.headers['Upload-Offset'] = str(offset)
+    return response, status
+
+# chunked uploads: POST to start one, PUT each chunk with its Upload-Offset, GET for the
+# offset to resume from after a failure, POST .../finish to publish; see app.resumable
+@bp.route('/videos/uploads', methods=['POST'])
+@login_required
+@verified_required
+@csrf_header_required
+def video_uploads():
+    data = request.get_json(silent=True) or {}
+    title = (data.get('title') or '').strip()
+    if not 1 <= len(title) <= 100:
+        raise UploadError(400, 'A title of 1 to 100 characters is required.')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        raise UploadError(400, 'The file size is required.')
+    upload = resumable.create(current_user, data.get('filename'), size, title=title)
+    db.session.commit()
+    return upload_status(upload, 0, 201)
+
+@bp.route('/videos/uploads/<id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+@verified_required
+@csrf_header_required
+def video_upload(id):
+    upload = own_upload(id)
+    if request.method == 'DELETE':
+        resumable.discard(upload)
+        db.session.delete(upload)
+        db.session.commit()
+        return '', 204
+    if request.method == 'PUT':
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            raise UploadError(400, 'Upload-Offset header is required.', resumable.offset(upload))
+        offset = resumable.write(upload, offset, request.stream, request.content_length)
+        db.session.commit()
+        return upload_status(upload, offset)
+    return upload_status(upload, resumable.offset(upload))
 
-@app.route('/video/<id>', methods=['GET','POST'])
+@bp.route('/videos/uploads/<id>/finish', methods=['POST'])
+@login_required
+@verified_required
+@csrf_header_required
+def finish_video_upload(id):
+    upload = own_upload(id)
+    filename = resumable.finish(upload)
+    video = Video(title=upload.title, filename=filename, post=Post(body=upload.title, author=current_user))
+    db.session.add(video)
+    db.session.delete(upload)
+    db.session.commit()
+    flash('Video Uploaded.')
+    return jsonify(id=video.id, url=url_for('main.video', id=video.id)), 201
+
+@bp.route('/media/videos/<path:filename>')
+def media_video(filename):
+    # conditional=True answers Range/If-Range/If-None-Match and streams through wsgi.file_wrapper
+    response = send_from_directory(os.path.abspath(clips.config.destination), filename,
+                                   conditional=True, cache_timeout=current_app.config['MEDIA_CACHE_TIMEOUT'])
+    response.headers['Accept-Ranges'] = 'bytes' # lets players seek before the first range request
+    return response
+
+@bp.route('/video/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def video(id):
     comment_form=CommentForm()
     if comment_form.comment_submit.data and comment_form.validate_on_submit():
         video_id=request.form.get("video_id","")
-        video=Video.query.filter_by(id=video_id).first()
-        comment = Comment(author=current_user, body=comment_form.post.data, video=video)
-        db.session.add(comment)
+        video=Video.query.filter_by(id=video_id).first_or_404()
+        comment = current_user.add_comment(video, comment_form.post.data)
+        fragments.invalidate(video)
         db.session.commit()
+        publish_comment(comment)
         flash('Commented')
         return redirect(request.referrer)
-    video = Video.query.filter_by(id=id).first()
+    video = Video.query.filter_by(id=id).first_or_404()
+    comments = comment_page(Comment.video_id == video.id)
+    return render_template('video.html', title='Video', video=video, comment_form=comment_form, comments=comments,
+                           liked=current_user.liked_video_ids([video]))
 
-    comments = Comment.query.filter(Comment.video_id==video.id).order_by(Comment.timestamp.desc()).all()
-    return render_template('video.html', title='Video', video=video, comment_form=comment_form,comments=comments)
-
-@app.route('/verification', methods=['GET','POST'])
+@bp.route('/verification', methods=['GET','POST'])
 @login_required
 def verification():
     verification_form=VerificationForm()
@@ -302,24 +500,29 @@ def verification():
         if label1 == 'Goup' and label2=='2' and label3=='Washington D.C':
             current_user.verified = 1
             db.session.commit()
+            user_cache.invalidate(current_user)
+            usernames.update(current_user)
             flash('You are now a verified user.')
         else:
             flash('Wrong answer(s). Please answer again.')
-            return redirect(url_for('verification'))
-        return redirect(url_for('discussion'))
+            return redirect(url_for('main.verification'))
+        return redirect(url_for('main.discussion'))
     return render_template('verification.html', title='Verification',verification_form=verification_form)
 
-@app.route('/delete-post/<id>', methods=['GET','POST'])
+@bp.route('/delete-post/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def delete_post(id):
-    post = Post.query.filter_by(id=id).first()
-    db.session.delete(post)
+    post = Post.query.filter_by(id=id).first_or_404()
+    fragments.invalidate(post)
+    files = delete_item(post)
     db.session.commit()
+    for uploads, filenames in files:
+        reaper.schedule(uploads, filenames)
     flash('Post deleted.')
-    return redirect(url_for('discussion'))
+    return redirect(url_for('main.discussion'))
 
-@app.route('/edit-post/<id>', methods=['GET','POST'])
+@bp.route('/edit-post/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def edit_post(id):
@@ -328,26 +531,33 @@ def edit_post(id):
 
     if post_form.validate_on_submit():
         post.body = post_form.post.data
+        bump_counters(post)
+        fragments.invalidate(post)
         db.session.commit()
         flash('Post edited successfully.')
 
-        return redirect(url_for('post',id=id))
+        return redirect(url_for('main.post',id=id))
     elif request.method=='GET':
         post_form.post.data=post.body
 
     return render_template('edit_post.html', title='Edit Post', post_form=post_form)
 
-@app.route('/delete-comment/<id>', methods=['GET','POST'])
+@bp.route('/delete-comment/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def delete_comment(id):
     comment = Comment.query.filter_by(id=id).first()
-    db.session.delete(comment)
+    parent = comment.parent
+    fragments.invalidate(parent)
+    current_user.delete_comment(comment)
     db.session.commit()
+    if parent is not None:
+        events.publish(item_channel(parent), 'comment_deleted', id=int(id))
+        publish_counts(parent)
     flash('Comment deleted.')
     return redirect(request.referrer)
 
-@app.route('/edit-comment/<id>', methods=['GET','POST'])
+@bp.route('/edit-comment/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def edit_comment(id):
@@ -359,18 +569,18 @@ def edit_comment(id):
         db.session.commit()
         flash('Comment edited successfully.')
         if comment.post_id:
-            return redirect(url_for('post', id=comment.post_id))
+            return redirect(url_for('main.post', id=comment.post_id))
         if comment.photo_id:
-            return redirect(url_for('photo', id=comment.photo_id))
+            return redirect(url_for('main.photo', id=comment.photo_id))
         if comment.video_id:
-            return redirect(url_for('video', id=comment.video_id))
+            return redirect(url_for('main.video', id=comment.video_id))
         return redirect(request.referrer)
     elif request.method=='GET':
         edit_comment_form.body.data=comment.body
 
     return render_template('edit_comment.html', title='Edit Comment', edit_comment_form=edit_comment_form)
 
-@app.route('/edit-photo/<id>', methods=['GET','POST'])
+@bp.route('/edit-photo/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def edit_photo(id):
@@ -378,24 +588,29 @@ def edit_photo(id):
     photo_title_form = PhotoTitleForm()
     if photo_title_form.validate_on_submit():
         photo.title = photo_title_form.title.data
+        bump_counters(photo)
+        fragments.invalidate(photo)
         db.session.commit()
         flash('Photo edited successfully.')
-        return redirect(url_for('photo',id=photo.id))
+        return redirect(url_for('main.photo',id=photo.id))
     elif request.method=='GET':
         photo_title_form.title.data=photo.title
     return render_template('edit_photo.html', title='Edit Photo', photo_title_form=photo_title_form)
 
-@app.route('/delete-photo/<id>', methods=['GET','POST'])
+@bp.route('/delete-photo/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def delete_photo(id):
-    photo = Photo.query.filter_by(id=id).first()
-    db.session.delete(photo)
+    photo = Photo.query.filter_by(id=id).first_or_404()
+    fragments.invalidate(photo)
+    files = delete_item(photo)
     db.session.commit()
+    for uploads, filenames in files:
+        reaper.schedule(uploads, filenames)
     flash('Photo deleted.')
-    return redirect(url_for('photos'))
+    return redirect(url_for('main.photos'))
 
-@app.route('/edit-video/<id>', methods=['GET','POST'])
+@bp.route('/edit-video/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def edit_video(id):
@@ -403,59 +618,115 @@ def edit_video(id):
     video_title_form = VideoTitleForm()
     if video_title_form.validate_on_submit():
         video.title = video_title_form.title.data
+        bump_counters(video)
+        fragments.invalidate(video)
         db.session.commit()
         flash('Video edited successfully.')
-        return redirect(url_for('video',id=video.id))
+        return redirect(url_for('main.video',id=video.id))
     elif request.method=='GET':
         video_title_form.title.data=video.title
     return render_template('edit_video.html', title='Edit Video', video_title_form=video_title_form)
 
-@app.route('/delete-video/<id>', methods=['GET','POST'])
+@bp.route('/delete-video/<id>', methods=['GET','POST'])
 @login_required
 @verified_required
 def delete_video(id):
-    video = Video.query.filter_by(id=id).first()
-    db.session.delete(video)
+    video = Video.query.filter_by(id=id).first_or_404()
+    fragments.invalidate(video)
+    files = delete_item(video)
     db.session.commit()
+    for uploads, filenames in files:
+        reaper.schedule(uploads, filenames)
     flash('Video deleted.')
-    return redirect(url_for('videos'))
+    return redirect(url_for('main.videos'))
 
-@app.route('/members')
+@bp.route('/members')
 @login_required
 @verified_required
+@etags.conditional(lambda: page_marker(
+    User.query.filter_by(verified=1), (User.member_since, User.id), User.username, images=(User.profile_picture,)))
 def members():
-    users = User.query.filter_by(verified=1).order_by(User.member_since.desc()).all()
+    users = paginate_keyset(User.query.filter_by(verified=1), (User.member_since, User.id))
     return render_template('members.html', title='Members', users=users)
 
+@bp.route('/trending', defaults={'collection': 'posts'})
+@bp.route('/trending/<any(posts, photos, videos):collection>')
+@login_required
+@verified_required
+def trending_items(collection):
+    kind = collection[:-1]
+    items = trending.top(collection)
+    liked = getattr(current_user, 'liked_{}_ids'.format(kind))(items)
+    return render_template('trending.html', title='Trending', collection=collection, kind=kind, items=items,
+                           liked=liked)
 
-@app.route('/favicon.ico')
+# a page listens on "discussion" or on one item, as in "photo-12"
+CHANNEL = re.compile(r'(discussion|(post|photo|video)-[0-9]+)$')
+
+@bp.route('/events/<channel>')
+@login_required
+@verified_required
+def live_events(channel):
+    if not CHANNEL.match(channel):
+        abort(404)
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.args['after'])
+    except (KeyError, ValueError):
+        last_id = events.last_id()
+    # waiting needs no database; hand the connection back for as long as it takes
+    db.session.remove()
+    if request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream':
+        return Response(events.stream({channel}, last_id), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # long polling, for clients without EventSource
+    with metrics.waiting():
+        found = events.wait({channel}, last_id, current_app.config['EVENTS_POLL_TIMEOUT'])
+    if found is None:
+        return jsonify(reset=True, last_id=events.last_id(), events=[])
+    return jsonify(reset=False, last_id=found[-1][0] if found else last_id,
+                   events=[{'id': id, 'event': event, 'data': data} for id, _, event, data in found])
+
+
+@bp.route('/favicon.ico')
 def favicon():
     return ''
 
-@app.route('/reset_password_request', methods=['GET','POST'])
+@bp.route('/reset_password_request', methods=['GET','POST'])
 def reset_password_request():
     if current_user.is_authenticated:
-        return redirect(url_for('discussion'))
+        return redirect(url_for('main.discussion'))
     form = ResetPasswordRequestForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user:
             send_password_reset_email(user)
         flash('Check your email for the instructions to reset your password.')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_password_request.html', title='Reset Password', form=form)
 
-@app.route('/reset_password/<token>', methods=['GET', 'POST'])
+@bp.route('/reset_password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
     if current_user.is_authenticated:
-        return redirect(url_for('discussion'))
+        return redirect(url_for('main.discussion'))
     user = User.verify_reset_password_token(token)
     if not user:
-        return redirect(url_for('discussion'))
+        return redirect(url_for('main.discussion'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
         user.set_password(form.password.data)
         db.session.commit()
+        user_cache.invalidate(user)
         flash('Your password has been reset.')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_password.html',title='Set New Password', form=form)
+
+@bp.route('/stats/fragments')
+@login_required
+@admin_required
+def fragment_stats():
+    return jsonify(fragments.stats())
+
+@bp.route('/metrics')
+@admin_or_token_required
+def metrics_export():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
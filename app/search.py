@@ -0,0 +1,119 @@
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, text
+
+# kind: (table, indexed column, visibility filter)
+SOURCES = {
+    'posts': ('post', 'body', 'post.is_discussion = 1'),
+    'photos': ('photo', 'title', 'photo.is_public = 1'),
+    'videos': ('video', 'title', None),
+    'comments': ('comment', 'body', None),
+    'users': ('user', 'username', '"user".verified = 1'),
+}
+
+# sentinels survive HTML escaping and are swapped for <mark> afterwards
+HIGHLIGHT_OPEN = '\x02'
+HIGHLIGHT_CLOSE = '\x03'
+
+CREATE_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({col}, content='{t}', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{t}" BEGIN '
+    'INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END',
+    'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{t}" BEGIN '
+    "INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); END",
+    'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col} ON "{t}" BEGIN '
+    "INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); "
+    'INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END',
+]
+
+
+def create_statements(table, column):
+    """DDL for an external-content FTS5 index on table.column kept in sync by triggers."""
+    return [s.format(fts=table + '_fts', t=table, col=column) for s in CREATE_STATEMENTS]
+
+
+def match_query(q):
+    """Turn user input into an FTS5 query: every word must match, the last one as a prefix."""
+    words = re.findall(r'\w+', q or '')
+    if not words:
+        return None
+    terms = ['"{}"'.format(w) for w in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlighted(snippet):
+    return Markup(escape(snippet or '')
+                  .replace(HIGHLIGHT_OPEN, Markup('<mark>'))
+                  .replace(HIGHLIGHT_CLOSE, Markup('</mark>')))
+
+
+class SearchResults(object):
+
+    def __init__(self, kind, hits, page, has_next):
+        self.kind = kind
+        self.hits = hits # list of (object, highlighted text)
+        self.page = page
+        self.has_next = has_next
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+
+class SearchIndex(object):
+    """Ranked full-text search backed by SQLite FTS5.
+
+    Each searchable column has an external-content FTS5 table, so the text
+    is not stored twice, and triggers keep it in step with every insert,
+    update and delete. The tables are created with db.create_all() and by
+    the migrations; `flask reindex` rebuilds them in bulk.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        self.per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+        for table, column, _ in SOURCES.values():
+            for statement in create_statements(table, column):
+                event.listen(db.metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+    def models(self):
+        from app.models import Post, Photo, Video, Comment, User
+        return {'posts': Post, 'photos': Photo, 'videos': Video, 'comments': Comment, 'users': User}
+
+    def query(self, kind, q, page=1):
+        match = match_query(q)
+        if kind not in SOURCES or not match:
+            return SearchResults(kind, [], page, False)
+        table, column, visible = SOURCES[kind]
+        fts = table + '_fts'
+        sql = ('SELECT {fts}.rowid, highlight({fts}, 0, :open, :close) FROM {fts} '
+               'JOIN "{t}" ON "{t}".id = {fts}.rowid '
+               'WHERE {fts} MATCH :match {visible}'
+               'ORDER BY {fts}.rank LIMIT :limit OFFSET :offset').format(
+            fts=fts, t=table, visible='AND {} '.format(visible) if visible else '')
+        rows = self.db.session.execute(text(sql), {
+            'open': HIGHLIGHT_OPEN, 'close': HIGHLIGHT_CLOSE, 'match': match,
+            'limit': self.per_page + 1, 'offset': (page - 1) * self.per_page}).fetchall()
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        model = self.models()[kind]
+        objects = {o.id: o for o in model.query.filter(model.id.in_([r[0] for r in rows]))} if rows else {}
+        hits = [(objects[r[0]], highlighted(r[1])) for r in rows if r[0] in objects]
+        return SearchResults(kind, hits, page, has_next)
+
+    def reindex(self):
+        for table, column, _ in SOURCES.values():
+            fts = table + '_fts'
+            for statement in create_statements(table, column):
+                self.db.session.execute(text(statement))
+            self.db.session.execute(text("INSERT INTO {0}({0}) VALUES ('rebuild')".format(fts)))
+            self.db.session.execute(text("INSERT INTO {0}({0}) VALUES ('optimize')".format(fts)))
+        self.db.session.commit()
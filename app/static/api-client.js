@@ -0,0 +1,214 @@
+// Likes, new comments and older comments go through /api/v1 instead of
+// reloading the page: the like links and comment forms rendered by
+// _likes.html and _comments.html carry the API URLs in data- attributes, and
+// only the counts and the new comments are put into the page. Without fetch
+// the links and forms work as plain ones.
+//
+// An element with data-events listens there for what others do while the
+// page is open: counts, comments and new posts, from the id in
+// data-last-event on. EventSource resumes by itself after a dropped
+// connection; without it the same URL is long-polled.
+(function () {
+    var meta = document.querySelector('meta[name=csrf-token]');
+    if (!meta || !window.fetch || !Element.prototype.closest) {
+        return;
+    }
+
+    function call(method, url, body) {
+        var headers = {'X-CSRFToken': meta.content, 'Accept': 'application/json'};
+        if (body !== undefined) {
+            headers['Content-Type'] = 'application/json';
+            body = JSON.stringify(body);
+        }
+        return fetch(url, {method: method, body: body, headers: headers, credentials: 'same-origin'})
+            .then(function (response) {
+                return response.json().then(function (data) {
+                    if (!response.ok) {
+                        throw new Error(data.error || response.statusText);
+                    }
+                    return data;
+                });
+            });
+    }
+
+    function setCount(name, item, value) {
+        var nodes = document.querySelectorAll('[data-' + name + '="' + item + '"]');
+        for (var i = 0; i < nodes.length; i++) {
+            nodes[i].textContent = value;
+        }
+    }
+
+    function element(tag, attributes, children) {
+        var node = document.createElement(tag);
+        Object.keys(attributes || {}).forEach(function (name) {
+            node.setAttribute(name, attributes[name]);
+        });
+        (children || []).forEach(function (child) {
+            node.appendChild(typeof child === 'string' ? document.createTextNode(child) : child);
+        });
+        return node;
+    }
+
+    function button(href, css, label) {
+        return element('a', {href: href}, [element('button', {type: 'button', 'class': 'btn ' + css}, [label])]);
+    }
+
+    // the same markup as comment_entry() in _comments.html
+    function renderComment(comment) {
+        var author = comment.author;
+        var children = [
+            element('a', {href: author.url}, [
+                element('img', {src: author.avatar, width: '20', 'class': 'img-responsive', style: 'display:inline;'})]),
+            ' ',
+            element('h4', {style: 'display:inline;'}, [element('a', {href: author.url}, [author.username])]),
+            ': ' + comment.body, element('br'), element('br')
+        ];
+        if (comment.edit_url) {
+            children.push(button(comment.edit_url, 'btn-primary', 'Edit'), ' ',
+                          button(comment.delete_url, 'btn-danger', 'Delete'));
+        }
+        children.push(element('br'), element('br'));
+        return element('div', {'class': 'comment', 'data-comment': comment.id}, children);
+    }
+
+    function like(link) {
+        var liked = link.getAttribute('data-liked') === '1';
+        return call(liked ? 'DELETE' : 'POST', link.getAttribute('data-like')).then(function (data) {
+            link.setAttribute('data-liked', data.liked ? '1' : '0');
+            link.href = link.href.replace(/\/(un)?like$/, data.liked ? '/unlike' : '/like');
+            link.firstElementChild.textContent = data.liked ? '👎' : '👍';
+            setCount('like-count', link.getAttribute('data-item'), data.like_count);
+        });
+    }
+
+    function olderComments(link) {
+        var thread = document.querySelector('[data-comments]');
+        var url = thread.getAttribute('data-comments') + '?before=' +
+            encodeURIComponent(link.getAttribute('data-more-comments'));
+        return call('GET', url).then(function (page) {
+            page.data.forEach(function (comment) {
+                thread.appendChild(renderComment(comment));
+            });
+            if (page.older) {
+                link.setAttribute('data-more-comments', page.older);
+                link.href = link.href.replace(/([?&]before=)[^&]*/, '$1' + encodeURIComponent(page.older));
+            } else {
+                link.parentNode.removeChild(link);
+            }
+        });
+    }
+
+    function addComment(thread, comment) {
+        // the event for one's own comment can come before the API answer, or after
+        if (!thread.querySelector('[data-comment="' + comment.id + '"]')) {
+            thread.insertBefore(renderComment(comment), thread.firstChild);
+        }
+    }
+
+    function postComment(form) {
+        var thread = document.querySelector('[data-comments]');
+        var field = form.querySelector('[name=post]');
+        return call('POST', thread.getAttribute('data-comments'), {body: field.value}).then(function (data) {
+            addComment(thread, data.data);
+            setCount('comment-count', thread.getAttribute('data-item'), data.comment_count);
+            field.value = '';
+        });
+    }
+
+    // a line above the live element, linking to the page reloaded
+    function notice(node, text) {
+        var box = node.previousElementSibling;
+        if (!box || !box.hasAttribute('data-notice')) {
+            box = element('div', {'class': 'alert alert-info', 'data-notice': ''});
+            node.parentNode.insertBefore(box, node);
+        }
+        box.textContent = text + ' ';
+        box.appendChild(element('a', {href: window.location.pathname}, ['Show']));
+    }
+
+    function listen(node) {
+        var newPosts = 0;
+        var handlers = {
+            counts: function (data) {
+                setCount('like-count', data.item, data.like_count);
+                setCount('comment-count', data.item, data.comment_count);
+            },
+            comment: function (data) {
+                if (node.hasAttribute('data-newest')) {
+                    addComment(node, data);
+                }
+            },
+            comment_deleted: function (data) {
+                var comment = node.querySelector('[data-comment="' + data.id + '"]');
+                if (comment) {
+                    comment.parentNode.removeChild(comment);
+                }
+            },
+            post: function () {
+                newPosts += 1;
+                notice(node, newPosts === 1 ? '1 new post.' : newPosts + ' new posts.');
+            },
+            // events were missed, so some of the page may be out of date
+            reset: function () {
+                notice(node, 'There is more since this page was loaded.');
+            }
+        };
+        var url = node.getAttribute('data-events');
+        var last = node.getAttribute('data-last-event');
+
+        if (window.EventSource) {
+            // on reconnecting, Last-Event-ID takes over from ?after=
+            var source = new EventSource(url + '?after=' + encodeURIComponent(last));
+            Object.keys(handlers).forEach(function (name) {
+                source.addEventListener(name, function (event) {
+                    handlers[name](JSON.parse(event.data));
+                });
+            });
+            return;
+        }
+        (function poll() {
+            call('GET', url + '?after=' + encodeURIComponent(last)).then(function (page) {
+                if (page.reset) {
+                    handlers.reset({});
+                }
+                page.events.forEach(function (event) {
+                    if (handlers[event.event]) {
+                        handlers[event.event](event.data);
+                    }
+                });
+                last = page.last_id;
+                poll();
+            }, function () {
+                setTimeout(poll, 5000);
+            });
+        })();
+    }
+
+    Array.prototype.forEach.call(document.querySelectorAll('[data-events]'), listen);
+
+    // fall back to the plain link or form if the request fails
+    document.addEventListener('click', function (event) {
+        var link = event.target.closest('a[data-like], a[data-more-comments]');
+        if (!link) {
+            return;
+        }
+        event.preventDefault();
+        var action = link.hasAttribute('data-like') ? like(link) : olderComments(link);
+        action.catch(function () {
+            window.location = link.href;
+        });
+    });
+
+    document.addEventListener('submit', function (event) {
+        var form = event.target;
+        if (!form.hasAttribute('data-comment-form') || !form.querySelector('[name=post]').value.trim()) {
+            return;
+        }
+        event.preventDefault();
+        postComment(form).catch(function () {
+            // submitted again without this handler, and with the button the view looks for
+            form.removeAttribute('data-comment-form');
+            form.querySelector('[name=comment_submit]').click();
+        });
+    });
+})();
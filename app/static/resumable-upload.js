@@ -0,0 +1,85 @@
+// Sends the videos form's files in chunks to /videos/uploads, so a dropped
+// connection costs one chunk instead of the whole file. An unfinished upload
+// is remembered in localStorage and picked up where the server left off when
+// the same file is chosen again. Without fetch the form is posted as usual.
+(function () {
+    var form = document.querySelector('form[data-resumable]');
+    if (!form || !window.fetch || !window.localStorage || !window.Blob || !Blob.prototype.slice) {
+        return;
+    }
+    var endpoint = form.getAttribute('data-resumable');
+    var progress = document.getElementById('upload-progress');
+    var csrf = form.querySelector('input[name=csrf_token]');
+
+    function call(method, url, body, headers) {
+        headers = headers || {};
+        if (csrf) {
+            headers['X-CSRFToken'] = csrf.value;
+        }
+        return fetch(url, {method: method, body: body, headers: headers, credentials: 'same-origin'})
+            .then(function (response) {
+                return response.json().then(function (data) {
+                    if (!response.ok && response.status !== 409) {
+                        throw new Error(data.error || response.statusText);
+                    }
+                    return data;
+                });
+            });
+    }
+
+    function start(file, title) {
+        var key = 'upload:' + [file.name, file.size, file.lastModified].join(':');
+        var known = localStorage.getItem(key);
+        var begin = known ? call('GET', known) : Promise.reject();
+        return begin.catch(function () {
+            return call('POST', endpoint, JSON.stringify({title: title, filename: file.name, size: file.size}),
+                        {'Content-Type': 'application/json'});
+        }).then(function (upload) {
+            localStorage.setItem(key, upload.url);
+            return send(file, upload, upload.offset, 0).then(function () {
+                return call('POST', upload.url + '/finish');
+            }).then(function (video) {
+                localStorage.removeItem(key);
+                return video;
+            });
+        });
+    }
+
+    function send(file, upload, offset, failures) {
+        progress.textContent = file.name + ': ' + Math.floor(100 * offset / file.size) + '%';
+        if (offset >= file.size) {
+            return Promise.resolve();
+        }
+        var chunk = file.slice(offset, offset + upload.chunk_size);
+        return call('PUT', upload.url, chunk, {'Upload-Offset': String(offset), 'Content-Type': 'application/octet-stream'})
+            .then(function (data) {
+                return send(file, upload, data.offset, 0);
+            }, function (error) {
+                if (failures >= 5) {
+                    throw error;
+                }
+                // ask where the server got to, after a growing pause
+                return new Promise(function (resolve) { setTimeout(resolve, 1000 * Math.pow(2, failures)); })
+                    .then(function () { return call('GET', upload.url); })
+                    .then(function (data) { return send(file, upload, data.offset, failures + 1); },
+                          function () { return send(file, upload, offset, failures + 1); });
+            });
+    }
+
+    form.addEventListener('submit', function (event) {
+        var input = form.querySelector('input[type=file]');
+        var title = form.querySelector('[name=title]');
+        if (!input.files.length || !title.value) {
+            return; // let the form report what is missing
+        }
+        event.preventDefault();
+        var files = Array.prototype.slice.call(input.files);
+        files.reduce(function (previous, file) {
+            return previous.then(function () { return start(file, title.value); });
+        }, Promise.resolve()).then(function () {
+            window.location.reload();
+        }, function (error) {
+            progress.textContent = 'Upload failed: ' + error.message + '. Choose the same file again to resume.';
+        });
+    });
+})();
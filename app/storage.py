@@ -0,0 +1,180 @@
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+import posixpath
+from flask import current_app
+from flask_uploads import UploadSet, UploadNotAllowed, extension
+
+CHUNK_SIZE = 64 * 1024
+CONTENT_PATH = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+# top-level directories of an upload set that never hold referenced uploads
+SPECIAL_DIRS = ('.incoming', '.uploads', 'defaults', 'derived')
+
+
+def content_path(digest, ext):
+    return posixpath.join(digest[:2], digest[2:4], '{}.{}'.format(digest, ext))
+
+
+def is_content_path(filename):
+    return bool(filename and CONTENT_PATH.match(filename))
+
+
+def walk_files(root, skip=()):
+    """Yield (relative path, DirEntry) for every file under root, one directory at a time."""
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root, rel))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                path = posixpath.join(rel, entry.name) if rel else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if path not in skip:
+                        stack.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield path, entry
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentAddressedUploadSet(UploadSet):
+    """An UploadSet that files uploads by content instead of by name.
+
+    Uploads are hashed while they are streamed to a temp file and end up at
+    ab/cd/<sha256>.<ext>, so the same file uploaded twice is stored once and
+    no directory grows past a few hundred entries. The digest is that of the
+    bytes as uploaded. `referrers` are the "table.column" names holding
+    filenames of this set; a stored file is only removed once none of them
+    refer to it. `process`, if given, is called with the path of each new
+    file before it is moved into the store, and may rewrite it in place.
+    """
+
+    def __init__(self, name, extensions, referrers=(), process=None, **kwargs):
+        super(ContentAddressedUploadSet, self).__init__(name, extensions, **kwargs)
+        self.referrers = referrers
+        self.process = process
+        # held while adopt() reuses a stored file and while discard() checks and removes one
+        self._lock = threading.Lock()
+
+    def save(self, storage, folder=None, name=None):
+        # folder and name are accepted for compatibility; the content decides the path
+        if storage.filename is None:
+            raise ValueError('Filename must not be empty!')
+        basename = self.get_basename(storage.filename)
+        if not self.file_allowed(storage, basename):
+            raise UploadNotAllowed()
+        return self.save_stream(storage.stream, extension(basename))
+
+    def save_stream(self, stream, ext):
+        fd, tmp = tempfile.mkstemp(dir=self._incoming())
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            return self.adopt(tmp, ext, digest.hexdigest())
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def adopt(self, path, ext, digest=None):
+        """Move the local file at `path` into the store and return its filename."""
+        if not self.extension_allowed(ext.lower()):
+            raise UploadNotAllowed()
+        filename = content_path(digest or file_digest(path), ext.lower())
+        target = self.path(filename)
+        with self._lock:
+            if os.path.exists(target):
+                # touched, so discard() leaves it until the row about to refer to it is committed
+                os.utime(target)
+                os.remove(path)
+                return filename
+        if self.process is not None:
+            self.process(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        return filename
+
+    def refcount(self, filename):
+        db = current_app.extensions['sqlalchemy'].db
+        count = 0
+        for referrer in self.referrers:
+            table, column = referrer.split('.')
+            column = db.metadata.tables[table].c[column]
+            count += db.session.query(db.func.count()).filter(column == filename).scalar()
+        return count
+
+    def discard(self, filename, min_age=300):
+        """Delete a stored file once nothing refers to it. Returns True if removed.
+
+        As in orphans(), a file stored or reused by an upload in the last
+        `min_age` seconds is kept: the row referring to it may not be
+        committed yet, and `flask storage orphans` removes it if it never is.
+        """
+        if not filename or filename.split('/', 1)[0] in SPECIAL_DIRS:
+            return False
+        path = self.path(filename)
+        with self._lock:
+            try:
+                if os.stat(path).st_mtime > time.time() - min_age or self.refcount(filename):
+                    return False
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def orphans(self, min_age=3600, chunk=500):
+        """Yield (filename, size) of stored files no row refers to.
+
+        The directory tree is walked once and checked against the referrers
+        `chunk` names at a time, so neither side is held in memory. Files
+        younger than `min_age` seconds are left alone: their rows may not be
+        committed yet. Abandoned temp files in .incoming count as orphans.
+        """
+        cutoff = time.time() - min_age
+        root = self.config.destination
+        for filename, entry in walk_files(os.path.join(root, '.incoming')):
+            stat = entry.stat()
+            if stat.st_mtime < cutoff:
+                yield posixpath.join('.incoming', filename), stat.st_size
+        batch = []
+        for filename, entry in walk_files(root, skip=SPECIAL_DIRS):
+            stat = entry.stat()
+            if stat.st_mtime < cutoff:
+                batch.append((filename, stat.st_size))
+            if len(batch) >= chunk:
+                yield from self._unreferenced(batch)
+                batch = []
+        yield from self._unreferenced(batch)
+
+    def _unreferenced(self, batch):
+        if not batch:
+            return
+        db = current_app.extensions['sqlalchemy'].db
+        names = [filename for filename, _ in batch]
+        referenced = set()
+        for referrer in self.referrers:
+            table, column = referrer.split('.')
+            column = db.metadata.tables[table].c[column]
+            referenced.update(row[0] for row in db.session.query(column).filter(column.in_(names)))
+        for filename, size in batch:
+            if filename not in referenced:
+                yield filename, size
+
+    def _incoming(self):
+        path = os.path.join(self.config.destination, '.incoming')
+        os.makedirs(path, exist_ok=True)
+        return path
@@ -0,0 +1,87 @@
+from datetime import datetime
+from sqlalchemy import event, text
+from sqlalchemy.orm import joinedload
+
+KINDS = ('post', 'photo', 'video')
+
+# kind: SELECT of the timeline rows for existing items; mirrored by migration 7fdcdf4eed0f
+BACKFILL = {
+    'post': 'SELECT timestamp, id FROM post WHERE is_discussion = 1',
+    'photo': 'SELECT timestamp, id FROM photo WHERE is_public = 1',
+    'video': 'SELECT timestamp, id FROM video',
+}
+
+
+class Timeline(object):
+    """The home page feed: discussion posts, public photos and videos, newest first.
+
+    Each such item has a timeline_entry row, added by a before_flush hook in
+    the same transaction as the item and deleted with it by ON DELETE
+    CASCADE. A page is one range scan on (timestamp, id) plus one query per
+    kind for the items on it, however much content there is in total.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        app.config.setdefault('TIMELINE_PER_PAGE', 10)
+        event.listen(db.session, 'before_flush', self._add_entries)
+
+    def models(self):
+        from app.models import Post, Photo, Video, TimelineEntry
+        return {'post': Post, 'photo': Photo, 'video': Video}, TimelineEntry
+
+    def kind(self, item):
+        models, _ = self.models()
+        if isinstance(item, models['post']):
+            return 'post' if item.is_discussion else None
+        if isinstance(item, models['photo']):
+            # is_public defaults to 1 and is only filled in on insert
+            return 'photo' if item.is_public is None or item.is_public else None
+        if isinstance(item, models['video']):
+            return 'video'
+        return None
+
+    def hydrate(self, page):
+        """Replace the TimelineEntry rows of a keyset page with (kind, item) pairs."""
+        models, _ = self.models()
+        Post = models['post']
+        options = {
+            'post': joinedload(Post.author),
+            'photo': joinedload(models['photo'].post).joinedload(Post.author),
+            'video': joinedload(models['video'].post).joinedload(Post.author),
+        }
+        loaded = {}
+        for kind in KINDS:
+            ids = [getattr(entry, kind + '_id') for entry in page.items if getattr(entry, kind + '_id')]
+            model = models[kind]
+            loaded[kind] = {item.id: item for item in
+                            model.query.options(options[kind]).filter(model.id.in_(ids))} if ids else {}
+        items = []
+        for entry in page.items:
+            for kind in KINDS:
+                item = loaded[kind].get(getattr(entry, kind + '_id'))
+                if item is not None:
+                    items.append((kind, item))
+                    break
+        page.items = items
+        return page
+
+    def rebuild(self):
+        self.db.session.execute(text('DELETE FROM timeline_entry'))
+        for kind, select in BACKFILL.items():
+            self.db.session.execute(text('INSERT INTO timeline_entry (timestamp, {}_id) {}'.format(kind, select)))
+        self.db.session.commit()
+
+    def _add_entries(self, session, flush_context, instances):
+        _, TimelineEntry = self.models()
+        for item in list(session.new):
+            kind = self.kind(item)
+            if kind is None:
+                continue
+            if item.timestamp is None:
+                item.timestamp = datetime.utcnow()
+            session.add(TimelineEntry(timestamp=item.timestamp, **{kind: item}))
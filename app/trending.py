@@ -0,0 +1,171 @@
+import math
+import sqlite3
+import time
+from sqlalchemy import event, func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload
+
+# collection: (column, value) an item needs to be ranked; the others keep scores all the same
+VISIBLE = {
+    'posts': ('is_discussion', 1),
+    'photos': ('is_public', 1),
+    'videos': None,
+}
+
+# the one row of trending_epoch, looked up by its primary key inside every increment
+EPOCH_ID = 1
+
+# unix seconds of a DateTime column, as SQLite stores it
+UNIX_TIME = "((julianday({}) - 2440587.5) * 86400.0)"
+
+# kind: every item's score from its likes and comments; mirrored by migration 5a0aa8a2f517.
+# Likes carry no time, so each counts as if made when the item was posted.
+REBUILD = (
+    'UPDATE {t} SET trending_score = :like_weight * like_count * power(2.0, ({posted} - :epoch) / :half_life) '
+    '+ :comment_weight * coalesce((SELECT sum(power(2.0, ({commented} - :epoch) / :half_life)) '
+    'FROM comment WHERE comment.{t}_id = {t}.id), 0)'
+)
+
+
+def rebuild_sql(table):
+    return text(REBUILD.format(t=table, posted=UNIX_TIME.format(table + '.timestamp'),
+                               commented=UNIX_TIME.format('comment.timestamp')))
+
+
+def _sqlite_functions(dbapi_connection, connection_record):
+    # SQLite only has power() when built with its math functions, which Python's often is not
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('power', 2, math.pow, deterministic=True)
+
+
+class Trending(object):
+    """Posts, photos and videos ranked by their likes and comments, recent ones counting most.
+
+    Every like or comment adds its weight times 2 ** ((now - epoch) / TRENDING_HALF_LIFE)
+    to the item's trending_score, in the UPDATE that already bumps its
+    counters. So a score is the sum of the item's interactions, each worth
+    half as much per half-life of age, times a factor all scores share,
+    which leaves their order alone. Nothing is recomputed from post_like,
+    and the top of the ranking is one walk down an index on the score.
+
+    The shared factor doubles every half-life. Once the epoch is
+    TRENDING_REBASE_INTERVAL seconds old, rebase() moves it to now and
+    scales every score down to match, in one transaction; the epoch is read
+    inside each increment's UPDATE, so increments always use the one in
+    force when they commit.
+    """
+
+    def __init__(self, app=None, db=None):
+        self._next_check = 0
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        app.config.setdefault('TRENDING_HALF_LIFE', 12 * 3600)
+        app.config.setdefault('TRENDING_LIKE_WEIGHT', 1.0)
+        app.config.setdefault('TRENDING_COMMENT_WEIGHT', 3.0)
+        app.config.setdefault('TRENDING_REBASE_INTERVAL', 7 * 24 * 3600)
+        app.config.setdefault('TRENDING_SIZE', 20)
+        event.listen(Engine, 'connect', _sqlite_functions)
+        app.before_request(self._rebase_if_due)
+
+    def models(self):
+        from app.models import Post, Photo, Video, TrendingEpoch
+        return {'posts': Post, 'photos': Photo, 'videos': Video}, TrendingEpoch
+
+    def boost(self, weight):
+        """SQL for the score of `weight` worth of interactions made now."""
+        _, TrendingEpoch = self.models()
+        now = time.time()
+        # before the first rebase there is no epoch; now is as good as any
+        epoch = func.coalesce(select([TrendingEpoch.epoch]).where(TrendingEpoch.id == EPOCH_ID).as_scalar(), now)
+        return weight * func.power(2.0, (now - epoch) / self.app.config['TRENDING_HALF_LIFE'])
+
+    def record(self, item, likes=0, comments=0):
+        """Add likes and comments, or take them away, in the UPDATE of the item's row.
+
+        A like or comment taken away is counted as if made now, which takes
+        off more than an older one added; the score stops at zero.
+        """
+        config = self.app.config
+        weight = likes * config['TRENDING_LIKE_WEIGHT'] + comments * config['TRENDING_COMMENT_WEIGHT']
+        column = type(item).trending_score
+        if weight >= 0:
+            item.trending_score = column + self.boost(weight)
+        else:
+            item.trending_score = func.max(column - self.boost(-weight), 0.0)
+
+    def ranking(self, kind):
+        """Query for a collection's ranked items, best first."""
+        models, _ = self.models()
+        model = models[kind]
+        query = model.query.filter(model.trending_score > 0)
+        if VISIBLE[kind]:
+            column, value = VISIBLE[kind]
+            query = query.filter(getattr(model, column) == value)
+        return query.order_by(model.trending_score.desc(), model.id.desc())
+
+    def top(self, kind, limit=None):
+        """The highest scoring items of a collection, with their authors."""
+        models, _ = self.models()
+        query = self.ranking(kind)
+        if kind == 'posts':
+            query = query.options(joinedload(models['posts'].author))
+        else:
+            query = query.options(joinedload(models[kind].post).joinedload(models['posts'].author))
+        return query.limit(limit or self.app.config['TRENDING_SIZE']).all()
+
+    def epoch(self):
+        _, TrendingEpoch = self.models()
+        row = TrendingEpoch.query.get(EPOCH_ID)
+        return row.epoch if row else None
+
+    def rebase(self, now=None):
+        """Move the epoch to `now` and scale every score to match. Returns the factor applied."""
+        models, TrendingEpoch = self.models()
+        now = now or time.time()
+        old = self.epoch()
+        if old is None:
+            self.db.session.add(TrendingEpoch(id=EPOCH_ID, epoch=now))
+            self.db.session.commit()
+            return 1.0
+        epochs = TrendingEpoch.__table__
+        moved = self.db.session.execute(epochs.update().where(epochs.c.id == EPOCH_ID).where(epochs.c.epoch == old)
+                                        .values(epoch=now))
+        if moved.rowcount != 1:
+            # another process rebased first
+            self.db.session.rollback()
+            return 1.0
+        factor = 2.0 ** ((old - now) / self.app.config['TRENDING_HALF_LIFE'])
+        for model in models.values():
+            table = model.__table__
+            self.db.session.execute(table.update().where(table.c.trending_score != 0)
+                                    .values(trending_score=table.c.trending_score * factor))
+        self.db.session.commit()
+        return factor
+
+    def rebuild_params(self, epoch):
+        config = self.app.config
+        return {'epoch': epoch, 'half_life': config['TRENDING_HALF_LIFE'],
+                'like_weight': config['TRENDING_LIKE_WEIGHT'], 'comment_weight': config['TRENDING_COMMENT_WEIGHT']}
+
+    def rebuild(self):
+        """Recompute every score from the counters and comments, with a fresh epoch."""
+        models, TrendingEpoch = self.models()
+        now = time.time()
+        self.db.session.execute(TrendingEpoch.__table__.delete())
+        self.db.session.add(TrendingEpoch(id=EPOCH_ID, epoch=now))
+        for model in models.values():
+            self.db.session.execute(rebuild_sql(model.__tablename__), self.rebuild_params(now))
+        self.db.session.commit()
+
+    def _rebase_if_due(self):
+        # looked at once a minute per process; the rebase itself runs once an interval
+        if time.monotonic() < self._next_check:
+            return
+        self._next_check = time.monotonic() + 60
+        epoch = self.epoch()
+        if epoch is None or time.time() - epoch > self.app.config['TRENDING_REBASE_INTERVAL']:
+            self.rebase()
@@ -0,0 +1,324 @@
+import io
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+# sorts after anything a username can continue with, so key + MAX_CHAR ends a prefix's run
+MAX_CHAR = '\U0010ffff'
+
+
+def unix_seconds(value):
+    return int((value - EPOCH).total_seconds()) if value else 0
+
+
+class PrefixIndex(object):
+    """Usernames in case-insensitive order, to find the most recently seen ones with a prefix.
+
+    The names are concatenated into one string, with their offsets, ids and
+    last_seen times (unix seconds) in 32-bit arrays, about 13 bytes a user
+    plus the text, against some 60 for a list of strings. All names with a
+    prefix are one run of that order, found by two binary searches. A run
+    of up to `scan_limit` names is ranked by scanning it; each prefix with
+    a longer run keeps its `size` most recently seen users ready. last_seen
+    only moves forward, so a touch keeps those lists exact as it goes, and
+    only a removal has one recomputed.
+
+    The rows are expected in (lowercased name, id) order and appended as
+    they come, so a streaming query is never held in memory whole. Users
+    added after the build go to a small sorted list beside the arrays, as
+    do rows that came out of order, and removed ones are blanked out,
+    until the next build.
+    """
+
+    def __init__(self, rows, size=20, scan_limit=2000):
+        # rows: (id, username, last_seen in unix seconds)
+        text = io.StringIO()
+        self.starts = array('I', (0,))
+        self.ids = array('I')
+        self.seen = array('I')
+        late = []
+        last = ('', 0)
+        for id, username, seen in rows:
+            key = (username.lower(), id)
+            if key < last:
+                # SQLite's lower() leaves non-ASCII letters as they are
+                late.append((id, username, seen))
+                continue
+            last = key
+            self.starts.append(self.starts[-1] + text.write(username))
+            self.ids.append(id)
+            self.seen.append(seen)
+        self.text = text.getvalue()
+        self.added = sorted((username.lower(), id, username) for id, username, _ in late) # (lowercased name, id, name)
+        self.added_seen = {id: seen for id, _, seen in late} # id: last_seen
+        self.removed = 0
+        self.size = size
+        self.scan_limit = scan_limit
+        self.top = {} # prefix: [(last_seen, id, name)], most recent first
+        self._find_long_runs()
+
+    def __len__(self):
+        return len(self.ids) - self.removed + len(self.added)
+
+    def name(self, i):
+        return self.text[self.starts[i]:self.starts[i + 1]]
+
+    def search(self, prefix, limit):
+        """(id, username) of up to `limit` users whose name starts with `prefix`, most recently seen first."""
+        key = prefix.lower()
+        if not key:
+            return []
+        found = self.top.get(key)
+        if found is None or limit > self.size:
+            found = self._rank(key, limit)
+        return [(id, name) for _, id, name in found[:limit]]
+
+    def touch(self, id, username, seen):
+        i = self._find(id, username)
+        if i is not None:
+            if seen <= self.seen[i]:
+                return
+            self.seen[i] = seen
+        elif self.added_seen.get(id, seen) < seen:
+            self.added_seen[id] = seen
+        else:
+            return
+        self._promote(username.lower(), (seen, id, username))
+
+    def add(self, id, username, seen):
+        if self._find(id, username) is not None or id in self.added_seen:
+            self.touch(id, username, seen)
+            return
+        key = username.lower()
+        insort(self.added, (key, id, username))
+        self.added_seen[id] = seen
+        self._promote(key, (seen, id, username))
+
+    def remove(self, id, username):
+        key = username.lower()
+        i = self._find(id, username)
+        if i is not None:
+            self.ids[i] = self.seen[i] = 0
+            self.removed += 1
+        elif id in self.added_seen:
+            self.added.remove((key, id, username))
+            del self.added_seen[id]
+        else:
+            return
+        for depth in range(1, len(key) + 1):
+            found = self.top.get(key[:depth])
+            if found is None:
+                break
+            if any(entry[1] == id for entry in found):
+                self.top[key[:depth]] = self._rank(key[:depth], self.size)
+
+    def _lower(self, key, lo=0, hi=None):
+        # the first position whose name, lowercased, is not before `key`
+        hi = len(self.ids) if hi is None else hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name(mid).lower() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, id, username):
+        key = username.lower()
+        i = self._lower(key)
+        while i < len(self.ids) and self.name(i).lower() == key:
+            if self.ids[i] == id:
+                return i
+            i += 1
+        return None
+
+    def _rank(self, key, limit):
+        lo = self._lower(key)
+        hi = self._lower(key + MAX_CHAR, lo)
+        ids, seen = self.ids, self.seen
+        found = [(seen[i], ids[i], self.name(i))
+                 for i in heapq.nlargest(limit + self.removed, range(lo, hi), key=seen.__getitem__) if ids[i]]
+        start, end = bisect_left(self.added, (key,)), bisect_left(self.added, (key + MAX_CHAR,))
+        found += [(self.added_seen[id], id, name) for _, id, name in self.added[start:end]]
+        found.sort(reverse=True)
+        return found[:limit]
+
+    def _find_long_runs(self):
+        # a run is split by the next character only where it is too long to scan
+        stack = [('', 0, len(self.ids))]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            depth = len(prefix) + 1
+            start = lo
+            while start < hi:
+                key = self.name(start).lower()
+                if len(key) < depth:
+                    start += 1
+                    continue
+                child = key[:depth]
+                end = self._lower(child + MAX_CHAR, start, hi)
+                if end - start > self.scan_limit:
+                    self.top[child] = self._rank(child, self.size)
+                    stack.append((child, start, end))
+                start = end
+
+    def _promote(self, key, entry):
+        # only prefixes of a long run have long runs themselves
+        for depth in range(1, len(key) + 1):
+            found = self.top.get(key[:depth])
+            if found is None:
+                break
+            if len(found) == self.size and entry < found[-1]:
+                continue
+            found[:] = sorted([e for e in found if e[1] != entry[1]] + [entry], reverse=True)[:self.size]
+
+
+class UsernameIndex(object):
+    """Verified usernames in memory, for typeahead and @mention completion.
+
+    Built by a background thread that the app's first request starts, from
+    one query streaming the users in the index's order; a search made
+    before it is done waits for it. Routes call update() once a change to a
+    user has committed, and touch() follows last_seen. The same thread then
+    reads back every TYPEAHEAD_REFRESH seconds the users that were seen, or
+    verified, by other processes, and every TYPEAHEAD_REBUILD seconds builds
+    the index afresh, which also drops the old names of users renamed
+    elsewhere.
+    """
+
+    def __init__(self, app=None, db=None):
+        self._index = None
+        self._since = 0
+        self._missed = None # updates made while a build runs, replayed on its result
+        self._lock = threading.Lock()
+        self._built = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        app.config.setdefault('TYPEAHEAD_SIZE', 20)
+        app.config.setdefault('TYPEAHEAD_SCAN_LIMIT', 2000)
+        app.config.setdefault('TYPEAHEAD_REFRESH', 60)
+        app.config.setdefault('TYPEAHEAD_REBUILD', 3600)
+        # not in create_app(): a thread started there would not survive a server forking its workers
+        app.before_first_request(self.start)
+
+    def build(self, bind=None):
+        """A PrefixIndex of the verified users, read through `bind`, the session by default."""
+        from app.models import User
+        table = User.__table__
+        query = self.db.select([table.c.id, table.c.username, table.c.last_seen]).where(table.c.verified == 1) \
+            .order_by(self.db.func.lower(table.c.username), table.c.id)
+        if bind is None:
+            bind = self.db.session.connection()
+        result = bind.execution_options(stream_results=True).execute(query)
+        return PrefixIndex(((id, username, unix_seconds(seen)) for id, username, seen in result),
+                           self.app.config['TYPEAHEAD_SIZE'], self.app.config['TYPEAHEAD_SCAN_LIMIT'])
+
+    def start(self):
+        """Build the index on a background thread, which then keeps it fresh."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='typeahead-refresh', daemon=True)
+                self._thread.start()
+
+    def search(self, prefix, limit):
+        index = self._index
+        if index is None:
+            self.start()
+            self._built.wait()
+            index = self._index
+            if index is None:
+                return [] # the build failed; this search has started another
+        with self._lock:
+            return index.search(prefix, limit)
+
+    def touch(self, user):
+        if self._index is not None and user.verified == 1:
+            with self._lock:
+                self._index.touch(user.id, user.username, int(time.time()))
+
+    def update(self, user, previous=None):
+        """Follow a committed change to `user`; `previous` is their username before a rename."""
+        change = (user.id, user.username, user.verified == 1, unix_seconds(user.last_seen), previous)
+        with self._lock:
+            if self._missed is not None:
+                self._missed.append(change)
+            if self._index is not None:
+                self._apply(self._index, *change)
+
+    def refresh(self):
+        """Add or move up the users seen since the last refresh. Returns how many."""
+        from app.models import User
+        # last_seen is written up to a flush interval after the fact
+        since = datetime.utcfromtimestamp(self._since - 2 * self.app.config['LAST_SEEN_FLUSH_INTERVAL'])
+        self._since = time.time()
+        rows = self.db.session.query(User.id, User.username, User.last_seen) \
+            .filter(User.verified == 1, User.last_seen > since).all()
+        self.db.session.remove()
+        with self._lock:
+            for id, username, seen in rows:
+                self._index.add(id, username, unix_seconds(seen))
+        return len(rows)
+
+    @staticmethod
+    def _apply(index, id, username, verified, seen, previous):
+        if previous is not None and previous != username:
+            index.remove(id, previous)
+        if verified:
+            index.add(id, username, seen)
+        else:
+            index.remove(id, username)
+
+    def _rebuild(self):
+        since = time.time()
+        with self._lock:
+            self._missed = []
+        try:
+            index = self.build()
+        except Exception:
+            with self._lock:
+                self._missed = None
+            raise
+        finally:
+            self.db.session.remove()
+        with self._lock:
+            for change in self._missed:
+                self._apply(index, *change)
+            self._missed = None
+            first, self._index = self._index is None, index
+        # what was touched while building comes back with the next refresh
+        self._since = since if first else min(self._since, since)
+
+    def _run(self):
+        try:
+            if self._index is None:
+                with self.app.app_context():
+                    self._rebuild()
+        except Exception:
+            logger.exception('Could not build the username index')
+            return
+        finally:
+            self._built.set()
+        rebuilt = time.monotonic()
+        while True:
+            time.sleep(self.app.config['TYPEAHEAD_REFRESH'])
+            try:
+                with self.app.app_context():
+                    if time.monotonic() - rebuilt > self.app.config['TYPEAHEAD_REBUILD']:
+                        self._rebuild()
+                        rebuilt = time.monotonic()
+                    else:
+                        self.refresh()
+            except Exception:
+                logger.exception('Could not refresh the username index')
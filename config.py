@@ -1,4 +1,5 @@
 import os
+import tempfile
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config(object):
@@ -6,16 +7,133 @@ class Config(object):
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # applied to every SQLite connection; GET requests read through a separate
+    # pool of query_only connections, which WAL lets run alongside the writer
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # ms
+        'mmap_size': 256 * 2**20,
+        'cache_size': -16000,  # KiB
+        'temp_store': 'MEMORY',
+        'foreign_keys': 'ON',  # deletes cascade to comments, likes, photos and videos
+    }
+    SQLITE_POOL_SIZE = 5
+    SQLITE_READER_POOL_SIZE = 10
+
 
 
     SECRET_KEY=os.environ.get('SECRET_KEY') or 'it-is-a-secret'
 
+    # compiled templates are kept here for every process on the host; unset to compile
+    # them in each process. `flask templates compile` fills it ahead of a deploy
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'goup-jinja-cache')
+
+    # seconds a fresh process may take to import the app and answer its first request;
+    # `flask startup-profile` exits non-zero beyond it
+    STARTUP_BUDGET = 2.0
+
     MAIL_SERVER='smtp.mailtrap.io'
     MAIL_PORT = 2525
     MAIL_USERNAME='6a213db6bf4103'
     MAIL_PASSWORD = '2561f1bafde38b'
     MAIL_USE_TLS = True
+    # errors are mailed to ADMINS; the admin pages go by User.is_admin instead
     ADMINS = ['admin@example.com']
+
+    # outgoing mail is queued in the outbox table and sent in batches over one
+    # connection; failures are retried after RETRY_BASE, 2*RETRY_BASE, ... seconds
+    OUTBOX_BATCH_SIZE = 50
+    OUTBOX_POLL_INTERVAL = 10
+    OUTBOX_MAX_ATTEMPTS = 8
+    OUTBOX_RETRY_BASE = 30
+    OUTBOX_RETRY_MAX = 3600
+    OUTBOX_SMTP_TIMEOUT = 30
     POSTS_PER_PAGE = 3
+    TIMELINE_PER_PAGE = 10
+    SEARCH_RESULTS_PER_PAGE = 10
+    COMMENTS_PER_PAGE = 20
+
+    # /api/v1 pages hold API_PER_PAGE items unless ?limit= asks for up to API_MAX_PER_PAGE
+    API_PER_PAGE = 20
+    API_MAX_PER_PAGE = 100
+
+    # /trending: a like counts LIKE_WEIGHT and a comment COMMENT_WEIGHT, halving every
+    # HALF_LIFE seconds; scores are rescaled every REBASE_INTERVAL seconds to stay in range
+    TRENDING_HALF_LIFE = 12 * 3600
+    TRENDING_LIKE_WEIGHT = 1.0
+    TRENDING_COMMENT_WEIGHT = 3.0
+    TRENDING_REBASE_INTERVAL = 7 * 24 * 3600
+    TRENDING_SIZE = 20
+
+    # live updates from /events: events kept for clients catching up, seconds between
+    # keep-alives on a quiet stream, seconds a long poll waits and seconds one stream lasts
+    # before the browser reconnects; with more than one process, run `flask events relay`
+    # and set EVENTS_RELAY to its socket (e.g. '/tmp/goup-events.sock')
+    EVENTS_BUFFER = 1000
+    EVENTS_RELAY = os.environ.get('EVENTS_RELAY')
+    EVENTS_HEARTBEAT = 15
+    EVENTS_POLL_TIMEOUT = 25
+    EVENTS_STREAM_LIFETIME = 600
+
+    # seconds: how stale last_seen may get, and how often buffered updates are written
+    LAST_SEEN_GRANULARITY = 60
+    LAST_SEEN_FLUSH_INTERVAL = 30
+
+    # logged-in users' rows are cached per process for this many seconds
+    USER_CACHE_TTL = 60
+    USER_CACHE_SIZE = 1024
+
+    # username typeahead: most matches returned, and kept ready for prefixes matching
+    # more than SCAN_LIMIT users; seconds between reading back users other processes saw,
+    # and between rebuilding the whole index
+    TYPEAHEAD_SIZE = 20
+    TYPEAHEAD_SCAN_LIMIT = 2000
+    TYPEAHEAD_REFRESH = 60
+    TYPEAHEAD_REBUILD = 3600
 
     UPLOADS_DEFAULT_DEST = 'app/static/uploads'
+    # request bodies beyond this are refused; bigger videos go up in chunks through /videos/uploads
+    MAX_CONTENT_LENGTH = 100 * 2**20
+
+    # chunked video uploads: total size, size of one PUT, and seconds an idle upload is kept
+    RESUMABLE_UPLOAD_MAX_SIZE = 2 * 2**30
+    RESUMABLE_UPLOAD_CHUNK_SIZE = 8 * 2**20
+    RESUMABLE_UPLOAD_EXPIRY = 24 * 3600
+
+    # seconds between deleting a row and removing its upload, so responses
+    # already streaming the file can finish; `flask storage orphans` catches the rest
+    REAPER_DELAY = 60
+    # files an upload stored or reused this many seconds ago are kept, as its row may
+    # not be committed yet; if it never is, `flask storage orphans` removes them
+    REAPER_MIN_AGE = 300
+
+    # resized copies of uploaded images, generated in the background
+    IMAGE_DERIVATIVE_SIZES = (64, 320, 640, 1280)
+    IMAGE_DERIVATIVE_WORKERS = 2
+    IMAGE_DERIVATIVE_QUEUE = 256
+
+    # uploaded videos are served by /media/videos with this max-age (seconds);
+    # set USE_X_SENDFILE = True when a front-end server can send the files itself
+    MEDIA_CACHE_TIMEOUT = 365 * 24 * 3600
+
+    # HTML and JSON responses of at least COMPRESS_MIN_SIZE bytes are gzipped,
+    # or sent as brotli when the Brotli package is installed and the client accepts it
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+
+    # /metrics is open to admins, and to scrapers sending "Authorization: Bearer <METRICS_TOKEN>";
+    # requests slower than METRICS_SLOW_REQUEST seconds log their slowest statements, and a
+    # statement repeated more than METRICS_N_PLUS_ONE times in one request is logged as N+1
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_SLOW_REQUEST = 0.5
+    METRICS_SLOW_STATEMENTS = 5
+    METRICS_N_PLUS_ONE = 10
+
+    # rendered feed items: bytes kept per process, and an optional SQLite file
+    # shared by all workers on the host (e.g. '/tmp/goup-fragments.db')
+    FRAGMENT_CACHE_BYTES = 8 * 2**20
+    FRAGMENT_CACHE_STORE = os.environ.get('FRAGMENT_CACHE_STORE')
+    FRAGMENT_CACHE_STORE_ROWS = 100000
@@ -1,6 +1,8 @@
-from app import app, db
+from app import create_app, db
 from app.models import User, Post, Photo
 
+app = create_app()
+
 @app.shell_context_processor
 def make_shell_context():
     return {'db':db, 'User':User, 'Post':Post, 'Photo':Photo}
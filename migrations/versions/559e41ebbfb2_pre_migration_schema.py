@@ -0,0 +1,28 @@
+"""pre-migration schema
+
+Revision ID: 559e41ebbfb2
+Revises:
+Create Date: 2026-10-18 18:40:12.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '559e41ebbfb2'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# the databases made before these migrations, app.db among them, are stamped with this
+# revision; it changes nothing, and 87d1d75bd317 brings their schema up to the baseline
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
@@ -0,0 +1,81 @@
+"""cascade deletes
+
+Revision ID: 5eca41fffa58
+Revises: 349a899b8719
+Create Date: 2026-10-18 19:09:58.865075
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5eca41fffa58'
+down_revision = '349a899b8719'
+branch_labels = None
+depends_on = None
+
+
+# table: (column, parent table) pairs whose rows go with their parent
+CHILDREN = {
+    'comment': [('post_id', 'post'), ('photo_id', 'photo'), ('video_id', 'video')],
+    'photo': [('post_id', 'post')],
+    'post_like': [('post_id', 'post'), ('photo_id', 'photo'), ('video_id', 'video')],
+    'video': [('post_id', 'post')],
+}
+
+# the foreign keys were created without names; this names them on reflection so they can be dropped
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+# copying a table drops its triggers; these tables carry the search index's (see fe4e5d00d9be)
+SEARCHED = {
+    'photo': 'title',
+    'video': 'title',
+    'comment': 'body',
+}
+
+
+def _recreate_foreign_keys(ondelete):
+    inspector = sa.inspect(op.get_bind())
+    for table, columns in CHILDREN.items():
+        # databases made before the migrations lack some of the keys (app.db has none on
+        # video.post_id); only those that are there are dropped, and all of them created
+        existing = {(tuple(fk['constrained_columns']), fk['referred_table'])
+                    for fk in inspector.get_foreign_keys(table)}
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            for column, parent in columns:
+                name = 'fk_{}_{}_{}'.format(table, column, parent)
+                if ((column,), parent) in existing:
+                    batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(name, parent, [column], ['id'], ondelete=ondelete)
+
+
+def _recreate_search_triggers():
+    for table, col in SEARCHED.items():
+        fts = table + '_fts'
+        op.execute(
+            'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{t}" BEGIN '
+            'INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END'.format(fts=fts, t=table, col=col))
+        op.execute(
+            'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{t}" BEGIN '
+            "INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); END".format(
+                fts=fts, t=table, col=col))
+        op.execute(
+            'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col} ON "{t}" BEGIN '
+            "INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); "
+            'INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END'.format(fts=fts, t=table, col=col))
+
+
+def upgrade():
+    # rows left behind by deletes made before the cascade existed would fail its checks
+    for table, columns in CHILDREN.items():
+        for column, parent in columns:
+            op.execute('DELETE FROM {t} WHERE {c} IS NOT NULL AND {c} NOT IN (SELECT id FROM {p})'.format(
+                t=table, c=column, p=parent))
+    _recreate_foreign_keys('CASCADE')
+    _recreate_search_triggers()
+
+
+def downgrade():
+    _recreate_foreign_keys(None)
+    _recreate_search_triggers()
@@ -0,0 +1,175 @@
+"""baseline schema
+
+Revision ID: 87d1d75bd317
+Revises: 559e41ebbfb2
+Create Date: 2026-10-18 18:45:35.032239
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '87d1d75bd317'
+down_revision = '559e41ebbfb2'
+branch_labels = None
+depends_on = None
+
+
+def _create_missing_indexes(inspector, table, indexes):
+    existing = set()
+    if table in inspector.get_table_names():  # as it was before upgrade() created any
+        existing = {index['name'] for index in inspector.get_indexes(table)}
+    with op.batch_alter_table(table, schema=None) as batch_op:
+        for name, columns, unique in indexes:
+            if name not in existing:
+                batch_op.create_index(name, columns, unique=unique)
+
+
+def upgrade():
+    # databases older than the migrations, stamped 559e41ebbfb2, already hold these tables,
+    # some of them without the indexes; only what is missing is created
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if 'user' not in tables:
+        op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=60), nullable=True),
+        sa.Column('email', sa.String(length=120), nullable=True),
+        sa.Column('password_hash', sa.String(length=120), nullable=True),
+        sa.Column('about_me', sa.String(length=140), nullable=True),
+        sa.Column('last_seen', sa.DateTime(), nullable=True),
+        sa.Column('profile_picture', sa.String(length=140), nullable=True),
+        sa.Column('verified', sa.Integer(), nullable=True),
+        sa.Column('member_since', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+    _create_missing_indexes(inspector, 'user', [
+        ('ix_user_email', ['email'], True),
+        ('ix_user_profile_picture', ['profile_picture'], False),
+        ('ix_user_username', ['username'], True),
+        ('ix_user_verified', ['verified'], False),
+    ])
+
+    if 'post' not in tables:
+        op.create_table('post',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('body', sa.String(length=140), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('is_discussion', sa.Integer(), nullable=True),
+        sa.Column('is_public', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    _create_missing_indexes(inspector, 'post', [
+        ('ix_post_body', ['body'], False),
+        ('ix_post_is_discussion', ['is_discussion'], False),
+        ('ix_post_is_public', ['is_public'], False),
+        ('ix_post_timestamp', ['timestamp'], False),
+    ])
+
+    if 'photo' not in tables:
+        op.create_table('photo',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=140), nullable=True),
+        sa.Column('is_public', sa.Integer(), nullable=True),
+        sa.Column('filename', sa.String(length=140), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('post_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    _create_missing_indexes(inspector, 'photo', [
+        ('ix_photo_filename', ['filename'], False),
+        ('ix_photo_is_public', ['is_public'], False),
+        ('ix_photo_timestamp', ['timestamp'], False),
+        ('ix_photo_title', ['title'], False),
+    ])
+
+    if 'video' not in tables:
+        op.create_table('video',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=140), nullable=True),
+        sa.Column('title', sa.String(length=140), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('post_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    _create_missing_indexes(inspector, 'video', [
+        ('ix_video_filename', ['filename'], False),
+        ('ix_video_timestamp', ['timestamp'], False),
+        ('ix_video_title', ['title'], False),
+    ])
+
+    if 'comment' not in tables:
+        op.create_table('comment',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('body', sa.String(length=140), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('post_id', sa.Integer(), nullable=True),
+        sa.Column('photo_id', sa.Integer(), nullable=True),
+        sa.Column('video_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['photo_id'], ['photo.id'], ),
+        sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['video_id'], ['video.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    _create_missing_indexes(inspector, 'comment', [
+        ('ix_comment_timestamp', ['timestamp'], False),
+    ])
+
+    if 'post_like' not in tables:
+        op.create_table('post_like',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('post_id', sa.Integer(), nullable=True),
+        sa.Column('photo_id', sa.Integer(), nullable=True),
+        sa.Column('video_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['photo_id'], ['photo.id'], ),
+        sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['video_id'], ['video.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('post_like')
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_comment_timestamp'))
+
+    op.drop_table('comment')
+    with op.batch_alter_table('video', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_video_title'))
+        batch_op.drop_index(batch_op.f('ix_video_timestamp'))
+        batch_op.drop_index(batch_op.f('ix_video_filename'))
+
+    op.drop_table('video')
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_photo_title'))
+        batch_op.drop_index(batch_op.f('ix_photo_timestamp'))
+        batch_op.drop_index(batch_op.f('ix_photo_is_public'))
+        batch_op.drop_index(batch_op.f('ix_photo_filename'))
+
+    op.drop_table('photo')
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_post_timestamp'))
+        batch_op.drop_index(batch_op.f('ix_post_is_public'))
+        batch_op.drop_index(batch_op.f('ix_post_is_discussion'))
+        batch_op.drop_index(batch_op.f('ix_post_body'))
+
+    op.drop_table('post')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_verified'))
+        batch_op.drop_index(batch_op.f('ix_user_username'))
+        batch_op.drop_index(batch_op.f('ix_user_profile_picture'))
+        batch_op.drop_index(batch_op.f('ix_user_email'))
+
+    op.drop_table('user')
+    # ### end Alembic commands ###
@@ -0,0 +1,54 @@
+"""full-text search index
+
+Revision ID: fe4e5d00d9be
+Revises: beeb0059c7f9
+Create Date: 2026-10-18 18:51:29.860895
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fe4e5d00d9be'
+down_revision = 'beeb0059c7f9'
+branch_labels = None
+depends_on = None
+
+
+# table: indexed column; mirrors app.search.SOURCES
+SOURCES = {
+    'post': 'body',
+    'photo': 'title',
+    'video': 'title',
+    'comment': 'body',
+    'user': 'username',
+}
+
+
+def upgrade():
+    for table, col in SOURCES.items():
+        fts = table + '_fts'
+        op.execute(
+            "CREATE VIRTUAL TABLE {fts} USING fts5({col}, content='{t}', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')".format(fts=fts, t=table, col=col))
+        op.execute(
+            'CREATE TRIGGER {fts}_ai AFTER INSERT ON "{t}" BEGIN '
+            'INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END'.format(fts=fts, t=table, col=col))
+        op.execute(
+            'CREATE TRIGGER {fts}_ad AFTER DELETE ON "{t}" BEGIN '
+            "INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); END".format(
+                fts=fts, t=table, col=col))
+        op.execute(
+            'CREATE TRIGGER {fts}_au AFTER UPDATE OF {col} ON "{t}" BEGIN '
+            "INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); "
+            'INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END'.format(fts=fts, t=table, col=col))
+        op.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(fts))
+
+
+def downgrade():
+    for table in SOURCES:
+        fts = table + '_fts'
+        for suffix in ('ai', 'ad', 'au'):
+            op.execute('DROP TRIGGER IF EXISTS {}_{}'.format(fts, suffix))
+        op.execute('DROP TABLE IF EXISTS {}'.format(fts))
@@ -0,0 +1,55 @@
+import itertools
+import os
+import shutil
+import pytest
+from config import Config, basedir
+from app import create_app, db, register_commands
+from app.models import User
+
+_usernames = ('user{}'.format(n) for n in itertools.count(1))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    # one app and database for the run, as in a worker process; each test makes its own rows
+    root = tmp_path_factory.mktemp('goup')
+    uploads = os.path.join(str(root), 'uploads')
+    shutil.copytree(os.path.join(basedir, 'app', 'static', 'uploads', 'images', 'defaults'),
+                    os.path.join(uploads, 'images', 'defaults'))
+
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(str(root), 'test.db')
+        UPLOADS_DEFAULT_DEST = uploads
+        JINJA_BYTECODE_CACHE_DIR = None
+        MAIL_SERVER = None
+
+    app = create_app(TestConfig)
+    register_commands(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def user(app):
+    """A verified user of its own for each test; the password is "pw"."""
+    with app.app_context():
+        user = User(username=next(_usernames), verified=1, profile_picture='defaults/default.jpg')
+        user.email = '{}@example.com'.format(user.username)
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.commit()
+        db.session.refresh(user)
+        db.session.expunge(user)
+    return user
+
+
+@pytest.fixture
+def client(app, user):
+    """A test client logged in as `user`."""
+    client = app.test_client()
+    response = client.post('/login', data={'username': user.username, 'password': 'pw', 'submit': 'Sign In'})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,77 @@
+import pytest
+from app import db
+from app.cli import recount
+from app.models import Post, Photo, Video, PostLike, Comment
+
+# collection in the URLs, model, foreign key column name on post_like and comment
+KINDS = [('posts', Post, 'post_id'), ('photos', Photo, 'photo_id'), ('videos', Video, 'video_id')]
+
+
+def add_item(user, model):
+    post = Post(body='counted', user_id=user.id, is_discussion=1)
+    if model is Post:
+        item = post
+    elif model is Photo:
+        item = Photo(title='counted', filename='defaults/default.jpg', is_public=1, post=post)
+    else:
+        item = Video(title='counted', filename='counted.mp4', post=post)
+    db.session.add(item)
+    db.session.commit()
+    return item.id
+
+
+def counters(model, fk, id):
+    item = model.query.get(id)
+    actual = (PostLike.query.filter(getattr(PostLike, fk) == id).count(),
+              Comment.query.filter(getattr(Comment, fk) == id).count())
+    return (item.like_count, item.comment_count), actual
+
+
+@pytest.mark.parametrize('collection,model,fk', KINDS)
+def test_counters_match_the_rows(app, user, client, collection, model, fk):
+    with app.app_context():
+        id = add_item(user, model)
+    like = '/like-{}/{}/'.format(fk[:-3], id)
+    api = '/api/v1/{}/{}/'.format(collection, id)
+    for _ in range(2):
+        client.get(like + 'like', headers={'Referer': '/'})
+    assert client.post(api + 'like').get_json()['like_count'] == 1
+    for _ in range(2):
+        assert client.delete(api + 'like').get_json()['like_count'] == 0
+    client.get(like + 'unlike', headers={'Referer': '/'})
+    client.get(like + 'like', headers={'Referer': '/'})
+    for body in ('first', 'second'):
+        assert client.post(api + 'comments', json={'body': body}).status_code == 201
+    with app.app_context():
+        comment = Comment.query.filter(getattr(Comment, fk) == id).first().id
+    client.get('/delete-comment/{}'.format(comment), headers={'Referer': '/'})
+    with app.app_context():
+        stored, actual = counters(model, fk, id)
+        assert stored == actual == (1, 1)
+
+
+@pytest.mark.parametrize('collection,model,fk', KINDS)
+def test_a_like_that_lost_the_race_changes_nothing(app, user, collection, model, fk):
+    with app.app_context():
+        id = add_item(user, model)
+        # the other request's row lands between this one's check and its insert
+        db.session.add(PostLike(user_id=user.id, **{fk: id}))
+        db.session.commit()
+        liker, item = db.session.merge(user), model.query.get(id)
+        getattr(liker, 'like_' + fk[:-3])(item)
+        db.session.commit()
+        stored, actual = counters(model, fk, id)
+        assert stored == (0, 0) and actual == (1, 0)
+
+
+def test_recount_repairs_drifted_counters(app, user):
+    with app.app_context():
+        id = add_item(user, Post)
+        db.session.add(PostLike(user_id=user.id, post_id=id))
+        Post.query.filter_by(id=id).update({'like_count': 7, 'comment_count': 3})
+        db.session.commit()
+    result = app.test_cli_runner().invoke(recount)
+    assert result.exit_code == 0
+    with app.app_context():
+        stored, actual = counters(Post, 'post_id', id)
+        assert stored == actual == (1, 0)
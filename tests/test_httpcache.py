@@ -0,0 +1,74 @@
+import pytest
+from app import db, derivatives
+from app.models import Photo, Post, User, Video
+
+
+def etag_of(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+@pytest.mark.parametrize('url', ['/discussion', '/photos', '/videos', '/members'])
+def test_an_unchanged_page_is_a_304(client, url):
+    client.get(url)  # shows, and so clears, anything flashed at login
+    etag = etag_of(client, url)
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+
+def test_a_like_or_a_new_post_changes_the_etag(app, user, client):
+    with app.app_context():
+        post = Post(body='cached', user_id=user.id, is_discussion=1)
+        db.session.add(post)
+        db.session.commit()
+        id = post.id
+    client.get('/discussion')
+    etag = etag_of(client, '/discussion')
+
+    client.get('/like-post/{}/like'.format(id), headers={'Referer': '/discussion'})
+    client.get('/discussion')  # clears the flash
+    assert client.get('/discussion', headers={'If-None-Match': etag}).status_code == 200
+    etag = etag_of(client, '/discussion')
+
+    with app.app_context():
+        db.session.add(Post(body='newer', user_id=user.id, is_discussion=1))
+        db.session.commit()
+    assert client.get('/discussion', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_etags_differ_per_user_and_page(app, client):
+    with app.app_context():
+        other = User(username='etag-other', email='etag-other@example.com', verified=1,
+                     profile_picture='defaults/default.jpg')
+        other.set_password('pw')
+        db.session.add(other)
+        db.session.commit()
+    other = app.test_client()
+    other.post('/login', data={'username': 'etag-other', 'password': 'pw', 'submit': 'Sign In'})
+    other.get('/discussion')
+    client.get('/discussion')
+    assert etag_of(other, '/discussion') != etag_of(client, '/discussion')
+    assert etag_of(client, '/discussion?before=2000-01-01T00:00:00_1') != etag_of(client, '/discussion')
+
+
+@pytest.mark.parametrize('url', ['/discussion', '/photos', '/videos'])
+def test_the_etag_changes_once_an_avatar_is_resized(app, user, client, monkeypatch, url):
+    # the author's avatar turns from the original into a srcset of resized copies
+    with app.app_context():
+        post = Post(body='avatar', user_id=user.id, is_discussion=1)
+        db.session.add(post)
+        db.session.flush()
+        db.session.add(Photo(filename='etag-photo.jpg', post_id=post.id, is_public=1))
+        db.session.add(Video(filename='etag-clip.mp4', post_id=post.id))
+        db.session.commit()
+    ready = set()
+    monkeypatch.setattr(derivatives, 'is_ready', lambda filename: filename in ready)
+    client.get(url)
+    etag = etag_of(client, url)
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    ready.add(user.profile_picture)
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 200
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+from app import db
+from app.models import Post
+from app.pagination import paginate_keyset, encode_cursor
+
+KEY = (Post.timestamp, Post.id)
+
+
+def add_posts(user, count):
+    # in pairs sharing a timestamp, so the id has to break the ties
+    start = datetime(2020, 1, 1)
+    posts = [Post(body='post {}'.format(n), user_id=user.id, is_discussion=1,
+                  timestamp=start + timedelta(minutes=n // 2)) for n in range(count)]
+    db.session.add_all(posts)
+    db.session.commit()
+    return sorted(((post.timestamp, post.id) for post in posts), reverse=True)
+
+
+def page(app, user, **args):
+    with app.test_request_context('/', query_string=args):
+        return paginate_keyset(Post.query.filter(Post.user_id == user.id), KEY, per_page=3)
+
+
+def keys(page):
+    return [(post.timestamp, post.id) for post in page]
+
+
+def test_older_pages_cover_every_row_once(app, user):
+    with app.app_context():
+        expected = add_posts(user, 8)
+        seen, current = [], page(app, user)
+        assert current.newer is None
+        while True:
+            seen += keys(current)
+            if current.older is None:
+                break
+            current = page(app, user, before=current.older)
+            assert current.newer is not None
+        assert seen == expected
+        assert len(current) == 2
+
+
+def test_newer_pages_retrace_older_ones(app, user):
+    with app.app_context():
+        add_posts(user, 8)
+        first = page(app, user)
+        second = page(app, user, before=first.older)
+        assert keys(page(app, user, after=second.newer)) == keys(first)
+        assert page(app, user, after=second.newer).newer is None
+
+
+def test_rows_added_meanwhile_do_not_shift_the_next_page(app, user):
+    with app.app_context():
+        expected = add_posts(user, 6)
+        first = page(app, user)
+        db.session.add(Post(body='new', user_id=user.id, is_discussion=1, timestamp=datetime(2021, 1, 1)))
+        db.session.commit()
+        assert keys(page(app, user, before=first.older)) == expected[3:]
+
+
+def test_a_bad_cursor_gives_the_first_page(app, user):
+    with app.app_context():
+        expected = add_posts(user, 4)
+        for cursor in ('nonsense', 'not-a-date_1', encode_cursor([datetime(2020, 1, 1)])):
+            assert keys(page(app, user, before=cursor)) == expected[:3]
@@ -0,0 +1,102 @@
+import io
+import os
+import struct
+import pytest
+from app import clips, resumable
+from app.models import Video, VideoUpload
+from app.resumable import UploadError
+
+
+def atom(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def sample_mp4():
+    # moov after mdat, as cameras write it; stored, it is moved to the front
+    ftyp = atom(b'ftyp', b'isom\0\0\0\x01isomavc1')
+    stco = atom(b'stco', struct.pack('>4sII', b'\0' * 4, 1, len(ftyp) + 8))
+    moov = atom(b'moov', atom(b'trak', atom(b'mdia', atom(b'minf', atom(b'stbl', stco)))))
+    return ftyp + atom(b'mdat', os.urandom(10000)) + moov
+
+
+class DroppedConnection(io.RawIOBase):
+    """A request body that breaks off after `data`."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.data:
+            raise IOError('connection reset')
+        buffer[:len(self.data)] = self.data
+        read, self.data = len(self.data), b''
+        return read
+
+
+@pytest.fixture
+def small_chunks(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'RESUMABLE_UPLOAD_CHUNK_SIZE', 4096)
+
+
+def start(client, size):
+    response = client.post('/videos/uploads', json={'title': 'big clip', 'filename': 'clip.mp4', 'size': size})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def put(client, url, data, offset):
+    return client.put(url, data=data, headers={'Upload-Offset': str(offset)})
+
+
+def test_offsets_are_acknowledged_and_enforced(client, small_chunks):
+    data = sample_mp4()
+    url = start(client, len(data))['url']
+    assert client.get(url).get_json()['offset'] == 0
+
+    response = put(client, url, data[:3000], 0)
+    assert response.status_code == 200
+    assert response.get_json()['offset'] == 3000 and response.headers['Upload-Offset'] == '3000'
+
+    # a retried chunk that already arrived is refused with the offset to carry on from
+    response = put(client, url, data[:3000], 0)
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '3000'
+    assert client.get(url).get_json()['offset'] == 3000
+
+    assert put(client, url, data[3000:9000], 3000).status_code == 413
+    assert client.post(url + '/finish').status_code == 409
+
+
+def test_an_interrupted_chunk_keeps_what_arrived(app, client, small_chunks):
+    data = sample_mp4()
+    upload = start(client, len(data))
+    put(client, upload['url'], data[:3000], 0)
+    with app.test_request_context():
+        with pytest.raises(IOError):
+            resumable.write(VideoUpload.query.get(upload['id']), 3000, DroppedConnection(data[3000:4000]))
+    offset = client.get(upload['url']).get_json()['offset']
+    assert offset == 4000
+
+    while offset < len(data):
+        offset = put(client, upload['url'], data[offset:offset + 4096], offset).get_json()['offset']
+    response = client.post(upload['url'] + '/finish')
+    assert response.status_code == 201
+    with app.app_context():
+        video = Video.query.get(response.get_json()['id'])
+        with open(clips.path(video.filename), 'rb') as f:
+            stored = f.read()
+        assert len(stored) == len(data)
+        assert stored.index(b'moov') < stored.index(b'mdat')
+        assert VideoUpload.query.get(upload['id']) is None
+    assert client.get(upload['url']).status_code == 404
+
+
+def test_a_write_at_the_wrong_offset_raises(app, client):
+    upload = start(client, 10)
+    with app.test_request_context():
+        with pytest.raises(UploadError) as error:
+            resumable.write(VideoUpload.query.get(upload['id']), 5, io.BytesIO(b'12345'))
+    assert error.value.status == 409 and error.value.offset == 0
@@ -0,0 +1,60 @@
+from app import db, search_index
+from app.models import Post, Photo, Comment
+
+
+def found(kind, q):
+    return [item.id for item, _ in search_index.query(kind, q)]
+
+
+def test_inserts_updates_and_deletes_reach_the_index(app, user):
+    with app.app_context():
+        post = Post(body='quokka sighting', user_id=user.id, is_discussion=1)
+        db.session.add(post)
+        db.session.commit()
+        assert found('posts', 'quokka') == [post.id]
+        assert found('posts', 'quok') == [post.id]  # the last word matches as a prefix
+
+        post.body = 'wombat sighting'
+        db.session.commit()
+        assert found('posts', 'quokka') == []
+        assert found('posts', 'wombat') == [post.id]
+
+        db.session.delete(post)
+        db.session.commit()
+        assert found('posts', 'wombat') == []
+
+
+def test_cascaded_deletes_leave_the_index(app, user):
+    with app.app_context():
+        photo = Photo(title='pangolin portrait', filename='defaults/default.jpg', is_public=1,
+                      post=Post(body='holder', user_id=user.id))
+        db.session.add(photo)
+        db.session.flush()
+        db.session.add(Comment(body='pangolin praise', user_id=user.id, photo_id=photo.id))
+        db.session.commit()
+        assert found('photos', 'pangolin') == [photo.id]
+        assert len(found('comments', 'pangolin')) == 1
+
+        # the post's delete cascades in the database, past the session
+        db.session.execute(Post.__table__.delete().where(Post.id == photo.post_id))
+        db.session.commit()
+        assert found('photos', 'pangolin') == []
+        assert found('comments', 'pangolin') == []
+
+
+def test_only_visible_rows_are_found(app, user):
+    with app.app_context():
+        db.session.add(Post(body='narwhal notes', user_id=user.id, is_discussion=0))
+        db.session.add(Photo(title='narwhal private', filename='defaults/default.jpg', is_public=0,
+                             post=Post(body='holder', user_id=user.id)))
+        db.session.commit()
+        assert found('posts', 'narwhal') == []
+        assert found('photos', 'narwhal') == []
+
+
+def test_search_page_highlights_matches(client, app, user):
+    with app.app_context():
+        db.session.add(Post(body='axolotl <b>facts</b>', user_id=user.id, is_discussion=1))
+        db.session.commit()
+    html = client.get('/search', query_string={'q': 'axolotl', 'type': 'posts'}).get_data(as_text=True)
+    assert '<mark>axolotl</mark> &lt;b&gt;facts&lt;/b&gt;' in html
@@ -0,0 +1,95 @@
+import random
+from datetime import datetime, timedelta
+import pytest
+from app import db, usernames
+from app.models import User
+from app.typeahead import PrefixIndex
+
+WORDS = ['al', 'Alex', 'alice', 'bob', 'Bo', 'carl', 'ALI', 'zed', 'ann', 'anna']
+PREFIXES = ['a', 'al', 'AL', 'ali', 'alex1', 'b', 'z', 'q', 'anna12', 'ren', 'bo_new']
+
+
+def brute_force(rows, prefix, limit):
+    matches = sorted(((seen, id, name) for id, name, seen in rows if name.lower().startswith(prefix.lower())),
+                     reverse=True)
+    return [(id, name) for _, id, name in matches[:limit]]
+
+
+@pytest.fixture
+def rows():
+    # in the order the build query streams them
+    rnd = random.Random(1)
+    rows = [(n, '{}{}'.format(rnd.choice(WORDS), n), rnd.randint(1, 10**6)) for n in range(1, 5001)]
+    return sorted(rows, key=lambda row: (row[1].lower(), row[0]))
+
+
+def test_lookups_match_a_scan(rows):
+    # a small scan limit, so the short prefixes are served from their kept lists
+    index = PrefixIndex(rows, size=5, scan_limit=50)
+    assert index.top
+    for prefix in PREFIXES:
+        for limit in (5, 12):
+            assert index.search(prefix, limit) == brute_force(rows, prefix, limit), prefix
+    assert index.search('', 5) == []
+
+
+def test_rows_out_of_order_are_still_found():
+    # SQLite's lower() leaves É as it is, so 'Ézra' is streamed before 'éa'
+    rows = [(1, 'eve', 30), (2, 'Ézra', 10), (3, 'éa', 20), (4, 'Éb', 40)]
+    index = PrefixIndex(rows, size=2, scan_limit=1)
+    assert len(index) == 4
+    for prefix in ('e', 'é', 'éz', 'ÉA', 'x'):
+        assert index.search(prefix, 3) == brute_force(rows, prefix, 3), prefix
+
+
+def test_touches_additions_removals_and_renames(rows):
+    rnd = random.Random(2)
+    index = PrefixIndex(rows, size=5, scan_limit=50)
+    rows = [list(row) for row in rows]
+    for _ in range(2000):
+        row = rnd.choice(rows)
+        row[2] += rnd.randint(1, 10**6)
+        index.touch(row[0], row[1], row[2])
+    for n in range(300):
+        row = [10000 + n, '{}_new{}'.format(rnd.choice(WORDS), n), rnd.randint(1, 3 * 10**6)]
+        rows.append(row)
+        index.add(*row)
+    for _ in range(300):
+        row = rows.pop(rnd.randrange(len(rows)))
+        index.remove(row[0], row[1])
+    for n in range(200):
+        row = rnd.choice(rows)
+        index.remove(row[0], row[1])
+        row[1] = 'renamed{}'.format(n)
+        index.add(*row)
+    rows = [tuple(row) for row in rows]
+    assert len(index) == len(rows)
+    for prefix in PREFIXES:
+        for limit in (5, 7):
+            assert index.search(prefix, limit) == brute_force(rows, prefix, limit), prefix
+
+
+def test_api_lists_verified_users_most_recently_seen_first(app, client):
+    now = datetime.utcnow()
+    with app.app_context():
+        users = []
+        for n, name in enumerate(['Tyalan', 'tyalbert', 'TYALFRED', 'tyalpha']):
+            user = User(username=name, email='{}@example.com'.format(name), verified=0 if name == 'tyalpha' else 1,
+                        last_seen=now - timedelta(days=n + 1))
+            users.append(user)
+        db.session.add_all(users)
+        db.session.commit()
+        for user in users:
+            usernames.update(user)
+    found = client.get('/api/v1/usernames?prefix=@tyal').get_json()['data']
+    assert [user['username'] for user in found] == ['Tyalan', 'tyalbert', 'TYALFRED']
+    assert client.get('/api/v1/usernames?prefix=tyal&limit=1').get_json()['data'][0]['username'] == 'Tyalan'
+
+    with app.app_context():
+        user = User.query.filter_by(username='TYALFRED').first()
+        user.username, user.last_seen = 'tyzed', now
+        db.session.commit()
+        usernames.update(user, 'TYALFRED')
+    found = client.get('/api/v1/usernames?prefix=TYAL').get_json()['data']
+    assert [user['username'] for user in found] == ['Tyalan', 'tyalbert']
+    assert client.get('/api/v1/usernames?prefix=tyz').get_json()['data'][0]['username'] == 'tyzed'